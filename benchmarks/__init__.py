@@ -0,0 +1,17 @@
+"""
+Scaling benchmarks for karaml.
+
+Generates synthetic karaml configs of a parametrized size and shape, times each
+stage of a build separately (YAML load, alias/template registration, layer
+translation and JSON serialization) and measures the peak memory of a build.
+Results are written as JSON and can be compared against a stored baseline to
+catch regressions in throughput or memory.
+
+Run from the root of the repository:
+
+```
+python -m benchmarks
+python -m benchmarks --suite scaling -o results.json
+python -m benchmarks --baseline benchmarks/baseline.json
+```
+"""
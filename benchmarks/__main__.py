@@ -0,0 +1,121 @@
+import argparse
+import sys
+from json import dumps, loads
+from pathlib import Path
+
+from benchmarks.runner import (
+    SUITES,
+    benchmark_loaders,
+    compare,
+    format_loader_results,
+    format_results,
+    run_suite,
+)
+
+BASELINE_FILE = Path(__file__).parent / "baseline.json"
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks",
+        description="Benchmark karaml builds of synthetic configs.",
+    )
+
+    parser.add_argument(
+        "--suite",
+        dest="suite",
+        help="The set of synthetic configs to benchmark. Default: default",
+        choices=list(SUITES),
+        default="default",
+    )
+
+    parser.add_argument(
+        "--repeat",
+        dest="repeat",
+        help="The number of builds per config. The best time of each stage "
+        "is kept. Default: 3",
+        type=int,
+        default=3,
+    )
+
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        help="The number of processes to translate layers with. Default: 1",
+        type=int,
+        default=1,
+    )
+
+    parser.add_argument(
+        "-o",
+        dest="output",
+        help="Write the results as JSON to this file",
+        type=Path,
+    )
+
+    parser.add_argument(
+        "--baseline",
+        dest="baseline",
+        help="Compare the results against a baseline JSON file and exit with "
+        "an error if any config regressed",
+        type=Path,
+    )
+
+    parser.add_argument(
+        "--save-baseline",
+        dest="save_baseline",
+        help=f"Save the results as the new baseline ({BASELINE_FILE.name})",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--tolerance",
+        dest="tolerance",
+        help="The allowed drop in throughput or growth in peak memory, as a "
+        "fraction of the baseline. Default: 0.2",
+        type=float,
+        default=0.2,
+    )
+
+    parser.add_argument(
+        "--loaders",
+        dest="loaders",
+        help="Only compare the parse time of the pure-Python and libyaml "
+        "YAML loaders",
+        action="store_true",
+    )
+
+    args = parser.parse_args()
+
+    if args.loaders:
+        results = {spec.name: benchmark_loaders(spec, args.repeat)
+                   for spec in SUITES[args.suite]}
+        print(format_loader_results(results))
+        if args.output:
+            args.output.write_text(dumps(results, indent=4))
+            print(f"\nWrote results to {args.output}")
+        return
+
+    baseline = loads(args.baseline.read_text()) if args.baseline else None
+    results = run_suite(SUITES[args.suite], args.repeat, args.jobs)
+    print(format_results(results, baseline))
+
+    if args.output:
+        args.output.write_text(dumps(results, indent=4))
+        print(f"\nWrote results to {args.output}")
+    if args.save_baseline:
+        BASELINE_FILE.write_text(dumps(results, indent=4))
+        print(f"\nSaved baseline to {BASELINE_FILE}")
+
+    if baseline:
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("\nRegressions against the baseline:")
+            print("\n".join(f"  - {regression}" for regression in regressions))
+            sys.exit(1)
+        print("\nNo regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""
+Times the stages of a karaml build for synthetic configs and compares the
+results against a baseline.
+
+The stages are run the same way KaramlConfig and file_writer run them, but
+timed separately, i.e. the layers are translated after the whole file is
+loaded rather than while it is loaded (see karaml_config.LayerStream):
+
+    load: reading the top-level items of the YAML file with iter_top_level
+    register: registering the user templates and aliases
+    gen_layers: translating every layer
+    serialize: encoding the complex modifications JSON (in memory)
+
+`benchmark_loaders` times the load stage alone with each YAML loader, i.e. the
+pure-Python loader and the libyaml one (if PyYAML was built with it), which
+is the one builds use.
+"""
+
+import tracemalloc
+from dataclasses import asdict
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from benchmarks.synthetic import SyntheticSpec, generate_config
+from karaml.compile_context import CompileContext
+from karaml.helpers import PyUniqueKeyLoader, UniqueKeyLoader
+from karaml.json_writer import iter_json
+from karaml.karaml_config import count_rules, translate_layers
+from karaml.templates import update_user_templates
+from karaml.user_aliases import update_user_aliases
+from karaml.yaml_stream import iter_top_level
+
+STAGES = ["load", "register", "gen_layers", "serialize"]
+
+LOADERS = {"python": PyUniqueKeyLoader}
+if UniqueKeyLoader is not PyUniqueKeyLoader:
+    LOADERS["libyaml"] = UniqueKeyLoader
+
+# Named sets of specs. `default` varies one dimension at a time around a
+# medium-sized config, `scaling` grows the config to show how karaml scales
+SUITES = {
+    "smoke": [
+        SyntheticSpec("smoke", layers=2, maps_per_layer=10),
+    ],
+    "default": [
+        SyntheticSpec("medium"),
+        SyntheticSpec("templates", template_share=0.5),
+        SyntheticSpec("app_conditions", app_condition_share=0.4),
+        SyntheticSpec("simultaneous", simultaneous_share=0.6),
+        SyntheticSpec("modded", modded_share=0.9),
+        SyntheticSpec("aliases", aliases=200, alias_share=0.5),
+    ],
+    "scaling": [
+        SyntheticSpec(f"layers_{n}", layers=n) for n in (4, 16, 64)
+    ] + [
+        SyntheticSpec(f"maps_{n}", maps_per_layer=n) for n in (25, 100, 400)
+    ],
+}
+
+
+def load_config(config_file: str, loader=UniqueKeyLoader) -> dict:
+    """
+    Loads a karaml config item by item, as KaramlConfig does, and returns
+    its top-level items.
+    """
+    with open(config_file) as f:
+        yaml_loader = loader(f)
+        try:
+            return dict(iter_top_level(yaml_loader))
+        finally:
+            yaml_loader.dispose()
+
+
+def run_stages(config_file: str, hold_flavor: str = "to",
+               jobs: int = 1) -> dict:
+    """
+    Builds a karaml config and returns the wall time of each stage in
+    seconds, as well as the number of mappings in the config.
+    """
+    times = {}
+    # Each run compiles with its own aliases and templates
+    with CompileContext().activate():
+        start = perf_counter()
+        yaml_data = load_config(config_file)
+        times["load"] = perf_counter() - start
+
+        start = perf_counter()
+        for key in ["profile_name", "title", "parameters", "json"]:
+            yaml_data.pop(key, None)
+        user_sections = {"aliases": yaml_data.get("aliases"),
+                         "templates": yaml_data.get("templates")}
+        update_user_templates(yaml_data)
+        update_user_aliases(yaml_data)
+        times["register"] = perf_counter() - start
+
+        start = perf_counter()
+        layers = translate_layers(
+            list(yaml_data.items()), hold_flavor, jobs, user_sections)
+        layers.reverse()
+        times["gen_layers"] = perf_counter() - start
+
+        start = perf_counter()
+        # Encoded in memory, since write_json would replace a file
+        "".join(iter_json({"title": "Karaml Benchmark", "rules": layers}))
+        times["serialize"] = perf_counter() - start
+
+    return {"mappings": count_rules(yaml_data), "stages": times}
+
+
+def peak_memory(config_file: str, hold_flavor: str = "to") -> int:
+    """
+    Returns the peak memory in bytes allocated while building a karaml
+    config. Measured in a separate run, since tracing slows the build down.
+    """
+    tracemalloc.start()
+    try:
+        run_stages(config_file, hold_flavor)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def benchmark_spec(spec: SyntheticSpec, repeat: int = 3,
+                   jobs: int = 1) -> dict:
+    """
+    Benchmarks a synthetic config. Each stage's time is the best of `repeat`
+    builds, which is the least noisy estimate of its cost.
+    """
+    with TemporaryDirectory() as tmp_dir:
+        config_file = Path(tmp_dir) / f"{spec.name}.yaml"
+        config_file.write_text(generate_config(spec))
+
+        runs = [run_stages(str(config_file), jobs=jobs)
+                for _ in range(repeat)]
+        memory = peak_memory(str(config_file))
+
+    stages = {
+        stage: min(run["stages"][stage] for run in runs) for stage in STAGES
+    }
+    total = sum(stages.values())
+    mappings = runs[0]["mappings"]
+    return {
+        "spec": asdict(spec),
+        "mappings": mappings,
+        "stages": stages,
+        "total": total,
+        "mappings_per_second": mappings / total if total else 0.0,
+        "peak_memory_bytes": memory,
+    }
+
+
+def run_suite(specs: list[SyntheticSpec], repeat: int = 3,
+              jobs: int = 1) -> dict:
+    """
+    Benchmarks every spec of a suite. Returns a dict of results by spec name.
+    """
+    return {spec.name: benchmark_spec(spec, repeat, jobs) for spec in specs}
+
+
+def benchmark_loaders(spec: SyntheticSpec, repeat: int = 3) -> dict:
+    """
+    Returns the best time of `repeat` loads of a synthetic config with each
+    of the LOADERS, in seconds.
+    """
+    with TemporaryDirectory() as tmp_dir:
+        config_file = Path(tmp_dir) / f"{spec.name}.yaml"
+        config_file.write_text(generate_config(spec))
+        loaders = {}
+        for name, loader in LOADERS.items():
+            times = []
+            for _ in range(repeat):
+                start = perf_counter()
+                load_config(str(config_file), loader)
+                times.append(perf_counter() - start)
+            loaders[name] = min(times)
+    return {"mappings": spec.mappings, "loaders": loaders}
+
+
+def format_loader_results(results: dict) -> str:
+    """
+    Returns a table of the load times of each loader, with the speedup of
+    each loader over the pure-Python one.
+    """
+    header = f"{'spec':<16}{'maps':>7}" + "".join(
+        f"{name + ' ms':>14}" for name in LOADERS)
+    header += f"{'speedup':>9}" if len(LOADERS) > 1 else ""
+    rows = [header]
+    for name, result in results.items():
+        times = result["loaders"]
+        row = f"{name:<16}{result['mappings']:>7}" + "".join(
+            f"{times[loader] * 1000:>14.1f}" for loader in LOADERS)
+        if len(LOADERS) > 1:
+            row += f"{times['python'] / min(times.values()):>8.1f}x"
+        rows.append(row)
+    return "\n".join(rows)
+
+
+def compare(results: dict, baseline: dict, tolerance: float = 0.2) -> list:
+    """
+    Compares benchmark results against a baseline. Returns a list of messages
+    for every spec whose throughput dropped, or whose peak memory grew, by
+    more than the tolerance (a fraction of the baseline). Specs missing from
+    either side are skipped.
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        throughput = result["mappings_per_second"]
+        base_throughput = base["mappings_per_second"]
+        if throughput < base_throughput * (1 - tolerance):
+            regressions.append(
+                f"{name}: throughput {throughput:.0f} mappings/s, "
+                f"baseline {base_throughput:.0f} mappings/s")
+        memory = result["peak_memory_bytes"]
+        base_memory = base["peak_memory_bytes"]
+        if memory > base_memory * (1 + tolerance):
+            regressions.append(
+                f"{name}: peak memory {memory / 1e6:.1f} MB, "
+                f"baseline {base_memory / 1e6:.1f} MB")
+    return regressions
+
+
+def format_results(results: dict, baseline: dict | None = None) -> str:
+    """
+    Returns a table of the results, with the change in throughput against
+    the baseline if one is given.
+    """
+    header = (f"{'spec':<16}{'maps':>7}" +
+              "".join(f"{stage + ' ms':>14}" for stage in STAGES) +
+              f"{'maps/s':>10}{'peak MB':>9}")
+    if baseline:
+        header += f"{'vs base':>9}"
+    rows = [header]
+    for name, result in results.items():
+        row = f"{name:<16}{result['mappings']:>7}"
+        row += "".join(
+            f"{result['stages'][stage] * 1000:>14.1f}" for stage in STAGES)
+        row += f"{result['mappings_per_second']:>10.0f}"
+        row += f"{result['peak_memory_bytes'] / 1e6:>9.1f}"
+        if baseline and name in baseline:
+            base = baseline[name]["mappings_per_second"]
+            change = (result["mappings_per_second"] / base - 1) * 100
+            row += f"{change:>+8.1f}%"
+        rows.append(row)
+    return "\n".join(rows)
@@ -0,0 +1,173 @@
+"""
+Generates synthetic karaml configs from a SyntheticSpec.
+
+Every generated config is deterministic for a given spec (including its seed),
+so the same spec always benchmarks the same config. From-keys are drawn
+without replacement from pools of plain, modded and simultaneous keys, so a
+layer never has duplicate keys (which would prompt the user).
+"""
+
+from dataclasses import dataclass
+from itertools import combinations
+from random import Random
+
+KEYS = list("abcdefghijklmnopqrstuvwxyz0123456789")
+MOD_SETS = ["c", "o", "s", "m", "co", "cs", "cm", "os", "om", "sm", "cos",
+            "com", "csm", "osm", "cosm", "x"]
+TO_KEYS = ["escape", "tab", "return_or_enter", "left_arrow", "right_arrow",
+           "up_arrow", "down_arrow", "delete_or_backspace", "spacebar"]
+TEMPLATE_CALLS = [
+    "app(Safari)",
+    "open(https://github.com)",
+    "shell(echo karaml)",
+    "notify(idx, Hello from karaml)",
+    "string(karaml)",
+    "var(bench_var, 1)",
+    "mouse(x, 1600)",
+]
+APP_CONDITIONS = ["if Safari$", "unless Terminal$ iterm2$ kitty$",
+                  "if Firefox$ Chrome$"]
+ALIAS_TARGETS = ["return_or_enter", "left_arrow", "o | left_arrow",
+                 "c s | tab", "shell(echo alias)"]
+
+
+@dataclass
+class SyntheticSpec:
+    """
+    The size and shape of a synthetic karaml config.
+
+    Attributes:
+        name: A name for the spec, used to label the results.
+        layers: The number of layers, including the /base/ layer.
+        maps_per_layer: The number of mappings in each layer.
+        template_share: The share of mappings that send a template.
+        app_condition_share: The share of mappings with frontmost app
+            conditions.
+        simultaneous_share: The share of from-keys that are simultaneous keys.
+        modded_share: The share of from-keys and to-keys with modifiers.
+        aliases: The number of user-defined aliases.
+        alias_share: The share of mappings that send a user-defined alias.
+        layer_toggle_share: The share of mappings that toggle a layer when
+            held.
+        seed: The seed for the random choices.
+    """
+    name: str
+    layers: int = 8
+    maps_per_layer: int = 50
+    template_share: float = 0.1
+    app_condition_share: float = 0.05
+    simultaneous_share: float = 0.1
+    modded_share: float = 0.5
+    aliases: int = 10
+    alias_share: float = 0.1
+    layer_toggle_share: float = 0.02
+    seed: int = 0
+
+    @property
+    def mappings(self) -> int:
+        return self.layers * self.maps_per_layer
+
+
+def quote_digits(key: str) -> str:
+    """
+    Quotes a key that YAML would otherwise load as an int, e.g. `1`.
+    """
+    return f"'{key}'" if key.isdigit() else key
+
+
+def layer_names(spec: SyntheticSpec) -> list[str]:
+    """
+    Returns the names of the layers of the config, `/base/` first.
+    """
+    return ["/base/"] + [f"/layer{i}/" for i in range(1, spec.layers)]
+
+
+def from_key_pools(rng: Random) -> tuple[list, list, list]:
+    """
+    Returns shuffled pools of plain, modded and simultaneous from-keys.
+    """
+    plain = [quote_digits(key) for key in KEYS]
+    modded = [f"<{mods}-{key}>" for mods in MOD_SETS for key in KEYS]
+    simultaneous = [f"{a}+{b}" for a, b in combinations(KEYS, 2)]
+    for pool in plain, modded, simultaneous:
+        rng.shuffle(pool)
+    return plain, modded, simultaneous
+
+
+def draw_from_key(rng: Random, spec: SyntheticSpec, pools: tuple) -> str:
+    """
+    Draws a from-key that hasn't been used in the layer yet, preferring the
+    kind of key picked by the spec's shares and falling back to any other
+    kind once a pool runs out.
+    """
+    plain, modded, simultaneous = pools
+    roll = rng.random()
+    if roll < spec.simultaneous_share:
+        preferred = [simultaneous, modded, plain]
+    elif roll < spec.simultaneous_share + spec.modded_share:
+        preferred = [modded, simultaneous, plain]
+    else:
+        preferred = [plain, modded, simultaneous]
+    for pool in preferred:
+        if pool:
+            return pool.pop()
+    raise ValueError(f"maps_per_layer is too large: {spec.maps_per_layer}")
+
+
+def to_key(rng: Random, spec: SyntheticSpec) -> str:
+    """
+    Returns a to-key, with modifiers for the spec's share of modded keys.
+    """
+    key = rng.choice(TO_KEYS + KEYS)
+    if rng.random() < spec.modded_share:
+        return f"<{rng.choice(MOD_SETS[:-1])}-{key}>"
+    return quote_digits(key)
+
+
+def rhs(rng: Random, spec: SyntheticSpec, layers: list[str]) -> str:
+    """
+    Returns the YAML for the right-hand side of a mapping.
+    """
+    roll = rng.random()
+    if roll < spec.app_condition_share:
+        conditions = rng.sample(APP_CONDITIONS, 2)
+        return "{ " + ", ".join(
+            f"{condition}: {to_key(rng, spec)}" for condition in conditions
+        ) + " }"
+    roll -= spec.app_condition_share
+    if roll < spec.layer_toggle_share:
+        return f"[{to_key(rng, spec)}, {rng.choice(layers)}]"
+    roll -= spec.layer_toggle_share
+    if roll < spec.template_share:
+        return rng.choice(TEMPLATE_CALLS)
+    roll -= spec.template_share
+    if roll < spec.alias_share and spec.aliases:
+        return f"alias{rng.randrange(spec.aliases)}"
+    return to_key(rng, spec)
+
+
+def generate_config(spec: SyntheticSpec) -> str:
+    """
+    Returns the YAML text of a synthetic karaml config for the spec.
+    """
+    rng = Random(spec.seed)
+    layers = layer_names(spec)
+
+    lines = [f"profile_name: Karaml Benchmark {spec.name}",
+             f"title: Karaml Benchmark {spec.name}", ""]
+    if spec.aliases:
+        lines.append("aliases:")
+        lines += [
+            f"  alias{i}: {ALIAS_TARGETS[i % len(ALIAS_TARGETS)]}"
+            for i in range(spec.aliases)
+        ]
+        lines.append("")
+
+    for layer in layers:
+        lines.append(f"{layer}:")
+        pools = from_key_pools(rng)
+        for _ in range(spec.maps_per_layer):
+            from_key = draw_from_key(rng, spec, pools)
+            lines.append(f"  {from_key}: {rhs(rng, spec, layers)}")
+        lines.append("")
+    return "\n".join(lines)
@@ -1,12 +1,238 @@
 import argparse
+import sys
+from os import cpu_count
+from pathlib import Path
+from time import perf_counter
 
 import karaml.cfg
-from karaml.file_writer import update_karabiner_json, write_complex_mods_json
+from karaml.backups import list_backups, restore_backup
+from karaml.batch import build_configs, find_config_files, format_results
+from karaml.build_cache import BuildCache, default_cache_dir
+from karaml.file_lock import FileLockTimeout
+from karaml.file_writer import (
+    KarabinerPrefetch,
+    update_karabiner_json,
+    write_complex_mods_json,
+)
+from karaml.helpers import DUPLICATE_POLICIES
 from karaml.karaml_config import KaramlConfig
+from karaml.profiles import compact_karabiner_json
+from karaml.shards import write_complex_mods_shards
+from karaml.timings import TIMINGS
+from karaml.watcher import watch_config
+
+
+def add_lock_timeout_argument(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--lock-timeout",
+        dest="lock_timeout",
+        help="How many seconds to wait for another karaml process to finish "
+        f"updating a file. Defaults to {karaml.cfg.LOCK_TIMEOUT:g}",
+        action="store",
+        type=float,
+        default=karaml.cfg.LOCK_TIMEOUT,
+    )
+
+
+def set_lock_timeout(parser: argparse.ArgumentParser, args):
+    if args.lock_timeout < 0:
+        parser.error("--lock-timeout must be 0 or a positive number")
+    karaml.cfg.LOCK_TIMEOUT = args.lock_timeout
+
+
+def backups_main(argv: list[str]):
+    """
+    Lists the karabiner.json backups or restores one of them, reading only
+    the backup manifest.
+    """
+    parser = argparse.ArgumentParser(
+        prog="karaml backups",
+        description="List or restore the automatic karabiner.json backups")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser(
+        "list",
+        help="List the backups, newest first",
+    )
+    restore = commands.add_parser(
+        "restore",
+        help="Restore karabiner.json from a backup. The current "
+        "karabiner.json is backed up first",
+    )
+    restore.add_argument(
+        "backup",
+        help="The backup to restore: its number in `karaml backups list` "
+        "(1 is the newest), its file name or its timestamp",
+    )
+    add_lock_timeout_argument(restore)
+    args = parser.parse_args(argv)
+    karabiner_path = Path("~/.config/karabiner").expanduser()
+
+    if args.command == "list":
+        lines = list_backups(karabiner_path)
+        print("\n".join(lines) if lines else "No backups found.")
+        return
+    set_lock_timeout(parser, args)
+    try:
+        if not restore_backup(karabiner_path, args.backup):
+            sys.exit(1)
+    except FileLockTimeout as e:
+        print(e)
+        sys.exit(1)
+
+
+def profiles_main(argv: list[str]):
+    """
+    Removes the stale profiles karaml generated in karabiner.json.
+    """
+    parser = argparse.ArgumentParser(
+        prog="karaml profiles",
+        description="Clean up the profiles karaml generated in karabiner.json")
+    commands = parser.add_subparsers(dest="command", required=True)
+    compact = commands.add_parser(
+        "compact",
+        help="Remove the profiles named 'Karaml Profile TIMESTAMP' except "
+        "for the newest ones and the selected one. karabiner.json is backed "
+        "up first",
+    )
+    compact.add_argument(
+        "--keep",
+        help="The number of generated profiles to keep. Defaults to 1",
+        action="store",
+        type=int,
+        default=1,
+    )
+    compact.add_argument(
+        "--dry-run",
+        dest="dry_run",
+        help="Only report the profiles that would be removed",
+        action="store_true",
+    )
+    add_lock_timeout_argument(compact)
+    args = parser.parse_args(argv)
+    if args.keep < 0:
+        parser.error("--keep must be 0 or a positive number")
+    set_lock_timeout(parser, args)
+    karabiner_path = Path("~/.config/karabiner").expanduser()
+    try:
+        if not compact_karabiner_json(karabiner_path, args.keep, args.dry_run):
+            sys.exit(1)
+    except FileLockTimeout as e:
+        print(e)
+        sys.exit(1)
+
+
+def build_main(argv: list[str]):
+    """
+    Compiles several configs into a folder of complex modifications files
+    in one go, without prompting.
+    """
+    parser = argparse.ArgumentParser(
+        prog="karaml build",
+        description="Compile several karaml configs to complex "
+        "modifications files, one per config, without prompting")
+    parser.add_argument(
+        "config_files",
+        help="The config files to compile. A folder stands for the .yaml "
+        "and .yml files in it",
+        nargs="+",
+    )
+    parser.add_argument(
+        "-o",
+        "--output-dir",
+        dest="output_dir",
+        help="The folder to write the complex modifications files to, named "
+        "after the configs",
+        required=True,
+        type=Path,
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        help="The number of processes to compile the configs with. Defaults "
+        "to 1. Pass 0 to use one process per CPU core",
+        action="store",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "-hd",
+        dest="hold_down",
+        help="Use 'to_if_held_down' as the flavor of hold instead of 'to'",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-d",
+        dest="debug",
+        help="Report the traceback of errors in the configs",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--on-duplicate",
+        dest="on_duplicate",
+        help="What to do with keys that appear twice in the same layer (or "
+        "layers defined twice): fail the config, or keep the first or the "
+        "last value. Defaults to error",
+        choices=[policy for policy in DUPLICATE_POLICIES
+                 if policy != "prompt"],
+        default="error",
+    )
+    parser.add_argument(
+        "--no-cache",
+        dest="no_cache",
+        help="Translate every layer from scratch instead of reusing the "
+        "unchanged layers of the previous build",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        dest="cache_dir",
+        help="The folder for the build cache. Defaults to "
+        "$XDG_CACHE_HOME/karaml or ~/.cache/karaml",
+        action="store",
+        type=Path,
+    )
+    args = parser.parse_args(argv)
+    if args.jobs < 0:
+        parser.error("--jobs must be 0 or a positive number")
+    config_files = find_config_files(args.config_files)
+    if not config_files:
+        parser.error("no config files found")
+
+    karaml.cfg.DEBUG_FLAG = args.debug
+    karaml.cfg.ON_DUPLICATE = args.on_duplicate
+    cache_dir = None if args.no_cache else (
+        args.cache_dir or default_cache_dir())
+    start = perf_counter()
+    results = build_configs(
+        config_files,
+        args.output_dir,
+        "to_if_held_down" if args.hold_down else "to",
+        args.jobs or cpu_count() or 1,
+        cache_dir,
+    )
+    print(format_results(results, perf_counter() - start))
+    if any(result.error is not None for result in results):
+        sys.exit(1)
+
+
+SUBCOMMANDS = {
+    "backups": backups_main,
+    "build": build_main,
+    "profiles": profiles_main,
+}
 
 
 def main():
-    parser = argparse.ArgumentParser()
+    if sys.argv[1:2] and sys.argv[1] in SUBCOMMANDS:
+        SUBCOMMANDS[sys.argv[1]](sys.argv[2:])
+        return
+
+    parser = argparse.ArgumentParser(
+        epilog="Run `karaml build -h` to compile several configs at once, "
+        "`karaml backups -h` to list or restore the automatic "
+        "karabiner.json backups, and `karaml profiles -h` to clean up the "
+        "profiles karaml generated.")
 
     parser.add_argument(
         "config_file",
@@ -27,6 +253,15 @@ def main():
 
     )
 
+    parser.add_argument(
+        "--split-layers",
+        dest="split_layers",
+        help="With -c, write one complex modifications file per layer, "
+        "named after the -c file. Only the layers that changed are "
+        "rewritten",
+        action="store_true",
+    )
+
     parser.add_argument(
         "-k",
         dest="k_profile",
@@ -35,6 +270,16 @@ def main():
         action="store_true",
     )
 
+    parser.add_argument(
+        "-p",
+        "--profile",
+        dest="profiles",
+        help="The name of a karabiner.json profile to update. Can be passed "
+        "several times to update several profiles in one go, and overrides "
+        "the profile_name and profiles of the config. Implies -k",
+        action="append",
+    )
+
     parser.add_argument(
         "-hd",
         dest="hold_down",
@@ -51,9 +296,76 @@ def main():
         action="store_true",
     )
 
+    parser.add_argument(
+        "--no-cache",
+        dest="no_cache",
+        help="Translate every layer from scratch instead of reusing the "
+        "unchanged layers of the previous build",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--cache-dir",
+        dest="cache_dir",
+        help="The folder for the build cache. Defaults to "
+        "$XDG_CACHE_HOME/karaml or ~/.cache/karaml",
+        action="store",
+        type=Path,
+    )
+
+    parser.add_argument(
+        "-w",
+        "--watch",
+        dest="watch",
+        help="Keep running and rebuild whenever the config file changes. "
+        "Requires -c or -k, since there is no one to answer the prompts",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        help="The number of processes to translate layers with. Defaults to "
+        "1. Pass 0 to use one process per CPU core",
+        action="store",
+        type=int,
+        default=1,
+    )
+
+    parser.add_argument(
+        "--on-duplicate",
+        dest="on_duplicate",
+        help="What to do with keys that appear twice in the same layer (or "
+        "layers defined twice): exit with an error, keep the first or the "
+        "last value, or prompt. Defaults to prompt, or to error with --watch "
+        "or when stdin isn't a terminal",
+        choices=DUPLICATE_POLICIES,
+    )
+
+    add_lock_timeout_argument(parser)
+
+    parser.add_argument(
+        "--timings",
+        dest="timings",
+        help="Print the time spent in each stage of the build",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--timings-json",
+        dest="timings_json",
+        help="Write the time spent in each stage of the build as JSON to "
+        "this file",
+        action="store",
+        type=Path,
+    )
+
     args = parser.parse_args()
-    config_file, complex_mods_output, k_profile, hold_down, debug = vars(
-        args).values()
+    config_file = args.config_file
+    complex_mods_output = args.complex_mods_output
+    k_profile = args.k_profile or bool(args.profiles)
+    hold_down, debug = args.hold_down, args.debug
 
     # For those who want to update their karabiner.json automatically,
     # set k_profiles (-K or --k)
@@ -68,16 +380,71 @@ def main():
     if debug:
         karaml.cfg.DEBUG_FLAG = True
 
+    if args.split_layers and not complex_mods_output:
+        parser.error("--split-layers requires -c")
+    write_complex_mods = (
+        write_complex_mods_shards if args.split_layers
+        else write_complex_mods_json)
+
     hold_flavor = "to" if not hold_down else "to_if_held_down"
-    karaml_config = KaramlConfig(config_file, hold_flavor)
+    if args.jobs < 0:
+        parser.error("--jobs must be 0 or a positive number")
+    jobs = args.jobs or cpu_count() or 1
+
+    set_lock_timeout(parser, args)
+    if args.watch and args.on_duplicate == "prompt":
+        parser.error("--on-duplicate=prompt can't be used with --watch")
+    karaml.cfg.ON_DUPLICATE = args.on_duplicate or (
+        "error" if args.watch else "prompt")
+
+    if args.timings or args.timings_json:
+        TIMINGS.enable()
+
+    def report_timings():
+        if args.timings:
+            print(TIMINGS.summary())
+        if args.timings_json:
+            TIMINGS.write_json(args.timings_json)
+    cache = None
+    if not args.no_cache:
+        cache = BuildCache(args.cache_dir or default_cache_dir())
+
+    if args.watch:
+        if not (complex_mods_output or k_profile):
+            parser.error("--watch requires -c or -k")
+
+        def write_outputs(karaml_config: KaramlConfig):
+            if complex_mods_output:
+                write_complex_mods(
+                    karaml_config, complex_mods_output, overwrite=True)
+            if k_profile:
+                update_karabiner_json(karaml_config, args.profiles)
+            report_timings()
+
+        watch_config(config_file, hold_flavor, cache, write_outputs, jobs)
+        return
+
+    # Read and back up karabiner.json while the config is built
+    prefetch = KarabinerPrefetch() if k_profile else None
+    try:
+        with TIMINGS.stage("build"):
+            karaml_config = KaramlConfig(
+                config_file, hold_flavor, cache, jobs)
+        if cache:
+            cache.report()
 
-    if complex_mods_output:
-        write_complex_mods_json(karaml_config, complex_mods_output)
+        if complex_mods_output:
+            write_complex_mods(karaml_config, complex_mods_output)
 
-    if k_profile:
-        update_karabiner_json(karaml_config)
+        if k_profile:
+            update_karabiner_json(karaml_config, args.profiles, prefetch)
+    finally:
+        # Drops the staged backup if the build failed or the user quit
+        if prefetch:
+            prefetch.close()
 
     if complex_mods_output or k_profile:
+        report_timings()
         print("Done!\n")
         return
 
@@ -90,10 +457,12 @@ def main():
         choice = input("\nCommand: ")
 
         if choice == "1":
-            update_karabiner_json(karaml_config)
+            update_karabiner_json(karaml_config, args.profiles)
+            report_timings()
             break
         if choice == "2":
             write_complex_mods_json(karaml_config, "karaml_complex_mods.json")
+            report_timings()
             break
         if choice in ["3", "q"]:
             print("Goodbye!")
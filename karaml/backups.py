@@ -0,0 +1,755 @@
+"""
+Content-addressed backups of karabiner.json.
+
+Every update of karabiner.json is preceded by a backup, and most backups of a
+config that is rebuilt often are identical or nearly so. Instead of copying the
+whole file each time, every distinct karabiner.json is stored once in the
+`objects` folder of `automatic_backups`, named after the sha256 of its content.
+The timestamped backup files (`karabiner.backup.TIMESTAMP.json`) are hard links
+to those objects, so they can still be opened or copied like regular files.
+
+Backing up a karabiner.json that was backed up before only costs a hash and a
+new link. New content is copied with `os.copy_file_range` where available,
+which lets filesystems like btrfs or XFS share the data blocks (a reflink)
+instead of duplicating them. Filesystems without hard links get a plain copy.
+
+A manifest (`manifest.json`) records every backup and object with its size, so
+the folder size, listing and restoring never need to scan the folder. After
+each backup, a RetentionPolicy prunes old backups and, if the config asks for
+it, compresses the objects that only older backups refer to. The timestamped
+files of compressed backups are removed, since the hard links would keep the
+uncompressed data alive; they are still listed in the manifest and can be
+restored with `karaml backups`. Backups made before the manifest existed are
+left alone unless the config has a `backups` policy.
+
+With the `delta` option, a new backup is stored as a structural delta against
+a full snapshot (its base) instead of in full, as long as the delta is much
+smaller (see karaml.json_delta). Every `rebase_every` deltas, the next backup
+is stored in full and becomes the base of the following ones, so restoring a
+backup never takes more than a base and one delta. Like compressed backups,
+delta backups have no timestamped file.
+"""
+
+import gzip
+import lzma
+import os
+from dataclasses import dataclass, fields
+from datetime import datetime
+from functools import partial
+from hashlib import sha256
+from json import JSONDecodeError, dumps, loads
+from pathlib import Path
+from shutil import copyfile
+
+from karaml.exceptions import invalidBackupPolicy
+from karaml.file_lock import file_lock
+from karaml.file_utils import file_signature
+from karaml.json_delta import apply_delta, diff_json
+from karaml.json_writer import file_digest, write_chunks
+from karaml.timings import timed
+
+BACKUP_DIR_NAME = "automatic_backups"
+OBJECTS_DIR_NAME = "objects"
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+BACKUP_GLOB = "karabiner.backup.*.json"
+TIME_FORMAT = "%Y-%m-%d_%H-%M-%S"
+
+COMPRESSORS = {"xz": lzma, "gz": gzip}
+# A delta is only stored if it is at most this fraction of the full file
+MAX_DELTA_RATIO = 0.5
+
+
+def backup_name(timestamp: datetime) -> str:
+    return f"karabiner.backup.{timestamp.strftime(TIME_FORMAT)}.json"
+
+
+def backup_time(name: str) -> datetime | None:
+    """
+    Returns the time of a backup from its file name, or None if the name
+    isn't a timestamped backup name.
+    """
+    try:
+        return datetime.strptime(name, f"karabiner.backup.{TIME_FORMAT}.json")
+    except ValueError:
+        return None
+
+
+@dataclass
+class RetentionPolicy:
+    """
+    Which backups to keep. A backup is kept if any of the keep rules selects
+    it. If no keep rule is set, every backup is kept. max_size_mb then drops
+    the oldest kept backups until the folder fits, but never the newest one.
+
+    Attributes:
+        keep_last: Keep the newest N backups.
+        keep_daily: Keep the newest backup of each of the last N days that
+            have backups.
+        keep_weekly: Keep the newest backup of each of the last N weeks that
+            have backups.
+        max_size_mb: The most space the stored backups may take up.
+        compress_after: Compress the objects that only backups older than the
+            newest N refer to. Off by default.
+        compression: The compression for old objects, "xz" or "gz".
+        delta: Store backups as deltas against a full snapshot.
+        rebase_every: The number of deltas stored against a snapshot before
+            the next backup is stored in full.
+        keep_legacy: Keep the backups made before the manifest existed (or
+            found when it was rebuilt), and leave them uncompressed. On
+            unless the config has a `backups` policy.
+    """
+
+    keep_last: int | None = 20
+    keep_daily: int | None = 14
+    keep_weekly: int | None = 8
+    max_size_mb: float | None = 100
+    compress_after: int | None = None
+    compression: str = "xz"
+    delta: bool = False
+    rebase_every: int = 20
+    keep_legacy: bool = True
+
+    @classmethod
+    def from_dict(cls, policy: dict | None) -> "RetentionPolicy":
+        """
+        Returns a policy with the defaults overridden by the `backups`
+        section of a karaml config. A rule set to null is disabled. With a
+        `backups` section, the legacy backups are subject to the policy too,
+        unless it sets keep_legacy.
+        """
+        if not policy:
+            return cls()
+        if not isinstance(policy, dict):
+            invalidBackupPolicy(policy, "The backups section must be a map.")
+        names = {f.name for f in fields(cls)}
+        for key, value in policy.items():
+            if key not in names:
+                invalidBackupPolicy(policy, f"Unknown backups key: {key}")
+            if key == "compression":
+                if value not in COMPRESSORS:
+                    invalidBackupPolicy(
+                        policy,
+                        f"compression must be one of {list(COMPRESSORS)}")
+                continue
+            if key in ("delta", "keep_legacy"):
+                if not isinstance(value, bool):
+                    invalidBackupPolicy(
+                        policy, f"{key} must be true or false")
+                continue
+            if key == "rebase_every" and (
+                    isinstance(value, bool) or
+                    not isinstance(value, int) or value < 1):
+                invalidBackupPolicy(
+                    policy, "rebase_every must be a number above 0")
+            number_types = (int, float) if key == "max_size_mb" else int
+            if value is not None and (
+                    isinstance(value, bool) or
+                    not isinstance(value, number_types) or value < 0):
+                invalidBackupPolicy(
+                    policy, f"{key} must be a positive number or null")
+        return cls(**{"keep_legacy": False, **policy})
+
+    @property
+    def max_size(self) -> float | None:
+        if self.max_size_mb is None:
+            return None
+        return self.max_size_mb * 1000000
+
+
+class BackupManifest:
+    """
+    The record of the backups and stored objects of a backup folder.
+
+    Attributes:
+        backup_dir: The automatic_backups folder.
+        objects: A dict of content digests to a dict with the "size" of the
+            content, the "stored_size" of the object file and its
+            "compression" (None if it is stored as is). Objects stored as a
+            delta also have the digest of their "base".
+        backups: A list of dicts with the "name", "time" (as in the name) and
+            "object" digest of each backup, from oldest to newest.
+        replaced: The compressed object files that store replaced with full
+            ones, to be removed once the manifest is saved.
+    """
+
+    def __init__(self, backup_dir: Path):
+        self.backup_dir = backup_dir
+        self.objects: dict[str, dict] = {}
+        self.backups: list[dict] = []
+        self.replaced: list[Path] = []
+
+    @property
+    def objects_dir(self) -> Path:
+        return self.backup_dir / OBJECTS_DIR_NAME
+
+    @property
+    def path(self) -> Path:
+        return self.backup_dir / MANIFEST_NAME
+
+    @property
+    def total_size(self) -> int:
+        return sum(obj["stored_size"] for obj in self.objects.values())
+
+    @classmethod
+    def load(cls, backup_dir: Path) -> "BackupManifest":
+        """
+        Loads the manifest of the backup folder. A missing or unreadable
+        manifest is rebuilt from the files in the folder, once. A missing
+        folder has no backups, and is left missing.
+        """
+        manifest = cls(backup_dir)
+        if not backup_dir.is_dir():
+            return manifest
+        try:
+            data = loads(manifest.path.read_text())
+            if data.get("version") == MANIFEST_VERSION:
+                manifest.objects = data["objects"]
+                manifest.backups = data["backups"]
+                return manifest
+        except (OSError, JSONDecodeError, KeyError, AttributeError):
+            pass
+        manifest.rebuild()
+        return manifest
+
+    def rebuild(self):
+        """
+        Records every timestamped backup in the folder, storing its content
+        as an object, and saves the manifest. Backups made before karaml
+        deduplicated them are replaced with links to their object.
+
+        Compressed and delta backups have no timestamped file, so objects
+        that no file refers to are recorded as recovered backups, dated by
+        their file, rather than left for the retention policy to delete.
+        Every backup found is marked as legacy, see RetentionPolicy.
+        """
+        self.objects, self.backups = {}, []
+        for obj in self.objects_dir.glob("*.json*"):
+            digest, _, suffix = obj.name.partition(".json")
+            digest, is_delta = digest.removesuffix(".delta"), \
+                digest.endswith(".delta")
+            compression = suffix.lstrip(".") or None
+            if compression is not None and compression not in COMPRESSORS:
+                continue
+            self.objects[digest] = {
+                "size": None,
+                "stored_size": obj.stat().st_size,
+                "compression": compression,
+            }
+            if is_delta:
+                delta = loads(self.read_stored(digest, is_delta=True))
+                self.objects[digest]["base"] = delta["base"]
+        backup_files = [
+            (time, file) for file in self.backup_dir.glob(BACKUP_GLOB)
+            if (time := backup_time(file.name))
+        ]
+        for time, file in sorted(backup_files):
+            digest, _ = self.store(file)
+            link_backup(self.object_path(digest), file)
+            self.backups.append(
+                backup_entry(file.name, time, digest, legacy=True))
+        listed = {backup["object"] for backup in self.backups}
+        for digest in self.objects.keys() - listed:
+            time = datetime.fromtimestamp(
+                self.object_path(digest).stat().st_mtime)
+            name = f"karabiner.recovered.{time.strftime(TIME_FORMAT)}." \
+                f"{digest[:12]}.json"
+            self.backups.append(
+                backup_entry(name, time, digest, legacy=True))
+        self.backups.sort(key=lambda backup: backup["time"])
+        for digest, obj in self.objects.items():
+            if obj["size"] is None:
+                obj["size"] = len(self.read_object(digest))
+        self.save()
+
+    def save(self):
+        write_chunks(self.path, [dumps({
+            "version": MANIFEST_VERSION,
+            "objects": self.objects,
+            "backups": self.backups,
+        }, indent=4)])
+
+    def remove_replaced(self):
+        """
+        Removes the compressed object files replaced by full ones. Must be
+        called with the lock on karabiner.json held, once the manifest that
+        no longer refers to them is saved. Files the manifest refers to
+        again, e.g. because the object was compressed again, are kept.
+        """
+        current = {self.object_path(digest) for digest in self.objects}
+        for obj in self.replaced:
+            if obj not in current:
+                obj.unlink(missing_ok=True)
+        self.replaced = []
+
+    def object_path(self, digest: str, is_delta: bool | None = None) -> Path:
+        obj = self.objects[digest]
+        if is_delta is None:
+            is_delta = "base" in obj
+        kind = ".delta" if is_delta else ""
+        suffix = f".{obj['compression']}" if obj["compression"] else ""
+        return self.objects_dir / f"{digest}{kind}.json{suffix}"
+
+    def is_linkable(self, digest: str) -> bool:
+        """
+        Returns True if the object is a full, uncompressed copy of a
+        karabiner.json, which timestamped backup files can link to.
+        """
+        obj = self.objects[digest]
+        return not obj["compression"] and "base" not in obj
+
+    def latest_base(self) -> str | None:
+        """
+        Returns the full object that the newest backup is, or is a delta of.
+        """
+        for backup in reversed(self.backups):
+            obj = self.objects[backup["object"]]
+            return obj.get("base", backup["object"])
+        return None
+
+    def store_delta(self, src: Path, rebase_every: int
+                    ) -> tuple[str, bool] | None:
+        """
+        Stores the file as a delta against the base of the newest backup.
+        Returns the hash of its content and whether it was new, or None if
+        it should be stored in full instead: because there is no base yet,
+        the base has rebase_every deltas already, the file isn't in the
+        indent=4 layout the delta is rebuilt in, or the delta is too large.
+        """
+        data = src.read_bytes()
+        digest = sha256(data).hexdigest()
+        if digest in self.objects:
+            return digest, False
+        base = self.latest_base()
+        deltas = sum(obj.get("base") == base for obj in self.objects.values())
+        if base is None or deltas >= rebase_every:
+            return None
+        try:
+            new = loads(data)
+        except (JSONDecodeError, UnicodeDecodeError):
+            return None
+        old = loads(self.read_object(base))
+        patch = diff_json(old, new)
+        rebuilt = dumps(apply_delta(old, patch), indent=4).encode()
+        if sha256(rebuilt).hexdigest() != digest:
+            return None
+        delta = dumps({"base": base, "patch": patch}).encode()
+        if len(delta) > len(data) * MAX_DELTA_RATIO:
+            return None
+
+        self.objects[digest] = {"size": len(data), "stored_size": len(delta),
+                                "compression": None, "base": base}
+        obj = self.object_path(digest)
+        tmp_obj = obj.with_name(f".{obj.name}.tmp")
+        tmp_obj.write_bytes(delta)
+        os.replace(tmp_obj, obj)
+        return digest, True
+
+    def store(self, src: Path) -> tuple[str, bool]:
+        """
+        Stores the file as an uncompressed object under the hash of its
+        content. Returns the hash and whether the content was new. Content
+        that is already stored uncompressed is not copied again.
+
+        If the content was stored compressed, the compressed file is only
+        added to replaced, since store may run without the lock on
+        karabiner.json and the manifest of another karaml process may still
+        refer to it. See remove_replaced.
+        """
+        digest = file_digest(src)
+        if digest is None:
+            raise FileNotFoundError(src)
+        stored = self.objects.get(digest)
+        if stored and not stored["compression"] and \
+                self.object_path(digest).exists():
+            return digest, False
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        obj = self.objects_dir / f"{digest}.json"
+        tmp_obj = obj.with_name(f".{obj.name}.tmp")
+        clone_file(src, tmp_obj)
+        os.replace(tmp_obj, obj)
+        if stored and stored["compression"]:
+            self.replaced.append(self.object_path(digest))
+        size = obj.stat().st_size
+        self.objects[digest] = {
+            "size": size, "stored_size": size, "compression": None}
+        return digest, stored is None
+
+    def read_stored(self, digest: str, is_delta: bool | None = None
+                    ) -> bytes:
+        """
+        Returns the bytes of an object file, decompressed.
+        """
+        compression = self.objects[digest]["compression"]
+        data = self.object_path(digest, is_delta).read_bytes()
+        if compression:
+            return COMPRESSORS[compression].decompress(data)
+        return data
+
+    def read_object(self, digest: str) -> bytes:
+        """
+        Returns the content of a backup, rebuilding it from its base if it
+        is stored as a delta.
+        """
+        data = self.read_stored(digest)
+        if "base" not in self.objects[digest]:
+            return data
+        delta = loads(data)
+        old = loads(self.read_object(delta["base"]))
+        return dumps(apply_delta(old, delta["patch"]), indent=4).encode()
+
+    def compress(self, digest: str, compression: str):
+        """
+        Compresses a stored object and removes the timestamped backup files
+        linked to it.
+        """
+        obj = self.objects[digest]
+        if obj["compression"]:
+            return
+        plain = self.object_path(digest)
+        data = COMPRESSORS[compression].compress(plain.read_bytes())
+        compressed = plain.with_name(f"{plain.name}.{compression}")
+        compressed.write_bytes(data)
+        for backup in self.backups:
+            if backup["object"] == digest:
+                (self.backup_dir / backup["name"]).unlink(missing_ok=True)
+        plain.unlink()
+        obj["compression"] = compression
+        obj["stored_size"] = len(data)
+
+    def find(self, name: str) -> dict | None:
+        """
+        Returns the backup with the name, or the n-th newest backup if the
+        name is a number (1 being the newest).
+        """
+        if name.isdigit():
+            index = int(name)
+            if 1 <= index <= len(self.backups):
+                return self.backups[-index]
+            return None
+        for backup in self.backups:
+            if name in (backup["name"], backup["time"]):
+                return backup
+        return None
+
+
+def backup_entry(name: str, time: datetime, digest: str,
+                 legacy: bool = False) -> dict:
+    entry = {"name": name, "time": time.strftime(TIME_FORMAT),
+             "object": digest}
+    if legacy:
+        entry["legacy"] = True
+    return entry
+
+
+def clone_file(src: Path, dst: Path):
+    """
+    Copies a file with copy_file_range, so the kernel can copy (or reflink)
+    it without moving the data through this process. Falls back to a regular
+    copy where copy_file_range is unavailable or unsupported.
+    """
+    try:
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            remaining = os.fstat(fsrc.fileno()).st_size
+            while remaining > 0:
+                copied = os.copy_file_range(
+                    fsrc.fileno(), fdst.fileno(), remaining)
+                if not copied:
+                    break
+                remaining -= copied
+            if remaining <= 0:
+                return
+    except (AttributeError, OSError):
+        pass
+    copyfile(src, dst)
+
+
+def link_backup(obj: Path, backup_file: Path):
+    """
+    Makes the timestamped backup file a hard link to the stored object, or a
+    copy of it if the filesystem doesn't support hard links. A backup with
+    the same timestamp (i.e. made within the same second) is replaced.
+    """
+    if backup_file.exists() and backup_file.samefile(obj):
+        return
+    backup_file.unlink(missing_ok=True)
+    try:
+        os.link(obj, backup_file)
+    except OSError:
+        clone_file(obj, backup_file)
+
+
+def select_backups(backups: list[dict], policy: RetentionPolicy,
+                   sizes: dict[str, int],
+                   bases: dict[str, str] | None = None) -> list[dict]:
+    """
+    Returns the backups the policy keeps, oldest first. sizes holds the
+    stored size of each object, which is counted once however many backups
+    refer to it. bases maps delta objects to their base, which counts
+    towards the size of the backups that need it.
+    """
+    bases = bases or {}
+    newest_first = backups[::-1]
+    keep_rules = [policy.keep_last, policy.keep_daily, policy.keep_weekly]
+    if all(rule is None for rule in keep_rules):
+        kept = set(range(len(newest_first)))
+    else:
+        kept = set(range(min(policy.keep_last or 0, len(newest_first))))
+        periods = [
+            (policy.keep_daily, lambda time: time[:10]),
+            (policy.keep_weekly,
+             lambda time: datetime.strptime(time, TIME_FORMAT)
+             .isocalendar()[:2]),
+        ]
+        for count, period_of in periods:
+            seen = set()
+            for i, backup in enumerate(newest_first):
+                if len(seen) >= (count or 0):
+                    break
+                period = period_of(backup["time"])
+                if period not in seen:
+                    seen.add(period)
+                    kept.add(i)
+
+    kept_backups = [newest_first[i] for i in sorted(kept)]
+    if policy.max_size is not None:
+        while len(kept_backups) > 1:
+            digests = with_bases(
+                {backup["object"] for backup in kept_backups}, bases)
+            if sum(sizes[digest] for digest in digests) <= policy.max_size:
+                break
+            kept_backups.pop()
+    return kept_backups[::-1]
+
+
+def with_bases(digests: set[str], bases: dict[str, str]) -> set[str]:
+    """
+    Returns the objects and the bases of the delta objects among them.
+    """
+    return digests | {bases[d] for d in digests if d in bases}
+
+
+def apply_retention(manifest: BackupManifest, policy: RetentionPolicy) -> int:
+    """
+    Prunes the backups the policy doesn't keep, deletes objects no backup
+    refers to anymore and compresses old objects. Returns the number of
+    pruned backups. Legacy backups are left as they are if the policy keeps
+    them, and don't count towards its rules.
+    """
+    sizes = {digest: obj["stored_size"]
+             for digest, obj in manifest.objects.items()}
+    bases = {digest: obj["base"]
+             for digest, obj in manifest.objects.items() if "base" in obj}
+    legacy = [b for b in manifest.backups
+              if policy.keep_legacy and b.get("legacy")]
+    managed = [b for b in manifest.backups if b not in legacy]
+    kept_names = {backup["name"] for backup in legacy} | {
+        backup["name"]
+        for backup in select_backups(managed, policy, sizes, bases)}
+    pruned = [b for b in manifest.backups if b["name"] not in kept_names]
+    for backup in pruned:
+        (manifest.backup_dir / backup["name"]).unlink(missing_ok=True)
+    kept = [b for b in manifest.backups if b["name"] in kept_names]
+    manifest.backups = kept
+
+    referenced = with_bases({backup["object"] for backup in kept}, bases)
+    for digest in list(manifest.objects):
+        if digest not in referenced:
+            manifest.object_path(digest).unlink(missing_ok=True)
+            del manifest.objects[digest]
+
+    if policy.compress_after is not None:
+        recent = kept[-policy.compress_after:] if policy.compress_after else []
+        recent_objects = with_bases(
+            {backup["object"] for backup in recent + legacy}, bases)
+        for digest in referenced - recent_objects:
+            manifest.compress(digest, policy.compression)
+    return len(pruned)
+
+
+@dataclass
+class StagedBackup:
+    """
+    The content of karabiner.json, stored ahead of a backup by stage_backup.
+
+    Attributes:
+        manifest: The manifest of the backup folder, with the object stored.
+        digest: The hash of the content of karabiner.json.
+        is_new: Whether the object wasn't stored before.
+        manifest_signature: The signature of the manifest file when it was
+            loaded, see karaml.file_utils.file_signature.
+    """
+    manifest: BackupManifest
+    digest: str
+    is_new: bool
+    manifest_signature: tuple[int, int] | None = None
+
+
+@timed("stage_backup")
+def stage_backup(karabiner_path: Path) -> StagedBackup | None:
+    """
+    Does the part of a backup of karabiner.json that doesn't depend on the
+    retention policy ahead of time, i.e. loading the manifest and storing
+    the content as a full object, so it can overlap with the build. The
+    backup is only recorded by backup_karabiner_json, or dropped by
+    discard_staged_backup. Returns None if karabiner.json is missing.
+    """
+    backup_dir = karabiner_path / BACKUP_DIR_NAME
+    backup_dir.mkdir(parents=True, exist_ok=True)
+    manifest = BackupManifest.load(backup_dir)
+    try:
+        digest, is_new = manifest.store(karabiner_path / "karabiner.json")
+    except FileNotFoundError:
+        return None
+    return StagedBackup(
+        manifest, digest, is_new, file_signature(manifest.path))
+
+
+def discard_staged_backup(staged: StagedBackup):
+    """
+    Drops a staged backup that isn't needed, since karabiner.json was left
+    unchanged.
+    """
+    if staged.is_new:
+        staged.manifest.object_path(staged.digest).unlink(missing_ok=True)
+    else:
+        # Storing may have replaced a compressed object with a full one
+        staged.manifest.save()
+        staged.manifest.remove_replaced()
+
+
+def store_staged(staged: StagedBackup, karabiner_json: Path,
+                 policy: RetentionPolicy) -> tuple[str, bool]:
+    """
+    Returns the digest of a staged backup and whether it was new, storing it
+    as a delta instead of the staged full object if the policy asks for it.
+    """
+    manifest, digest = staged.manifest, staged.digest
+    if not (policy.delta and staged.is_new):
+        return digest, staged.is_new
+    full_path = manifest.object_path(digest)
+    full = manifest.objects.pop(digest)
+    stored = manifest.store_delta(karabiner_json, policy.rebase_every)
+    if stored is None:
+        manifest.objects[digest] = full
+        return digest, True
+    full_path.unlink(missing_ok=True)
+    return stored
+
+
+@timed("backup_karabiner_json")
+def backup_karabiner_json(karabiner_path: Path,
+                          policy: RetentionPolicy | None = None,
+                          staged: StagedBackup | None = None) -> bool:
+    """
+    Backs up karabiner.json to automatic_backups folder, then applies the
+    retention policy (the default policy if None) to the folder. A backup
+    staged with stage_backup is recorded rather than stored again, and must
+    be of the current content of karabiner.json.
+    Returns True if backup was successful, False otherwise.
+    """
+    policy = policy or RetentionPolicy()
+    backup_dir = karabiner_path / BACKUP_DIR_NAME
+    backup_dir.mkdir(parents=True, exist_ok=True)
+    manifest = staged.manifest if staged else BackupManifest.load(backup_dir)
+
+    karabiner_json = karabiner_path / "karabiner.json"
+    now = datetime.now()
+    backup_file = backup_dir / backup_name(now)
+    try:
+        stored = None
+        if staged:
+            stored = store_staged(staged, karabiner_json, policy)
+        elif policy.delta:
+            stored = manifest.store_delta(karabiner_json, policy.rebase_every)
+        digest, is_new = stored or manifest.store(karabiner_json)
+    except FileNotFoundError:
+        report_missing_karabiner_json(karabiner_json)
+        return False
+    manifest.backups = [
+        b for b in manifest.backups if b["name"] != backup_file.name]
+    manifest.backups.append(backup_entry(backup_file.name, now, digest))
+    detail = "" if is_new else " (same content as an earlier backup)"
+    if manifest.is_linkable(digest):
+        link_backup(manifest.object_path(digest), backup_file)
+        print(f"Backed up karabiner.json to{detail}:"
+              f"\n~/{backup_file.relative_to(Path.home())}\n")
+    else:
+        backup_file.unlink(missing_ok=True)
+        print(f"Backed up karabiner.json as {backup_file.name}{detail}\n")
+
+    pruned = apply_retention(manifest, policy)
+    manifest.save()
+    manifest.remove_replaced()
+    if pruned:
+        print(f"Pruned {pruned} old backups.")
+    report_backup_folder_size(backup_dir, manifest.total_size)
+    return True
+
+
+def restore_backup(karabiner_path: Path, name: str,
+                   policy: RetentionPolicy | None = None) -> bool:
+    """
+    Restores karabiner.json from a backup, found by name, time or position
+    (1 being the newest). The current karabiner.json is backed up first if it
+    differs from the backup. Returns True if the backup was found. Raises
+    FileLockTimeout if another karaml process keeps karabiner.json locked.
+    """
+    backup_dir = karabiner_path / BACKUP_DIR_NAME
+    manifest = BackupManifest.load(backup_dir)
+    if not manifest.backups:
+        print("No backups found.")
+        return False
+    backup = manifest.find(name)
+    if not backup:
+        print(f"Could not find backup: {name}")
+        return False
+    text = manifest.read_object(backup["object"]).decode("utf-8")
+    karabiner_json = karabiner_path / "karabiner.json"
+    with file_lock(karabiner_json):
+        backup_current = None
+        if karabiner_json.exists():
+            backup_current = partial(
+                backup_karabiner_json, karabiner_path, policy)
+        written = write_chunks(karabiner_json, [text], backup_current)
+    if not written:
+        print(f"karabiner.json is already the same as {backup['name']}.")
+        return True
+    print(f"Restored karabiner.json from {backup['name']}.")
+    return True
+
+
+def list_backups(karabiner_path: Path) -> list[str]:
+    """
+    Returns a line for every backup in the manifest, newest first, with its
+    position, time, size and how it is stored.
+    """
+    manifest = BackupManifest.load(karabiner_path / BACKUP_DIR_NAME)
+    lines = []
+    for i, backup in enumerate(reversed(manifest.backups), 1):
+        obj = manifest.objects[backup["object"]]
+        stored_as = " ".join(filter(None, [
+            "delta" if "base" in obj else "", obj["compression"]]))
+        lines.append(f"{i:>4}  {backup['time']}  "
+                     f"{obj['size'] / 1000:>10.1f} KB  "
+                     f"{backup['object'][:12]}  {stored_as}")
+    return lines
+
+
+def report_missing_karabiner_json(karabiner_json: Path):
+    print(f"Could not find {karabiner_json}.\n"
+          "Please check your karabiner.json path.\n"
+          "By default, it is ~/.config/karabiner/karabiner.json\n"
+          "Aborting attempt to update karabiner.json\n")
+
+
+def report_backup_folder_size(backup_dir: Path, size: int):
+    """
+    Reports the size of the backup folder in MB. Warns the user if the
+    size is over 100 MB.
+    """
+    if size > 100000000:
+        print("WARNING! Backup folder size is over 100 MB.")
+    rounded_size = round(size / 1000000, 2)
+    print(f"Backup folder size: {rounded_size} MB\n")
+    print(f"Backup folder: ~/{backup_dir.relative_to(Path.home())}\n")
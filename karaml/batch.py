@@ -0,0 +1,186 @@
+"""
+Compiles many karaml configs in one invocation, e.g. a config per machine and
+per keyboard in a dotfiles repo:
+
+    karaml build laptop.yaml desktop.yaml keyboards/*.yaml -o build -j 4
+
+Each config is compiled to a complex modifications file of its own in the
+output folder, named after the config (`laptop.yaml` -> `laptop.json`). The
+configs are spread over a pool of worker processes, and each worker compiles
+config after config, so the imports, key code tables and compiled regexes are
+set up once per worker rather than once per config. Every config compiles in a
+CompileContext of its own (see karaml.compile_context), so the aliases and
+templates of one config never leak into the next.
+
+A batch build never prompts: duplicate keys are an error unless
+--on-duplicate says otherwise, and existing output files are overwritten
+(unchanged ones are left untouched). A config with errors is reported in the
+summary without stopping the others.
+"""
+
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from dataclasses import dataclass
+from io import StringIO
+from itertools import repeat
+from pathlib import Path
+from time import perf_counter
+
+import karaml.cfg
+from karaml.build_cache import BuildCache
+from karaml.file_writer import basic_rules_dict
+from karaml.json_writer import write_json
+from karaml.karaml_config import KaramlConfig
+
+CONFIG_SUFFIXES = (".yaml", ".yml")
+
+
+@dataclass
+class BuildResult:
+    """
+    The outcome of compiling one config of a batch.
+
+    Attributes:
+        config_file: The config file.
+        output_file: The complex modifications file it is compiled to.
+        seconds: How long it took to compile and write the config.
+        rules: The number of rules in the config.
+        layers: The number of layers written.
+        written: False if the output file already had the same content.
+        error: The error report if the config failed to compile, else None.
+    """
+    config_file: str
+    output_file: str
+    seconds: float
+    rules: int = 0
+    layers: int = 0
+    written: bool = False
+    error: str | None = None
+
+
+def find_config_files(paths: list[str]) -> list[str]:
+    """
+    Returns the config files to build for the paths passed on the command
+    line. A folder stands for the .yaml and .yml files in it. Files passed
+    more than once are only built once.
+    """
+    config_files, seen = [], set()
+    for path in map(Path, paths):
+        if path.is_dir():
+            files = sorted(
+                p for p in path.iterdir() if p.suffix in CONFIG_SUFFIXES)
+        else:
+            files = [path]
+        for config_file in files:
+            resolved = config_file.resolve()
+            if resolved not in seen:
+                seen.add(resolved)
+                config_files.append(str(config_file))
+    return config_files
+
+
+def output_files(config_files: list[str], output_dir: Path) -> list[Path]:
+    """
+    Returns the output file of each config, named after the config. Configs
+    with the same name in different folders are numbered in order.
+    """
+    outputs, seen = [], {}
+    for config_file in config_files:
+        stem = Path(config_file).stem
+        seen[stem] = seen.get(stem, 0) + 1
+        suffix = f"-{seen[stem]}" if seen[stem] > 1 else ""
+        outputs.append(output_dir / f"{stem}{suffix}.json")
+    return outputs
+
+
+def init_build_worker(debug_flag: bool, on_duplicate: str):
+    """
+    Applies the settings of the main process to a worker process.
+    """
+    karaml.cfg.DEBUG_FLAG = debug_flag
+    karaml.cfg.ON_DUPLICATE = on_duplicate
+
+
+def build_config(config_file: str, output_file: str, hold_flavor: str,
+                 cache_dir: Path | None = None) -> BuildResult:
+    """
+    Compiles a config to a complex modifications file and returns the
+    result. What the build prints is only kept if it fails, as the error
+    report.
+    """
+    start = perf_counter()
+    output = StringIO()
+    try:
+        with redirect_stdout(output):
+            cache = BuildCache(cache_dir) if cache_dir else None
+            karaml_config = KaramlConfig(config_file, hold_flavor, cache)
+            written = write_json(
+                Path(output_file), basic_rules_dict(karaml_config))
+    except SystemExit:
+        return BuildResult(config_file, output_file, perf_counter() - start,
+                           error=output.getvalue().strip())
+    except Exception as e:
+        report = (traceback.format_exc() if karaml.cfg.DEBUG_FLAG
+                  else "".join(traceback.format_exception_only(e)))
+        return BuildResult(config_file, output_file, perf_counter() - start,
+                           error=(output.getvalue() + report).strip())
+    return BuildResult(
+        config_file,
+        output_file,
+        perf_counter() - start,
+        rules=karaml_config.rule_count,
+        layers=len(karaml_config.layers),
+        written=written,
+    )
+
+
+def build_configs(config_files: list[str], output_dir: Path,
+                  hold_flavor: str = "to", jobs: int = 1,
+                  cache_dir: Path | None = None) -> list[BuildResult]:
+    """
+    Compiles the configs into the output folder, by a pool of worker
+    processes if jobs > 1, and returns the results in the order of the
+    configs.
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    args = (
+        config_files,
+        map(str, output_files(config_files, output_dir)),
+        repeat(hold_flavor),
+        repeat(cache_dir),
+    )
+    workers = min(jobs, len(config_files))
+    if workers <= 1:
+        return list(map(build_config, *args))
+    with ProcessPoolExecutor(
+        workers,
+        initializer=init_build_worker,
+        initargs=(karaml.cfg.DEBUG_FLAG, karaml.cfg.ON_DUPLICATE),
+    ) as executor:
+        return list(executor.map(build_config, *args))
+
+
+def format_results(results: list[BuildResult], seconds: float) -> str:
+    """
+    Returns a summary of a batch build with the time each config took, and
+    the error report of each config that failed.
+    """
+    lines = []
+    for result in results:
+        if result.error is not None:
+            status, detail = "failed", ""
+        else:
+            status = "written" if result.written else "unchanged"
+            detail = f" ({result.rules} rules, {result.layers} layers)"
+        lines.append(
+            f"{result.seconds * 1000:8.1f} ms  {status:<9}  "
+            f"{result.config_file} -> {result.output_file}{detail}")
+        if result.error:
+            lines.extend(f"    {line}".rstrip()
+                         for line in result.error.splitlines())
+    failed = sum(result.error is not None for result in results)
+    lines.append(
+        f"\nBuilt {len(results) - failed} of {len(results)} configs in "
+        f"{seconds:.2f}s" + (f", {failed} failed" if failed else ""))
+    return "\n".join(lines)
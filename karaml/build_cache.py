@@ -0,0 +1,229 @@
+"""
+A persistent build cache for karaml configs.
+
+Translating a layer is by far the most expensive part of a karaml build, and
+most edits to a config only touch one or two layers. The BuildCache stores the
+translated layers of the previous build on disk, keyed by a fingerprint of each
+layer's YAML subtree plus everything else that can change its translation: the
+user-defined aliases and templates, the hold flavor and the karaml version.
+
+On the next build, layers with an unchanged fingerprint are loaded from the
+cache and only the edited layers are translated again. If the config file
+itself is unchanged, the whole build is restored from the cache without even
+parsing the YAML.
+
+The cache lives in `$XDG_CACHE_HOME/karaml` (`~/.cache/karaml` by default),
+with one JSON file per config file.
+"""
+
+from hashlib import sha256
+from importlib.metadata import PackageNotFoundError, version
+from json import JSONDecodeError, dumps, loads
+from os import environ
+from pathlib import Path
+
+import karaml.cfg
+
+try:
+    KARAML_VERSION = version("karaml")
+except PackageNotFoundError:
+    KARAML_VERSION = "unknown"
+
+# The attributes of a KaramlConfig that make up a finished build
+BUILD_ATTRS = [
+    "profile_name",
+    "title",
+    "params",
+    "backup_policy",
+    "compact_profiles",
+    "profiles",
+    "json_rules_list",
+    "rule_count",
+    "layers",
+]
+
+
+def default_cache_dir() -> Path:
+    """
+    Returns the default cache folder, respecting XDG_CACHE_HOME if it is set.
+    """
+    cache_home = environ.get("XDG_CACHE_HOME") or "~/.cache"
+    return Path(cache_home).expanduser() / "karaml"
+
+
+def fingerprint(*parts) -> str:
+    """
+    Returns a hex digest for any number of YAML-loaded objects. The repr of
+    the objects is used rather than a JSON dump since PyYAML may produce keys
+    that are not strings (e.g. ints), and dict reprs keep insertion order,
+    which matters for karaml layers.
+    """
+    return sha256(repr(parts).encode()).hexdigest()
+
+
+class BuildCache:
+    """
+    A cache of translated layers for a single karaml config file.
+
+    Attributes:
+        cache_dir: The folder the cache files are written to. If None, the
+            cache is only kept in memory (e.g. for a long-running process).
+        hits: The number of layers restored from the cache in the last build.
+        misses: The number of layers translated in the last build.
+        unchanged: Whether the last build was restored entirely because the
+            config file had not changed.
+    """
+
+    def __init__(self, cache_dir: Path | None = None):
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        self.unchanged = False
+        self._cache_file: Path | None = None
+        self._entry: dict = {}
+        self._context = ""
+        self._used_layers: dict = {}
+
+    def cache_file(self, from_file: str) -> Path | None:
+        """
+        Returns the cache file for a config file. Each config file is cached
+        separately, named after a hash of its absolute path.
+        """
+        if self.cache_dir is None:
+            return None
+        config_path = str(Path(from_file).expanduser().resolve())
+        return self.cache_dir / f"{fingerprint(config_path)[:16]}.json"
+
+    def load(self, from_file: str):
+        """
+        Loads the cache entry for a config file from disk. A missing or
+        unreadable cache file is treated as an empty cache. Entries written by
+        a different karaml version are discarded.
+        """
+        cache_file = self.cache_file(from_file)
+        if cache_file != self._cache_file:
+            self._entry = {}
+            self._cache_file = cache_file
+        if cache_file is None or self._entry:
+            return
+        try:
+            entry = loads(cache_file.read_text())
+        except (OSError, JSONDecodeError):
+            return
+        if isinstance(entry, dict) and entry.get("version") == KARAML_VERSION:
+            self._entry = entry
+
+    def save(self):
+        """
+        Writes the cache entry to disk. Failing to write the cache is not an
+        error, it only means the next build will not be incremental.
+        """
+        if self._cache_file is None:
+            return
+        try:
+            self._cache_file.parent.mkdir(parents=True, exist_ok=True)
+            self._cache_file.write_text(dumps(self._entry))
+        except OSError:
+            pass
+
+    def input_fingerprint(self, from_file: str, hold_flavor: str) -> str:
+        """
+        Returns a fingerprint of everything a build depends on: the raw
+        config file, the hold flavor, the duplicate key policy and the karaml
+        version.
+        """
+        with open(from_file, "rb") as f:
+            config_bytes = f.read()
+        return fingerprint(config_bytes, hold_flavor,
+                           karaml.cfg.ON_DUPLICATE, KARAML_VERSION)
+
+    def restore_build(self, karaml_config, input_fp: str) -> bool:
+        """
+        Restores the attributes of a finished build onto the karaml_config if
+        the input fingerprint matches the cached one. Returns True if the
+        build was restored, False otherwise.
+        """
+        self.hits, self.misses, self.unchanged = 0, 0, False
+        self.load(karaml_config.from_file)
+        build = self._entry.get("build")
+        if not build or self._entry.get("input") != input_fp:
+            return False
+        if any(attr not in build for attr in BUILD_ATTRS):
+            return False
+        layers = self._entry.get("layers", {})
+        for attr in BUILD_ATTRS:
+            setattr(karaml_config, attr, build[attr])
+        # Translated layers are stored once, by fingerprint. Layers that were
+        # not translated (i.e. the /JSON/ layer) are stored inline
+        karaml_config.layers = [
+            layers[layer] if isinstance(layer, str) else layer
+            for layer in build["layers"]
+        ]
+        self.unchanged = True
+        return True
+
+    def begin_build(self, aliases: dict, templates: dict, hold_flavor: str):
+        """
+        Sets the context that every layer fingerprint of this build depends
+        on. Must be called before the user aliases and templates are popped
+        from the YAML data. Calling it again starts the build over, e.g. when
+        the config turns out to have more aliases or templates.
+        """
+        self._context = fingerprint(
+            aliases, templates, hold_flavor, KARAML_VERSION)
+        self._used_layers = {}
+        self.hits, self.misses = 0, 0
+
+    def layer_fingerprint(self, layer_key: str, layer_maps: dict) -> str:
+        """
+        Returns the fingerprint of a single layer in the current build.
+        """
+        return fingerprint(self._context, layer_key, layer_maps)
+
+    def get_layer(self, layer_fp: str) -> dict | None:
+        """
+        Returns the cached translation of a layer, or None if the layer has
+        not been translated with this fingerprint before. Counts hits and
+        misses.
+        """
+        layer = self._entry.get("layers", {}).get(layer_fp)
+        if layer is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._used_layers[layer_fp] = layer
+        return layer
+
+    def put_layer(self, layer_fp: str, layer: dict):
+        """
+        Adds a freshly translated layer to the current build.
+        """
+        self._used_layers[layer_fp] = layer
+
+    def store_build(self, karaml_config, input_fp: str):
+        """
+        Stores the finished build and the layers it used, dropping any layers
+        that are no longer part of the config, and writes the cache to disk.
+        """
+        layer_fps = {id(layer): fp for fp, layer in self._used_layers.items()}
+        build = {attr: getattr(karaml_config, attr) for attr in BUILD_ATTRS}
+        build["layers"] = [
+            layer_fps.get(id(layer), layer) for layer in build["layers"]
+        ]
+        self._entry = {
+            "version": KARAML_VERSION,
+            "input": input_fp,
+            "build": build,
+            "layers": self._used_layers,
+        }
+        self.save()
+
+    def report(self):
+        """
+        Prints a summary of the cache hits and misses of the last build.
+        """
+        if self.unchanged:
+            print("Build cache: config unchanged, reused previous build\n")
+            return
+        print(f"Build cache: {self.hits} layers reused, "
+              f"{self.misses} layers translated\n")
@@ -1 +1,3 @@
 DEBUG_FLAG = False
+LOCK_TIMEOUT = 10.0
+ON_DUPLICATE = "prompt"
@@ -0,0 +1,90 @@
+"""
+The user aliases and templates a karaml config is compiled with.
+
+A CompileContext holds the registries that translating a config depends on:
+the key code registry with the built-in and user aliases, the user templates,
+and the memoized translations of the maps. Each KaramlConfig compiles in a
+context of its own, so configs compiled one after the other (or in different
+threads) in the same process don't see each other's aliases and templates.
+
+The context is not passed down the call chain, which would be every function
+of karaml.map_translator and karaml.key_karamlizer. Instead, it is made the
+current context of the thread for the duration of the build with `activate`,
+and looked up with `current_context`. Code that never activates a context
+(e.g. the tests of single maps) runs in a process-wide default context.
+
+The built-in aliases are shared with every context until a user alias is
+added, and the registry is copied then, so the built-ins are never modified.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator
+
+from karaml.key_codes import KEY_REGISTRY, Alias, KeyCodeRegistry
+
+
+class CompileContext:
+    """
+    The registries a config is compiled with.
+
+    Attributes:
+        keys: The key code registry, including the user aliases.
+        user_templates: The user templates by name, as ShellCommandTemplates.
+        translations: The memoized translations of the maps of the config,
+            which depend on the aliases and templates, by map string. See
+            karaml.map_translator.cached_translations.
+    """
+
+    def __init__(self):
+        self.keys: KeyCodeRegistry = KEY_REGISTRY
+        self.user_templates: dict = {}
+        self.translations: dict = {}
+
+    def add_alias(self, name: str, alias: Alias):
+        self.own_keys().add_alias(name, alias)
+
+    def add_modifier_alias(self, name: str, modifiers: str):
+        self.own_keys().add_modifier_alias(name, modifiers)
+
+    def add_template(self, name: str, template):
+        self.user_templates[name] = template
+
+    def own_keys(self) -> KeyCodeRegistry:
+        """
+        Returns the key code registry of the context, copying the built-in
+        one first if it is still shared.
+        """
+        if self.keys is KEY_REGISTRY:
+            self.keys = KEY_REGISTRY.copy()
+        return self.keys
+
+    @contextmanager
+    def activate(self) -> Iterator["CompileContext"]:
+        """
+        Makes this the current context of the thread within the with block.
+        """
+        token = CURRENT_CONTEXT.set(self)
+        try:
+            yield self
+        finally:
+            CURRENT_CONTEXT.reset(token)
+
+
+DEFAULT_CONTEXT = CompileContext()
+CURRENT_CONTEXT: ContextVar[CompileContext] = ContextVar("compile_context")
+
+
+def current_context() -> CompileContext:
+    """
+    Returns the context the current thread compiles with.
+    """
+    return CURRENT_CONTEXT.get(DEFAULT_CONTEXT)
+
+
+def use_context(context: CompileContext):
+    """
+    Makes the context the current context of the thread for the rest of its
+    life, e.g. in a worker process that translates the layers of one config.
+    """
+    CURRENT_CONTEXT.set(context)
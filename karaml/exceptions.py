@@ -11,6 +11,25 @@ def configError(string: str):
     sys_exit()
 
 
+def duplicateKeys(report: str):
+    configError(
+        f"{report}\n\n"
+        "Remove the duplicate keys, or pass --on-duplicate=first or\n"
+        "--on-duplicate=last to keep the first or last value of each."
+    )
+
+
+def invalidBackupPolicy(policy, note: str):
+    configError(f"Invalid backups section: {policy}\n{note}")
+
+
+def invalidCompactProfiles(value):
+    configError(
+        "Invalid value for compact_profiles: "
+        f"{value}.\nValue must be a number of profiles to keep, e.g. 1"
+    )
+
+
 def invalidConditionValue(name: str, value: str):
     configError(
         f"Invalid value for condition: {name}={value}.\n"
@@ -19,6 +38,13 @@ def invalidConditionValue(name: str, value: str):
     )
 
 
+def invalidConfigRoot(mark):
+    configError(
+        "The config must be a map of layers and sections, e.g. `/base/:`,\n"
+        f"but got something else at:\n{mark}"
+    )
+
+
 def invalidFrontmostAppCondition(condition: str, map_rhs: dict):
     configError(
         "Invalid condition for frontmost_application\n"
@@ -133,6 +159,14 @@ def invalidParamValues(param_dict: dict, value: int):
     )
 
 
+def invalidProfiles(profile):
+    configError(
+        f"Invalid item in profiles: {profile}\n"
+        "profiles must be a list of unique profile names or maps with a "
+        "`name` and optional `parameters`"
+    )
+
+
 def invalidSoftFunct(string: str):
     configError(
         "Invalid software function argument: need well formed dict. "
@@ -0,0 +1,75 @@
+"""
+Advisory file locks for the files karaml reads, modifies and writes back.
+
+A watch process, an editor hook and a manual run can all update karabiner.json
+or a complex modifications file at the same time. Each of them reads the file,
+backs it up and writes a new version, so two interleaved updates could lose one
+of them. `file_lock` serializes these cycles with an `fcntl.flock` lock on a
+lock file next to the target (`.karabiner.json.lock`), which is released even
+if the process dies.
+
+A writer that finds the file locked waits its turn, polling the lock until
+karaml.cfg.LOCK_TIMEOUT seconds have passed, and then gives up with a
+FileLockTimeout. The time spent waiting for and holding locks is recorded in
+the `lock_wait` and `lock_held` timing stages.
+"""
+
+import fcntl
+from contextlib import contextmanager
+from pathlib import Path
+from time import monotonic, sleep
+
+import karaml.cfg
+from karaml.timings import TIMINGS
+
+POLL_INTERVAL = 0.05
+
+
+class FileLockTimeout(Exception):
+    def __init__(self, path: Path, timeout: float):
+        super().__init__(
+            f"Could not lock {path} within {timeout:g} seconds, another "
+            "karaml process is updating it.\n"
+            "Try again once it is done, or raise the limit with "
+            "--lock-timeout.\n")
+
+
+def lock_file_path(path: Path) -> Path:
+    """
+    Returns the lock file for a file. Symlinks are resolved first, so every
+    link to the same file shares its lock.
+    """
+    path = Path(path).resolve()
+    return path.with_name(f".{path.name}.lock")
+
+
+@contextmanager
+def file_lock(path: Path, timeout: float | None = None):
+    """
+    Holds an exclusive advisory lock on the file for the duration of the
+    block. Raises FileLockTimeout if the lock isn't free within the timeout
+    (karaml.cfg.LOCK_TIMEOUT by default).
+    """
+    if timeout is None:
+        timeout = karaml.cfg.LOCK_TIMEOUT
+    lock_path = lock_file_path(path)
+    if not lock_path.parent.is_dir():
+        # Nothing to protect, the file can't be there either
+        yield
+        return
+    with open(lock_path, "a") as lock:
+        with TIMINGS.stage("lock_wait"):
+            deadline = monotonic() + timeout
+            while True:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if monotonic() >= deadline:
+                        raise FileLockTimeout(path, timeout) from None
+                    sleep(POLL_INTERVAL)
+        try:
+            with TIMINGS.stage("lock_held"):
+                yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
@@ -0,0 +1,18 @@
+"""
+Small helpers for the files karaml watches, reads and writes, shared by the
+watcher and the writers without either depending on the other.
+"""
+
+from pathlib import Path
+
+
+def file_signature(path: Path) -> tuple[int, int] | None:
+    """
+    Returns a tuple of the modification time and size of a file, or None if
+    the file does not exist (e.g. in the middle of an editor's atomic save).
+    """
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
@@ -1,60 +1,40 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from dataclasses import dataclass
 from datetime import datetime
-from json import dumps, loads
+from functools import partial
+from json import loads
 from pathlib import Path
-from shutil import copyfile
 
+from karaml.backups import (
+    RetentionPolicy,
+    StagedBackup,
+    backup_karabiner_json,
+    discard_staged_backup,
+    report_missing_karabiner_json,
+    stage_backup,
+)
+from karaml.file_lock import FileLockTimeout, file_lock
+from karaml.file_utils import file_signature
+from karaml.json_patch import patch_values
+from karaml.json_writer import (
+    WriteAborted,
+    chunks_digest,
+    file_digest,
+    iter_json,
+    write_chunks,
+    write_json,
+)
 from karaml.karaml_config import KaramlConfig
+from karaml.profiles import (
+    AUTO_PROFILE_PREFIX,
+    compact_profiles,
+    report_compaction,
+)
+from karaml.timings import TIMINGS, timed
 
-
-def backup_karabiner_json(karabiner_path: Path) -> bool:
-    """
-    Backs up karabiner.json to automatic_backups folder.
-    Returns True if backup was successful, False otherwise.
-    """
-
-    current_time = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    backup_dir = karabiner_path / "automatic_backups"
-    backup_dir.mkdir(parents=True, exist_ok=True)
-    backup_dir_size = get_backup_folder_size(backup_dir)
-    report_backup_folder_size(backup_dir, backup_dir_size)
-
-    karabiner_json = karabiner_path / "karabiner.json"
-    backup_file = backup_dir / f"karabiner.backup.{current_time}.json"
-    try:
-        copyfile(karabiner_json, backup_file)
-        print("Backed up karabiner.json to:"
-              f"\n~/{backup_file.relative_to(Path.home())}\n")
-
-        return True
-    except FileNotFoundError:
-        print(f"Could not find {karabiner_json}.\n"
-              "Please check your karabiner.json path.\n"
-              "By default, it is ~/.config/karabiner/karabiner.json\n"
-              "Aborting attempt to update karabiner.json\n")
-        return False
-
-
-def get_backup_folder_size(backup_dir: Path) -> int:
-    """
-    Returns the size of the backup folder in bytes.
-    """
-    size = 0
-    for file in backup_dir.iterdir():
-        if file.is_file():
-            size += file.stat().st_size
-    return size
-
-
-def report_backup_folder_size(backup_dir: Path, size: int):
-    """
-    Reports the size of the backup folder in MB. Warns the user if the
-    size is over 100 MB.
-    """
-    if size > 100000000:
-        print("WARNING! Backup folder size is over 100 MB.")
-    rounded_size = round(size / 1000000, 2)
-    print(f"Backup folder size: {rounded_size} MB\n")
-    print(f"Backup folder: ~/{backup_dir.relative_to(Path.home())}\n")
+PROFILE_TEMPLATE = Path(__file__).parent / "profile_template.json"
+COMPLEX_MODS_PATH = "~/.config/karabiner/assets/complex_modifications"
 
 
 def basic_rules_dict(karaml_config) -> dict:
@@ -78,12 +58,13 @@ def match_profile_name(profiles: dict, profile_name: str) -> dict:
     return {}
 
 
-def new_profile_dict(karaml_config, profile_name: str) -> dict:
-    with open("profile_template.json", "r") as f:
+def new_profile_dict(karaml_config, profile_name: str,
+                     params: dict | None = None) -> dict:
+    with open(PROFILE_TEMPLATE, "r") as f:
         profile_template = f.read()
 
     profiles_dict = loads(profile_template)
-    template = update_complex_mods(profiles_dict, karaml_config)
+    template = update_complex_mods(profiles_dict, karaml_config, params)
     template["name"] = profile_name
     return template
 
@@ -94,7 +75,7 @@ def set_profile_name(karaml_config: KaramlConfig) -> tuple[str, bool]:
     # time as as a unique identifier if no profile name is provided
     if not profile_name:
         current_time = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        profile_name = "Karaml Profile " + str(current_time)
+        profile_name = AUTO_PROFILE_PREFIX + str(current_time)
         print("No profile name specified, using: " + profile_name)
         print("Consider renaming the profile in Karabiner-Elements")
         is_set = False
@@ -103,88 +84,380 @@ def set_profile_name(karaml_config: KaramlConfig) -> tuple[str, bool]:
     return profile_name, is_set
 
 
-def update_complex_mods(profile_dict: dict, karaml_config) -> dict:
+def target_profiles(karaml_config: KaramlConfig,
+                    profile_names: list[str] | None = None) -> list[tuple]:
+    """
+    Returns a (profile_name, is_set, params) tuple for every profile to
+    update: the profile names passed on the command line, else the config's
+    `profiles` list, else its `profile_name`. params holds the profile's
+    parameter overrides from the config's `profiles` list, if any. A name
+    passed more than once is only updated once.
+    """
+    overrides = {
+        profile["name"]: profile["params"]
+        for profile in karaml_config.profiles
+    }
+    if profile_names:
+        return [(name, True, overrides.get(name, {}))
+                for name in dict.fromkeys(profile_names)]
+    if overrides:
+        return [(name, True, params) for name, params in overrides.items()]
+    return [(*set_profile_name(karaml_config), {})]
+
+
+def merge_params(karaml_config: KaramlConfig, params: dict | None) -> dict:
+    """
+    Returns the config's complex modification parameters with a profile's
+    overrides applied on top.
+    """
+    if not params:
+        return karaml_config.params
+    base = karaml_config.params.get("parameters", {})
+    return {"parameters": {**base, **params["parameters"]}}
+
+
+def update_complex_mods(profile_dict: dict, karaml_config,
+                        params: dict | None = None) -> dict:
     karaml_dict = basic_rules_dict(karaml_config)
     complex_mods = profile_dict["complex_modifications"]
     complex_mods.update(karaml_dict)
-    if karaml_config.params:
-        complex_mods.update(karaml_config.params)
+    if params := merge_params(karaml_config, params):
+        complex_mods.update(params)
     return profile_dict
 
 
-def update_karabiner_json(karaml_config: KaramlConfig):
+@dataclass
+class KarabinerSnapshot:
+    """
+    karabiner.json as it was read before an update.
+
+    Attributes:
+        text: The text of karabiner.json.
+        data: The parsed text.
+        signature: The modification time and size of the file when it was
+            read, see karaml.file_utils.file_signature.
+        staged_backup: The backup of the text, stored ahead of time if the
+            snapshot was prefetched.
+    """
+    text: str
+    data: dict
+    signature: tuple[int, int] | None
+    staged_backup: StagedBackup | None = None
+
+
+def read_karabiner_json(karabiner_path: Path, stage: bool = False
+                        ) -> KarabinerSnapshot | None:
+    """
+    Reads and parses karabiner.json, and stages its backup if stage is True.
+    Returns None if karabiner.json is missing.
+    """
+    karabiner_json = karabiner_path / "karabiner.json"
+    signature = file_signature(karabiner_json)
+    try:
+        with open(karabiner_json, "r") as f:
+            karabiner_config = f.read()
+    except FileNotFoundError:
+        return None
+    staged = stage_backup(karabiner_path) if stage else None
+    return KarabinerSnapshot(
+        karabiner_config, loads(karabiner_config), signature, staged)
+
+
+class KarabinerPrefetch:
+    """
+    Reads, parses and stages the backup of karabiner.json, either in a
+    background thread while the karaml config is built, or on demand.
+
+    Started in the background, the I/O of an update overlaps with the
+    translation of the layers, and only the patching and the write are left
+    once the config is built. The background thread doesn't take the lock on
+    karabiner.json (see karaml.file_lock), so other karaml processes can
+    update it during the build and its prompts. The lock is only taken when
+    the snapshot is used: if karabiner.json or the backup manifest changed
+    since they were read, the snapshot is dropped and the file is read again.
+
+    Use as a context manager, which takes the lock, returns the snapshot
+    (None if karabiner.json is missing) and releases the lock on exit. Raises
+    FileLockTimeout if the lock couldn't be taken. A prefetch that is never
+    used, e.g. because the build failed, must be closed to drop its staged
+    backup.
+    """
+
+    def __init__(self, karabiner_path: Path | None = None,
+                 background: bool = True):
+        self.karabiner_path = karabiner_path or \
+            Path("~/.config/karabiner").expanduser()
+        self.karabiner_json = self.karabiner_path / "karabiner.json"
+        self.lock = ExitStack()
+        self.future = None
+        if background:
+            executor = ThreadPoolExecutor(max_workers=1)
+            self.future = executor.submit(self.prefetch)
+            executor.shutdown(wait=False)
+
+    @timed("prefetch_karabiner_json")
+    def prefetch(self) -> KarabinerSnapshot | None:
+        return read_karabiner_json(self.karabiner_path, stage=True)
+
+    def __enter__(self) -> KarabinerSnapshot | None:
+        try:
+            self.lock.enter_context(file_lock(self.karabiner_json))
+            return self.snapshot()
+        except BaseException:
+            self.lock.close()
+            raise
+
+    def snapshot(self) -> KarabinerSnapshot | None:
+        if not self.future:
+            return read_karabiner_json(self.karabiner_path)
+        future, self.future = self.future, None
+        with TIMINGS.stage("prefetch_wait"):
+            snapshot = future.result()
+        if snapshot and not self.is_current(snapshot):
+            # Changed since it was read, by another karaml process or e.g.
+            # by Karabiner-Elements itself
+            self.drop(snapshot)
+            return read_karabiner_json(self.karabiner_path)
+        return snapshot
+
+    def is_current(self, snapshot: KarabinerSnapshot) -> bool:
+        """
+        Returns True if neither karabiner.json nor the backup manifest the
+        snapshot was staged with changed since they were read.
+        """
+        staged = snapshot.staged_backup
+        return snapshot.signature == file_signature(self.karabiner_json) \
+            and (staged is None or staged.manifest_signature ==
+                 file_signature(staged.manifest.path))
+
+    def drop(self, snapshot: KarabinerSnapshot | None):
+        """
+        Discards the staged backup of the snapshot, unless another karaml
+        process updated the backups since, which may have recorded the same
+        object. Must be called with the lock held.
+        """
+        staged = snapshot and snapshot.staged_backup
+        if staged and staged.manifest_signature == \
+                file_signature(staged.manifest.path):
+            discard_staged_backup(staged)
+
+    def __exit__(self, *exc_info):
+        self.lock.close()
+        return False
+
+    def close(self):
+        """
+        Drops the snapshot if it wasn't used, discarding its staged backup.
+        """
+        future, self.future = self.future, None
+        try:
+            snapshot = future.result() if future else None
+            if snapshot and snapshot.staged_backup:
+                with file_lock(self.karabiner_json):
+                    self.drop(snapshot)
+        except Exception:
+            # Leaves the staged object rather than masking a build error
+            pass
+
+
+def update_karabiner_json(karaml_config: KaramlConfig,
+                          profile_names: list[str] | None = None,
+                          prefetch: KarabinerPrefetch | None = None):
     """
     Updates karabiner.json with the karaml config. If no profile name is
     specified, a new profile is created with the current time as a unique
     identifier. If a profile name is specified, the profile with that name
     is updated. If no profile with that name is found, a new profile is
     created with the specified name.
+
+    Several profiles can be updated at once, either by passing their names
+    or with the config's `profiles` list (see target_profiles). karabiner.json
+    is still read, backed up and written only once.
+
+    Other karaml processes can't update karabiner.json between the read and
+    the write, see karaml.file_lock. If karabiner.json was already read in the
+    background while the config was built, pass the KarabinerPrefetch.
+
+    Only the updated profiles' complex_modifications (or the new profiles)
+    are written into the existing text of karabiner.json, leaving the rest of
+    the file as it was. See karaml.json_patch.
+
+    If the config sets `compact_profiles`, stale profiles generated by
+    earlier runs are removed in the same write. See karaml.profiles.
     """
 
     print("\nUpdating karabiner.json...\n")
 
-    karabiner_path = Path("~/.config/karabiner").expanduser()
-    if not backup_karabiner_json(karabiner_path):
+    prefetch = prefetch or KarabinerPrefetch(background=False)
+    try:
+        with prefetch as snapshot:
+            patch_karabiner_json(karaml_config, prefetch.karabiner_path,
+                                 snapshot, profile_names)
+    except FileLockTimeout as e:
+        print(e)
+
+
+def patch_karabiner_json(karaml_config: KaramlConfig, karabiner_path: Path,
+                         snapshot: KarabinerSnapshot | None,
+                         profile_names: list[str] | None = None):
+    """
+    Does the patching, backup and write of update_karabiner_json, which holds
+    the lock on karabiner.json meanwhile.
+    """
+    karabiner_json = karabiner_path / "karabiner.json"
+    if snapshot is None:
+        report_missing_karabiner_json(karabiner_json)
         return
+    karabiner_config, karabiner_dict = snapshot.text, snapshot.data
+
+    removed_profiles, bytes_saved = [], 0
+    if karaml_config.compact_profiles is not None:
+        karabiner_config, removed_profiles, bytes_saved = compact_profiles(
+            karabiner_config, karabiner_dict, karaml_config.compact_profiles)
 
-    with open(karabiner_path / "karabiner.json", "r") as f:
-        karabiner_config = f.read()
-    karabiner_dict = loads(karabiner_config)
     profiles = karabiner_dict["profiles"]
-    profile_name, is_set = set_profile_name(karaml_config)
-    found_profile = match_profile_name(profiles, profile_name)
+    targets = target_profiles(karaml_config, profile_names)
+    patches, updated = [], []
+    for profile_name, is_set, params in targets:
+        found_profile = match_profile_name(profiles, profile_name)
+        if is_set and found_profile:
+            update_complex_mods(found_profile, karaml_config, params)
+            profile_index = next(
+                i for i, profile in enumerate(profiles)
+                if profile is found_profile)
+            patches.append((
+                "replace",
+                ["profiles", profile_index, "complex_modifications"],
+                found_profile["complex_modifications"],
+            ))
+            updated.append(f"profile: {profile_name}.")
+        else:
+            print(f"Could not find profile with name: {profile_name}.\n"
+                  "Creating new profile with determined name.\n")
+            new_profile = new_profile_dict(karaml_config, profile_name, params)
+            profiles.append(new_profile)
+            patches.append(("append", ["profiles"], new_profile))
+            updated.append(f"with new profile: {profile_name}.")
+
+    # If the stale profiles couldn't be removed from the text, there is no
+    # text to patch and the whole file is written from karabiner_dict
+    patched_config = karabiner_config and patch_values(
+        karabiner_config, patches)
+
+    # The backup is only made once the new content is known to differ, so an
+    # unchanged build doesn't touch karabiner.json or its backups at all.
+    # If karabiner.json isn't formatted the way Karabiner-Elements writes it,
+    # write the whole file instead
+    written = write_chunks(
+        karabiner_json,
+        patched_config or iter_json(karabiner_dict),
+        before_replace=partial(
+            backup_karabiner_json,
+            karabiner_path,
+            RetentionPolicy.from_dict(karaml_config.backup_policy),
+            snapshot.staged_backup,
+        ),
+    )
+    if not written and snapshot.staged_backup:
+        discard_staged_backup(snapshot.staged_backup)
+    if not written:
+        target_names = ", ".join(name for name, _, _ in targets)
+        print(f"karabiner.json is unchanged for profile: {target_names}.")
+        return
+    if removed_profiles:
+        report_compaction(removed_profiles, bytes_saved)
+    for detail in updated:
+        print(f"Updated karabiner.json {detail}")
+
+
+def confirm_overwrite(to_file: str):
+    """
+    Asks the user to confirm overwriting an existing complex modifications
+    file. Raises WriteAborted if the user declines, or exits if they quit.
+    """
+    overwrite = None
+    while overwrite not in ["Y", "N"]:
+        overwrite = input(
+            f"'{to_file}' already exists. Overwrite? [Y/N] "
+        )
+        if overwrite == "Y":
+            print("Overwriting.")
+        elif overwrite == "N":
+            print("Aborting.")
+            raise WriteAborted
+        elif overwrite == "q" or overwrite == "Q":
+            print("Quitting.")
+            exit()
+        else:
+            print("Please enter Y or N (uppercase) to continue"
+                  "or q to quit.")
+
+
+def confirm_before_lock(path: Path, digest: str, to_file: str) -> str | None:
+    """
+    Asks the user to confirm overwriting the file if it exists with other
+    content than the digest. Called before the file is locked, so other
+    karaml processes don't wait on the prompt. Returns the digest of the
+    file the user agreed to overwrite (None if it doesn't exist), for
+    unchanged_since to check under the lock. Raises WriteAborted if the
+    user declines.
+    """
+    confirmed = file_digest(path)
+    if confirmed is not None and confirmed != digest:
+        confirm_overwrite(to_file)
+    return confirmed
 
-    if is_set and found_profile:
-        update_complex_mods(found_profile, karaml_config)
-        update_detail = ""
-    else:
-        print(f"Could not find profile with name: {profile_name}.\n"
-              "Creating new profile with determined name.\n")
-        new_profile = new_profile_dict(karaml_config, profile_name)
-        profiles.append(new_profile)
-        update_detail = "with new "
 
-    with open(karabiner_path / "karabiner.json", "w") as f:
-        f.write(dumps(karabiner_dict, indent=4))
-        print(
-            f"Updated karabiner.json {update_detail}profile: {profile_name}.")
+def unchanged_since(path: Path, confirmed: str | None, to_file: str):
+    """
+    Returns a before_replace callback for write_chunks that aborts the write
+    if the file changed since the user confirmed overwriting it.
+    """
+    def check():
+        if file_digest(path) != confirmed:
+            print(f"'{to_file}' changed while waiting for confirmation. "
+                  "Aborting.")
+            raise WriteAborted
+    return check
 
 
-def write_complex_mods_json(karaml_config, to_file: str):
+def write_complex_mods_json(karaml_config, to_file: str,
+                            overwrite: bool = False):
     """
     Writes the karaml config to a complex modifications json file. This
-    file can be imported into Karabiner-Elements using the GUI.
+    file can be imported into Karabiner-Elements using the GUI. If the file
+    already exists with different content, the user is asked to confirm the
+    overwrite unless overwrite is True. An unchanged file is left as is.
+    The user is asked before the file is locked, see confirm_before_lock.
     """
     if not to_file or not karaml_config:
         print("No destination file or karaml config provided. Aborting.")
         return
-    complex_mods_path_str = "~/.config/karabiner/assets/complex_modifications"
-    complex_mods_path = Path(complex_mods_path_str).expanduser()
+    complex_mods_path = Path(COMPLEX_MODS_PATH).expanduser()
 
     print("\nWriting complex modifications to:\n"
-          f"{complex_mods_path_str}/{to_file}\n")
-
-    if Path(complex_mods_path / to_file).exists():
-        overwrite = None
-        while overwrite not in ["Y", "N"]:
-            overwrite = input(
-                f"'{to_file}' already exists. Overwrite? [Y/N] "
-            )
-            if overwrite == "Y":
-                print("Overwriting.")
-            elif overwrite == "N":
-                print("Aborting.")
-                return
-            elif overwrite == "q" or overwrite == "Q":
-                print("Quitting.")
-                exit()
-            else:
-                print("Please enter Y or N (uppercase) to continue"
-                      "or q to quit.")
+          f"{COMPLEX_MODS_PATH}/{to_file}\n")
 
     rules_name = karaml_config.title if karaml_config.title else "Karaml rules"
     karaml_dict = basic_rules_dict(karaml_config)
+    complex_mods_file = complex_mods_path / to_file
 
-    with open(complex_mods_path / to_file, "w") as f:
-        f.write(dumps(karaml_dict, indent=4))
-        print(f"Wrote '{rules_name}' complex modifications to {to_file}.")
+    confirm = None
+    try:
+        if complex_mods_file.exists() and not overwrite:
+            confirmed = confirm_before_lock(
+                complex_mods_file, chunks_digest(iter_json(karaml_dict)),
+                to_file)
+            confirm = unchanged_since(complex_mods_file, confirmed, to_file)
+        with file_lock(complex_mods_file):
+            written = write_json(complex_mods_file, karaml_dict, confirm)
+    except WriteAborted:
+        return
+    except FileLockTimeout as e:
+        print(e)
+        return
+    if not written:
+        print(f"'{rules_name}' complex modifications in {to_file} are "
+              "unchanged.")
+        return
+    print(f"Wrote '{rules_name}' complex modifications to {to_file}.")
@@ -1,11 +1,21 @@
 import ast
-from re import Match, search
+import sys
+from dataclasses import dataclass
 from sys import exit as sys_exit
 
 import yaml
 from yaml import SafeLoader
 
+try:
+    from yaml import CSafeLoader
+except ImportError:
+    # PyYAML was built without libyaml
+    CSafeLoader = None
+
+import karaml.cfg
+from karaml.compile_context import current_context
 from karaml.exceptions import (
+    duplicateKeys,
     invalidConditionValue,
     invalidDictFormatInString,
     invalidFlag,
@@ -20,79 +30,186 @@ from karaml.exceptions import (
     invalidToOpt,
     invalidTotalParensInMods,
 )
-from karaml.key_codes import (
-    CONSUMER_KEY_CODE,
-    KEY_CODE,
-    MODIFIER_ALIASES,
-    MODIFIERS,
-    POINTING_BUTTON,
-    STICKY_MODS,
-)
+from karaml.key_codes import MODIFIERS, STICKY_MODS
+from karaml.map_parser import ModifierGroups, scan_layer
+from karaml.timings import timed
+
 
+DUPLICATE_POLICIES = ["error", "first", "last", "prompt"]
+STR_TAG = "tag:yaml.org,2002:str"
+MERGE_TAG = "tag:yaml.org,2002:merge"
 
-def extract_yaml_node_value(mapping_node):
+
+def describe_yaml_node(node) -> str:
     """
-    Gets the value of a YAML node representing either a single complex
+    Describes the value of a YAML node representing either a single complex
     modification or a layer of complex modifications. This is used to
-    print the key or layer that is being overwritten when a duplicate YAML key
+    show the key or layer that is being overwritten when a duplicate YAML key
     is found in the YAML file.
     If the node is a single complex modification, the value is the 'to' event/s
     of the complex modification.
     If the node is a layer, the value is the list of all the 'from' events
     of the complex modifications in the layer.
     """
-    print("Value:")
-    if not isinstance(mapping_node, yaml.nodes.MappingNode):
-        print("    ", mapping_node.value)
-        return mapping_node
-    for key_node, _ in mapping_node.value:
-        key = key_node.value
-        print("    ", key)
+    if isinstance(node, yaml.nodes.MappingNode):
+        values = [str(key_node.value) for key_node, _ in node.value]
+    else:
+        values = [str(node.value)]
+    return "Value:\n" + "\n".join(f"     {value}" for value in values)
+
+
+@dataclass
+class DuplicateKey:
+    """
+    A key that appears more than once in the same mapping of a YAML file.
+
+    Attributes:
+        key: The key.
+        mark: Where the duplicate is in the file.
+        first_mark: Where the key first appears in the mapping.
+        value_node: The YAML node of the duplicate's value.
+    """
+    key: object
+    mark: yaml.Mark
+    first_mark: yaml.Mark
+    value_node: yaml.Node
 
+    def __str__(self) -> str:
+        return (f"Duplicate key found in YAML\n{self.mark}\n"
+                f"First defined\n{self.first_mark}\n\n"
+                f"Key: {self.key}\n{describe_yaml_node(self.value_node)}")
 
-class UniqueKeyLoader(SafeLoader):
+
+class DuplicateKeyCheck:
     """
-    This class inherits from the SafeLoader class of the PyYAML library.
-    It overrides the compose_mapping_node method to check for duplicate
-    keys in the YAML file.
+    A mixin for the loaders of the PyYAML library that checks every mapping
+    in the YAML file for duplicate keys before it is constructed.
+
+    The check is done when the mapping is constructed rather than when its
+    node is composed, since the C loaders compose the nodes in libyaml. The
+    duplicates of the whole file are collected in `duplicates` in a single
+    pass, without stopping the load, and resolved afterwards by
+    resolve_duplicate_keys. With the "first" policy (karaml.cfg.ON_DUPLICATE),
+    the later values of a duplicate key are left out of the mapping,
+    otherwise the last value wins as usual.
     """
 
-    def check_duplicate_keys(self, node):
+    def __init__(self, stream):
+        super().__init__(stream)
+        self.duplicates: list[DuplicateKey] = []
+
+    @timed("check_duplicate_keys")
+    def check_duplicate_keys(self, node) -> list[tuple]:
         """
-        Checks for duplicate keys in the YAML file. If a duplicate key is
-        found, the key and the value of the key are printed to the console, and
-        the warn_duplicate_key function is called to confirm that the user
-        wants to overwrite the key.
+        Records the duplicate keys of a mapping node and returns the key and
+        value nodes to construct the mapping from. String keys are compared
+        by the text of their node, other keys (e.g. numbers) are
+        constructed first.
         """
-        keys = set()
+        keep_first = karaml.cfg.ON_DUPLICATE == "first"
+        seen, items = {}, []
         for key_node, value_node in node.value:
-            key = self.construct_object(key_node, deep=False)
-            if key in keys:
-                print(f"Duplicate key found in YAML\n{key_node.start_mark}")
-                print(f"\nKey: {key}")
-                value_node = extract_yaml_node_value(value_node)
-                warn_duplicate_key()
-            keys.add(key)
-
-    def compose_mapping_node(self, anchor):
+            if key_node.tag == MERGE_TAG:
+                items.append((key_node, value_node))
+                continue
+            if key_node.tag == STR_TAG:
+                key = key_node.value
+            else:
+                key = self.construct_object(key_node, deep=False)
+            if key not in seen:
+                seen[key] = key_node.start_mark
+            else:
+                self.duplicates.append(DuplicateKey(
+                    key, key_node.start_mark, seen[key], value_node))
+                if keep_first:
+                    continue
+            items.append((key_node, value_node))
+        return items
+
+    def construct_mapping(self, node, deep=False):
         """
-        Overloads the compose_mapping_node method of the SafeLoader class to
-        check for duplicate keys in the YAML file.
+        Overloads the construct_mapping method of the SafeConstructor class
+        to check for duplicate keys in the YAML file.
         """
-        node = super().compose_mapping_node(anchor)
-        self.check_duplicate_keys(node)
-        return node
+        items = self.check_duplicate_keys(node)
+        if len(items) != len(node.value):
+            node.value = items
+        return super().construct_mapping(node, deep)
+
+
+class PyUniqueKeyLoader(DuplicateKeyCheck, SafeLoader):
+    """
+    The pure-Python SafeLoader of the PyYAML library, checking for duplicate
+    keys.
+    """
+
+
+if CSafeLoader is not None:
+    class CUniqueKeyLoader(DuplicateKeyCheck, CSafeLoader):
+        """
+        The CSafeLoader of the PyYAML library, which parses and composes the
+        YAML file with libyaml, checking for duplicate keys. Several times
+        faster than PyUniqueKeyLoader on large configs.
+        """
+
+    UniqueKeyLoader = CUniqueKeyLoader
+else:
+    UniqueKeyLoader = PyUniqueKeyLoader
+
+
+def load_unique_keys(stream, loader=UniqueKeyLoader):
+    """
+    Loads a YAML document, checking for duplicate keys. Returns the data and
+    the duplicate keys found, in the order they appear in the file.
+    """
+    yaml_loader = loader(stream)
+    try:
+        data = yaml_loader.get_single_data()
+    finally:
+        yaml_loader.dispose()
+    duplicates = sorted(yaml_loader.duplicates,
+                        key=lambda d: (d.mark.line, d.mark.column))
+    return data, duplicates
+
+
+def resolve_duplicate_keys(duplicates: list[DuplicateKey],
+                           policy: str | None = None):
+    """
+    Applies a duplicate key policy (karaml.cfg.ON_DUPLICATE by default) to
+    the duplicate keys found in the config:
+
+        error: reports every duplicate key and exits
+        first: reports them and keeps the first value of each key
+        last: reports them and keeps the last value of each key
+        prompt: reports them and asks whether to continue with the last
+            values. Falls back to error if stdin isn't a terminal, so an
+            unattended build can't stall.
+    """
+    if not duplicates:
+        return
+    policy = policy or karaml.cfg.ON_DUPLICATE
+    if policy == "prompt" and not sys.stdin.isatty():
+        policy = "error"
+    report = "\n\n".join(str(duplicate) for duplicate in duplicates)
+    if policy == "error":
+        duplicateKeys(report)
+        return
+    print(report)
+    if policy == "prompt":
+        warn_duplicate_key()
+        return
+    print(f"\nKeeping the {policy} value of each duplicate key.\n")
 
 
 def warn_duplicate_key():
     """
-    Confirms that the user wants to overwrite a key that is already
+    Confirms that the user wants to overwrite keys that are already
     defined in the map. This is to prevent accidental overwrites.
-    Continue to overwrite the key if the user confirms, else exit.
+    Continue to overwrite the keys if the user confirms, else exit.
     """
     continue_check = input("""
-This is a duplicate key in the same layer or a duplicate layer name.
-This will overwrite the previous key or layer.
+These are duplicate keys in the same layer or duplicate layer names.
+They will overwrite the previous keys or layers.
 
 Do you want to continue? (y/n): """).lower()
 
@@ -144,16 +261,17 @@ def get_multi_keys(string: str) -> list[str]:
     return []
 
 
-def is_layer(string: str) -> Match | None:
+def is_layer(string: str) -> str | None:
     """
-    Returns True if the string matches the regex for an acceptable layer name.
+    Returns the layer name if the string is an acceptable layer reference,
+    e.g. '/nav/', otherwise None.
 
     This function is used to determine what kind of to-event to assign the
     string to. If it is a layer, we might want to assign it to a 'to' event
     rather than a 'to_if_held_down' event so the layer can be accessed
     immediately without waiting for the 'to_if_held_down_threshold'.
     """
-    return search("^/([^/]+)/$", string)
+    return scan_layer(string)
 
 
 def validate_alias_key_code(alias_def: str) -> bool:
@@ -165,12 +283,7 @@ def validate_alias_key_code(alias_def: str) -> bool:
     """
     return (
         isinstance(alias_def, str) and
-        any(alias_def in x for x in (
-            KEY_CODE,
-            POINTING_BUTTON,
-            CONSUMER_KEY_CODE,
-            MODIFIER_ALIASES,
-        ))
+        current_context().keys.is_valid_key_code(alias_def)
     )
 
 
@@ -313,11 +426,7 @@ def validate_layer(string: str) -> str | None:
     The format must be a string enclosed in forward slashes, e.g. '/layer1/'
     with only alphanumeric characters and underscores.
     """
-    layer: Match | None = is_layer(string)
-    if not layer:
-        invalidLayerName(string)
-        return
-    return layer.group(1) or invalidLayerName(string)
+    return is_layer(string) or invalidLayerName(string)
 
 
 def validate_mod_aliases(mods: str) -> str:
@@ -364,15 +473,16 @@ def validate_to_opts(string: str) -> str:
     invalidToOpt(string)
 
 
-def validate_optional_mod_sets(mod_string: str, opt_mod_matches: list):
+def validate_optional_mod_sets(mod_string: str, mod_groups: ModifierGroups):
     """
     Check that if a user has added any optional modifiers to a map, they are
     formatted correctly. A correctly formatted modifier string will have only
     one set of parentheses containing the optional modifiers, and these must be
     either at the beginning or end of the string.
     """
-    if len(opt_mod_matches) > 1 or search("\\w+\\(\\w+\\)\\w+", mod_string):
-        invalidTotalParensInMods(mod_string, opt_mod_matches)
+    optional_sets = list(mod_groups.optional_sets)
+    if len(optional_sets) > 1 or mod_groups.split:
+        invalidTotalParensInMods(mod_string, optional_sets)
 
 
 def validate_sticky_mod_value(string: str):
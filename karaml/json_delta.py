@@ -0,0 +1,113 @@
+"""
+Structural deltas between two JSON documents.
+
+Consecutive versions of karabiner.json usually differ in a handful of
+manipulators, so a delta that only spells out what changed is a small fraction
+of the document. `diff_json` returns such a delta as a JSON-serializable op,
+and `apply_delta` rebuilds the new document from the old one and the op.
+
+The ops are:
+
+    ["same"]                      the value is unchanged
+    ["set", value]                the value is replaced
+    ["dict", keys, {key: op}]     a dict whose changed keys are patched. keys
+                                  is the new key order, or null if it is the
+                                  same as the old one
+    ["list", [item, ...]]         a list, item by item. An int item copies the
+                                  old item at that index, ["patch", i, op]
+                                  patches it, and ["set", value] is new
+
+Items of a list are matched with the old list by content first, so inserting
+or removing a rule doesn't make every rule after it look changed. Items with
+no exact match are patched against the old item at the same position.
+"""
+
+from json import dumps
+
+SAME = ["same"]
+
+
+def diff_json(old, new) -> list:
+    """
+    Returns the op that turns the old value into the new one.
+    """
+    # Compared as JSON, since True == 1 and dicts with different key orders
+    # are equal in Python
+    if type(old) is type(new) and dumps(old) == dumps(new):
+        return SAME
+    if isinstance(old, dict) and isinstance(new, dict):
+        return diff_dict(old, new)
+    if isinstance(old, list) and isinstance(new, list):
+        return diff_list(old, new)
+    return ["set", new]
+
+
+def diff_dict(old: dict, new: dict) -> list:
+    changed = {}
+    for key, value in new.items():
+        if key not in old:
+            changed[key] = ["set", value]
+            continue
+        op = diff_json(old[key], value)
+        if op is not SAME:
+            changed[key] = op
+    keys = None if list(old) == list(new) else list(new)
+    return ["dict", keys, changed]
+
+
+def diff_list(old: list, new: list) -> list:
+    old_index = {}
+    for i, item in enumerate(old):
+        old_index.setdefault(dumps(item), i)
+    items = []
+    for i, item in enumerate(new):
+        match = old_index.get(dumps(item))
+        if match is not None:
+            items.append(match)
+        elif i < len(old) and isinstance(item, (dict, list)):
+            items.append(patch_or_set(i, old[i], item))
+        else:
+            items.append(["set", item])
+    return ["list", items]
+
+
+def patch_or_set(i: int, old, new) -> list:
+    """
+    Returns a patch of the old item at index i, or the new item itself if
+    the patch would be larger.
+    """
+    op = diff_json(old, new)
+    if op[0] == "set" or len(dumps(op)) >= len(dumps(new)):
+        return ["set", new]
+    return ["patch", i, op]
+
+
+def apply_delta(old, op: list):
+    """
+    Returns the value the op turns the old value into. The old value is not
+    modified.
+    """
+    kind = op[0]
+    if kind == "same":
+        return old
+    if kind == "set":
+        return op[1]
+    if kind == "dict":
+        _, keys, changed = op
+        keys = keys if keys is not None else list(old)
+        return {
+            key: apply_delta(old.get(key), changed[key])
+            if key in changed else old[key]
+            for key in keys
+        }
+    if kind == "list":
+        new = []
+        for item in op[1]:
+            if isinstance(item, int):
+                new.append(old[item])
+            elif item[0] == "patch":
+                new.append(apply_delta(old[item[1]], item[2]))
+            else:
+                new.append(item[1])
+        return new
+    raise ValueError(f"Unknown delta op: {kind}")
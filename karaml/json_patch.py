@@ -0,0 +1,230 @@
+"""
+Patches a single value of a JSON document in its text, leaving every other byte
+of the document intact.
+
+karabiner.json holds every profile, device setting and rule of a user's
+Karabiner-Elements config, but karaml only ever changes one profile's
+`complex_modifications`, appends a new profile or removes stale profiles.
+Instead of re-serializing the whole document, the value is located by its path
+(e.g. `["profiles", 2, "complex_modifications"]`) by scanning the text, and
+only the new value is encoded and spliced in.
+
+The new value is encoded in the `indent=4` format that both Karabiner-Elements
+and karaml write. If the text around the value is formatted differently, the
+patch is refused (None is returned) and the caller should fall back to writing
+the whole document.
+"""
+
+import re
+from itertools import chain
+from json import JSONDecodeError, JSONDecoder
+from json.decoder import scanstring
+from typing import Iterator
+
+from karaml.json_writer import INDENT, iter_json
+
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+DECODER = JSONDecoder()
+
+
+def skip_whitespace(text: str, i: int) -> int:
+    return WHITESPACE.match(text, i).end()
+
+
+def iter_members(text: str, start: int) -> Iterator[tuple]:
+    """
+    Yields a (key, key_start, value_start, value_end) tuple for every member
+    of the JSON object that starts at `start`. Values are only decoded to find
+    where they end, so stopping early skips the rest of the object.
+    """
+    if text[start] != "{":
+        raise JSONDecodeError("Expected object", text, start)
+    i = skip_whitespace(text, start + 1)
+    if text[i] == "}":
+        return
+    while True:
+        if text[i] != '"':
+            raise JSONDecodeError("Expected key", text, i)
+        key, key_end = scanstring(text, i + 1)
+        colon = skip_whitespace(text, key_end)
+        if text[colon] != ":":
+            raise JSONDecodeError("Expected ':'", text, colon)
+        value_start = skip_whitespace(text, colon + 1)
+        _, value_end = DECODER.raw_decode(text, value_start)
+        yield key, i, value_start, value_end
+        i = skip_whitespace(text, value_end)
+        if text[i] == "}":
+            return
+        if text[i] != ",":
+            raise JSONDecodeError("Expected ',' or '}'", text, i)
+        i = skip_whitespace(text, i + 1)
+
+
+def iter_elements(text: str, start: int) -> Iterator[tuple]:
+    """
+    Yields a (value_start, value_end) tuple for every element of the JSON
+    array that starts at `start`.
+    """
+    if text[start] != "[":
+        raise JSONDecodeError("Expected array", text, start)
+    i = skip_whitespace(text, start + 1)
+    if text[i] == "]":
+        return
+    while True:
+        _, value_end = DECODER.raw_decode(text, i)
+        yield i, value_end
+        i = skip_whitespace(text, value_end)
+        if text[i] == "]":
+            return
+        if text[i] != ",":
+            raise JSONDecodeError("Expected ',' or ']'", text, i)
+        i = skip_whitespace(text, i + 1)
+
+
+def value_span(text: str, path: list) -> tuple[int, int, int]:
+    """
+    Returns a (line_start, value_start, value_end) tuple for the value at the
+    path of object keys and array indices, where line_start is the index the
+    value (or its key) starts its line at. Raises a KeyError or IndexError if
+    the path doesn't exist.
+    """
+    line_start = value_start = skip_whitespace(text, 0)
+    value_end = len(text.rstrip())
+    for step in path:
+        if isinstance(step, str):
+            for key, key_start, start, end in iter_members(text, value_start):
+                if key == step:
+                    line_start, value_start, value_end = key_start, start, end
+                    break
+            else:
+                raise KeyError(step)
+        else:
+            for i, (start, end) in enumerate(iter_elements(text, value_start)):
+                if i == step:
+                    line_start, value_start, value_end = start, start, end
+                    break
+            else:
+                raise IndexError(step)
+    return line_start, value_start, value_end
+
+
+def is_indented(text: str, pos: int, level: int) -> bool:
+    """
+    Returns True if the text at pos is the first thing on its line, indented
+    with four spaces per level.
+    """
+    line_start = text.rfind("\n", 0, pos) + 1
+    return text[line_start:pos] == INDENT * level
+
+
+def replace_splice(text: str, path: list, value) -> tuple | None:
+    """
+    Returns a (start, end, pieces) splice that replaces the value at the
+    path, or None if the path doesn't exist or the text isn't formatted with
+    `indent=4` around it.
+    """
+    try:
+        line_start, start, end = value_span(text, path)
+    except (JSONDecodeError, KeyError, IndexError):
+        return None
+    level = len(path)
+    if not is_indented(text, line_start, level):
+        return None
+    return start, end, iter_json(value, level)
+
+
+def append_splice(text: str, path: list, value) -> tuple | None:
+    """
+    Returns a (start, end, pieces) splice that appends the value to the
+    non-empty array at the path, or None if the path doesn't exist, the array
+    is empty or the text isn't formatted with `indent=4` around it.
+    """
+    try:
+        _, array_start, _ = value_span(text, path)
+        elements = list(iter_elements(text, array_start))
+    except (JSONDecodeError, KeyError, IndexError):
+        return None
+    level = len(path) + 1
+    if not elements or not is_indented(text, elements[-1][0], level):
+        return None
+    last_end = elements[-1][1]
+    return (
+        last_end,
+        last_end,
+        chain([",\n" + INDENT * level], iter_json(value, level)),
+    )
+
+
+SPLICES = {"replace": replace_splice, "append": append_splice}
+
+
+def patch_values(text: str, patches: list[tuple]) -> Iterator[str] | None:
+    """
+    Returns the pieces of the text with several patches applied at once, or
+    None if any of them can't be applied. Each patch is a tuple of "replace"
+    or "append", a path and a value, as in replace_value and append_value.
+    Paths refer to the original text, and values appended to the same array
+    are appended in order.
+    """
+    splices = [SPLICES[kind](text, path, value)
+               for kind, path, value in patches]
+    if not splices or None in splices:
+        return None
+    # sorted() is stable, so appends at the same position keep their order
+    splices = sorted(splices, key=lambda splice: splice[0])
+    for (_, end, _), (start, _, _) in zip(splices, splices[1:]):
+        if start < end:
+            return None
+    return splice_pieces(text, splices)
+
+
+def splice_pieces(text: str, splices: list[tuple]) -> Iterator[str]:
+    position = 0
+    for start, end, pieces in splices:
+        yield text[position:start]
+        yield from pieces
+        position = end
+    yield text[position:]
+
+
+def replace_value(text: str, path: list, value) -> Iterator[str] | None:
+    """
+    Returns the pieces of the text with the value at the path replaced, or
+    None if the path doesn't exist or the text isn't formatted with
+    `indent=4` around it.
+    """
+    return patch_values(text, [("replace", path, value)])
+
+
+def append_value(text: str, path: list, value) -> Iterator[str] | None:
+    """
+    Returns the pieces of the text with the value appended to the non-empty
+    array at the path, or None if the path doesn't exist, the array is empty
+    or the text isn't formatted with `indent=4` around it.
+    """
+    return patch_values(text, [("append", path, value)])
+
+
+def remove_elements(text: str, path: list, indices: set[int]) -> str | None:
+    """
+    Returns the text with the elements at the indices removed from the array
+    at the path, or None if the path doesn't exist or the text isn't
+    formatted with `indent=4` around the array's elements. Removing every
+    element is refused too, since an empty array is formatted differently.
+    """
+    try:
+        _, array_start, _ = value_span(text, path)
+        elements = list(iter_elements(text, array_start))
+    except (JSONDecodeError, KeyError, IndexError):
+        return None
+    level = len(path) + 1
+    if not indices or len(indices) >= len(elements) or not all(
+            is_indented(text, start, level) for start, _ in elements):
+        return None
+    kept = [span for i, span in enumerate(elements) if i not in indices]
+    separator = ",\n" + INDENT * level
+    return "".join([
+        text[:elements[0][0]],
+        separator.join(text[start:end] for start, end in kept),
+        text[elements[-1][1]:],
+    ])
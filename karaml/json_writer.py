@@ -0,0 +1,296 @@
+"""
+Streams JSON output to files layer by layer.
+
+`dumps(data, indent=4)` builds the whole output in memory before it is written,
+which is as large as the file itself for big rule sets. `write_json` instead
+walks the top of the data structure itself and encodes each layer (a dict with
+a "manipulators" list, i.e. a complex modification rule) separately, writing
+every piece to the file as soon as it is encoded.
+
+The output is byte-identical to `dumps(data, indent=4)`. Each layer is encoded
+with `indent=4` and re-indented to its depth in the file, which is safe since
+newlines inside JSON strings are always escaped. Layers are encoded whole
+rather than piece by piece (as `JSONEncoder.iterencode` would) because a
+single encoder call per layer is much faster than writing thousands of small
+chunks.
+
+With `indent`, the json module encodes in pure Python, and manipulators repeat
+a lot of structure (the same layer `conditions`, `set_variable` events, or
+`"type": "basic"` in every manipulator). Layers are therefore encoded
+manipulator by manipulator, and the encoded text of every value of a
+manipulator is memoized in a FragmentCache. A fragment is looked up by its
+repr, which is built in C and tells apart any two values of the plain JSON
+data in manipulators that encode differently (e.g. True and 1), so only new
+fragments go through the slow indented encoder.
+
+Writes are skipped when the file already holds the same content, which is
+checked by comparing a hash of the new text (computed while it is written to a
+temp file) with a hash of the file on disk. Leaving an unchanged file alone
+keeps Karabiner-Elements from reloading its configuration.
+"""
+
+import os
+from contextlib import contextmanager
+from hashlib import sha256
+from json import JSONEncoder
+from pathlib import Path
+from shutil import copymode
+from tempfile import NamedTemporaryFile
+from typing import Callable, Iterable, Iterator
+
+from karaml.timings import TIMINGS
+
+INDENT = " " * 4
+ENCODER = JSONEncoder(indent=4)
+MAX_FRAGMENTS = 100_000
+
+
+class FragmentCache:
+    """
+    Memoizes the indented JSON text of repeated values.
+
+    Attributes:
+        fragments: A dict of (nesting level, repr of a value) to the text
+            of the value at that level, as `dumps(value, indent=4)` would
+            write it. Cleared once it holds MAX_FRAGMENTS fragments.
+        hits: The number of values whose text was reused.
+        misses: The number of values that had to be encoded.
+    """
+
+    def __init__(self):
+        self.fragments: dict[tuple[int, str], str] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def encode(self, value, level: int) -> str:
+        """
+        Returns the JSON text of the value at the given nesting level.
+        """
+        if not isinstance(value, (dict, list)) or not value:
+            return ENCODER.encode(value)
+        key = (level, repr(value))
+        text = self.fragments.get(key)
+        if text is not None:
+            self.hits += 1
+            return text
+        self.misses += 1
+        if len(self.fragments) >= MAX_FRAGMENTS:
+            self.fragments.clear()
+        text = ENCODER.encode(value)
+        if level:
+            text = text.replace("\n", "\n" + INDENT * level)
+        self.fragments[key] = text
+        return text
+
+
+FRAGMENTS = FragmentCache()
+
+
+def join_members(members: list[str], brackets: str, level: int) -> str:
+    """
+    Returns the JSON text of an object or array with the encoded members, as
+    `dumps(..., indent=4)` would write it at the given nesting level.
+    """
+    inner_indent = "\n" + INDENT * (level + 1)
+    return (brackets[0] + inner_indent + ("," + inner_indent).join(members) +
+            "\n" + INDENT * level + brackets[1])
+
+
+def has_str_keys(data) -> bool:
+    return (
+        isinstance(data, dict) and
+        bool(data) and
+        all(isinstance(key, str) for key in data)
+    )
+
+
+def encode_layer(layer: dict, level: int) -> str:
+    """
+    Returns the JSON text of a layer (a rule with "manipulators") at the
+    given nesting level, encoding the values of each manipulator through the
+    FRAGMENTS cache.
+    """
+    hits, misses = FRAGMENTS.hits, FRAGMENTS.misses
+    members = []
+    for key, value in layer.items():
+        if key == "manipulators" and isinstance(value, list) and value:
+            text = join_members(
+                [encode_manipulator(item, level + 2) for item in value],
+                "[]", level + 1)
+        else:
+            text = FRAGMENTS.encode(value, level + 1)
+        members.append(f"{ENCODER.encode(key)}: {text}")
+    TIMINGS.count("json_fragment_hits", FRAGMENTS.hits - hits)
+    TIMINGS.count("json_fragment_misses", FRAGMENTS.misses - misses)
+    return join_members(members, "{}", level)
+
+
+def encode_manipulator(manipulator, level: int) -> str:
+    if not has_str_keys(manipulator):
+        return FRAGMENTS.encode(manipulator, level)
+    return join_members([
+        f"{ENCODER.encode(key)}: {FRAGMENTS.encode(value, level + 1)}"
+        for key, value in manipulator.items()
+    ], "{}", level)
+
+
+def iter_json(data, level: int = 0) -> Iterator[str]:
+    """
+    Yields the JSON text of the data in pieces, formatted as
+    `dumps(data, indent=4)` would be at the given nesting level.
+    """
+    if is_streamable_dict(data):
+        inner_indent = "\n" + INDENT * (level + 1)
+        yield "{"
+        for i, (key, value) in enumerate(data.items()):
+            yield f"{',' if i else ''}{inner_indent}{ENCODER.encode(key)}: "
+            yield from iter_json(value, level + 1)
+        yield "\n" + INDENT * level + "}"
+    elif isinstance(data, (list, tuple)) and data:
+        inner_indent = "\n" + INDENT * (level + 1)
+        yield "["
+        for i, item in enumerate(data):
+            yield f"{',' if i else ''}{inner_indent}"
+            yield from iter_json(item, level + 1)
+        yield "\n" + INDENT * level + "]"
+    elif has_str_keys(data):
+        yield encode_layer(data, level)
+    else:
+        text = ENCODER.encode(data)
+        yield text.replace("\n", "\n" + INDENT * level) if level else text
+
+
+def is_streamable_dict(data) -> bool:
+    """
+    Returns True if the dict should be streamed key by key. Layers are
+    encoded whole (see encode_layer), and so are dicts with keys that JSON
+    would convert to strings (e.g. ints), which are rare enough not to bother
+    streaming.
+    """
+    return has_str_keys(data) and "manipulators" not in data
+
+
+def current_umask() -> int:
+    """
+    Returns the umask of the process, which can only be read by setting it.
+    """
+    umask = os.umask(0o022)
+    os.umask(umask)
+    return umask
+
+
+@contextmanager
+def atomic_open(path: Path):
+    """
+    Opens a temp file next to the path for writing, and replaces the file at
+    the path with it once the block finishes. If the process dies or the
+    block raises an error, the original file is left untouched.
+
+    Symlinks are resolved first, so a symlinked config (e.g. in a dotfiles
+    repo) is updated rather than replaced by a regular file. A path that
+    exists but isn't a regular file (e.g. a folder or /dev/null) is never
+    replaced: an OSError is raised instead.
+
+    The file keeps the mode of the file it replaces, or gets the default mode
+    for new files (0o666 less the umask) rather than the 0o600 of temp files.
+    """
+    path = Path(path).resolve()
+    if path.exists() and not path.is_file():
+        raise OSError(f"Not a regular file, refusing to replace it: {path}")
+    tmp_file = NamedTemporaryFile(
+        "w", dir=path.parent, prefix=f".{path.name}.", suffix=".tmp",
+        delete=False)
+    try:
+        with tmp_file as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        if path.exists():
+            copymode(path, tmp_file.name)
+        else:
+            os.chmod(tmp_file.name, 0o666 & ~current_umask())
+        os.replace(tmp_file.name, path)
+    except BaseException:
+        Path(tmp_file.name).unlink(missing_ok=True)
+        raise
+
+
+class WriteAborted(Exception):
+    """
+    Raised by a before_replace callback of write_chunks to cancel the write,
+    leaving the file untouched.
+    """
+
+
+class _Unchanged(Exception):
+    """
+    Raised inside an atomic_open block to discard the temp file when the new
+    content is the same as the file's.
+    """
+
+
+def file_digest(path: Path) -> str | None:
+    """
+    Returns the sha256 hex digest of a file's bytes, or None if the file does
+    not exist.
+    """
+    try:
+        with open(path, "rb") as f:
+            digest = sha256()
+            while block := f.read(1 << 20):
+                digest.update(block)
+    except FileNotFoundError:
+        return None
+    return digest.hexdigest()
+
+
+def chunks_digest(chunks: Iterable[str]) -> str:
+    """
+    Returns the sha256 hex digest of the pieces of a JSON text, as
+    file_digest would return it once they are written.
+    """
+    digest = sha256()
+    for chunk in chunks:
+        digest.update(chunk.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def write_chunks(path: Path, chunks: Iterable[str],
+                 before_replace: Callable[[], None] | None = None) -> bool:
+    """
+    Atomically writes the pieces of a JSON text to a file. Returns True if
+    the file was written, or False if it already had the same content, in
+    which case it is left untouched.
+
+    before_replace is called once the new content is known to differ from
+    the file's, right before the file is replaced (e.g. to back it up or to
+    ask the user to confirm). It can raise WriteAborted to cancel the write.
+    """
+    try:
+        with TIMINGS.stage("write_json"), atomic_open(path) as f:
+            digest = sha256()
+            for chunk in chunks:
+                f.write(chunk)
+                digest.update(chunk.encode(f.encoding))
+            if digest.hexdigest() == file_digest(path):
+                raise _Unchanged
+            if before_replace:
+                before_replace()
+    except _Unchanged:
+        return False
+    return True
+
+
+def write_json(path: Path, data: dict,
+               before_replace: Callable[[], None] | None = None) -> bool:
+    """
+    Writes the data as JSON to a file, identical to `dumps(data, indent=4)`,
+    without building the whole JSON string in memory. Returns False if the
+    file already had the same content and was left untouched.
+    """
+    return write_chunks(path, iter_json(data), before_replace)
@@ -1,18 +1,44 @@
 import re
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import redirect_stdout
 from copy import deepcopy
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from functools import partial
+from io import StringIO
+from itertools import repeat
+from threading import Lock
+from time import perf_counter
 from typing import Union
 
 import yaml
 
-from karaml.exceptions import invalidFrontmostAppCondition, invalidLayerName
+import karaml.cfg
+from karaml.backups import RetentionPolicy
+from karaml.build_cache import BuildCache
+from karaml.compile_context import CompileContext, use_context
+from karaml.exceptions import (
+    invalidCompactProfiles,
+    invalidFrontmostAppCondition,
+    invalidLayerName,
+    invalidProfiles,
+)
 from karaml.helpers import (
     UniqueKeyLoader,
+    resolve_duplicate_keys,
     translate_params,
 )
 from karaml.key_karamlizer import KaramlizedKey, UserMapping
 from karaml.templates import update_user_templates
+from karaml.timings import TIMINGS, timed
 from karaml.user_aliases import update_user_aliases
+from karaml.yaml_stream import iter_top_level
+
+# The top-level keys of a config that aren't layers
+USER_SECTION_KEYS = ("aliases", "templates")
+SECTION_KEYS = USER_SECTION_KEYS + (
+    "profile_name", "title", "parameters", "backups", "compact_profiles",
+    "profiles", "json",
+)
 
 
 def extract_keys(mapping_node):
@@ -29,43 +55,112 @@ def extract_keys(mapping_node):
 class KaramlConfig:
     from_file: str
     hold_flavor: str
+    cache: BuildCache | None = None
+    jobs: int = 1
+    # The user aliases and templates of this config, which only apply to it
+    context: CompileContext = field(
+        default_factory=CompileContext, repr=False, compare=False)
 
     def __post_init__(self):
+        with self.context.activate():
+            self.compile()
+
+    def compile(self):
+        """
+        Loads and translates the config, or restores it from the build cache,
+        in the config's compile context.
+        """
+        if self.cache:
+            with TIMINGS.stage("restore_build"):
+                input_fp = self.cache.input_fingerprint(
+                    self.from_file, self.hold_flavor)
+                restored = self.cache.restore_build(self, input_fp)
+            if restored:
+                self.yaml_data: dict = {}
+                self.config_stats()
+                return
+
+        self.layer_stream = LayerStream(self.hold_flavor, self.cache,
+                                        self.jobs)
         self.yaml_data: dict = self.load_karaml_config(self.from_file)
         self.profile_name: str = self.get_profile_name(self.yaml_data)
         self.title: str = self.get_ruleset_title(self.yaml_data)
         self.params: dict = self.get_params(self.yaml_data)
+        self.backup_policy: dict = self.get_backup_policy(self.yaml_data)
+        self.compact_profiles: int | None = self.get_compact_profiles(
+            self.yaml_data)
+        self.profiles: list = self.get_profiles(self.yaml_data)
         self.json_rules_list: list = self.get_json_rules_list(self.yaml_data)
-        update_user_templates(self.yaml_data)
-        update_user_aliases(self.yaml_data)
-        self.layers: list = self.gen_layers(self.yaml_data)
-
+        # Kept so the user aliases and templates can be shipped to the worker
+        # processes of a parallel build, since they are popped from yaml_data
+        self.user_sections: dict = {
+            "aliases": self.yaml_data.get("aliases"),
+            "templates": self.yaml_data.get("templates"),
+        }
+        # The layer stream applies them
+        for key in USER_SECTION_KEYS:
+            self.yaml_data.pop(key, None)
+        self.rule_count: int = self.layer_stream.rule_count
+        self.layers: list = self.gen_layers()
+
+        if self.cache:
+            with TIMINGS.stage("store_build"):
+                self.cache.store_build(self, input_fp)
         self.config_stats()
 
+    @timed("load_karaml_config")
     def load_karaml_config(self, from_file: str) -> dict:
         """
         Loads a karaml config file and returns a dict of the yaml data imported
         by the PyYAML library.
+
+        The top-level items are constructed one at a time (see
+        karaml.yaml_stream) and handed to the layer stream, which starts
+        translating the layers while the rest of the file is loaded. The
+        layers are left out of the returned dict, see LayerStream.
         """
+        yaml_data = {}
         with open(from_file) as f:
             # TODO: need some kind of health check here for characters that
             # raise errors, e.g `?`
-            yaml_data: dict = yaml.load(f, Loader=UniqueKeyLoader)
+            loader = UniqueKeyLoader(f)
+            try:
+                for key, value in iter_top_level(loader):
+                    self.layer_stream.add(key, value)
+                    # The layers are kept by the layer stream only
+                    if key in SECTION_KEYS:
+                        yaml_data[key] = value
+            finally:
+                loader.dispose()
+        duplicates = sorted(loader.duplicates,
+                            key=lambda d: (d.mark.line, d.mark.column))
+        resolve_duplicate_keys(duplicates)
+        if self.layer_stream.needs_reload:
+            self.reload_layers(from_file)
         return yaml_data
 
+    @timed("reload_layers")
+    def reload_layers(self, from_file: str):
+        """
+        Loads the config file again for the maps of the layers whose
+        translations the layer stream dropped after freeing their maps,
+        i.e. if an aliases or templates section comes after a layer.
+        """
+        with open(from_file) as f:
+            loader = UniqueKeyLoader(f)
+            try:
+                for key, value in iter_top_level(loader):
+                    self.layer_stream.reload(key, value)
+            finally:
+                loader.dispose()
+
     def config_stats(self) -> dict:
         """
         Prints a summary of the loaded layers and rules in the config file
-        to stdout. Layers are determined by the number of top-level keys
-        in the config that match the pattern /layer_name/ (e.g. /layer1/).
-        All other top-level keys are ignored.
+        to stdout.
         """
 
-        rule_count = 0
-        for layer_name, layer_maps in self.yaml_data.items():
-            # Account for multiple layer conditions (e.g. /layer1/ + /layer2/)
-            if layer_name.startswith("/") and layer_name.endswith("/"):
-                rule_count += len(layer_maps)
+        rule_count = self.rule_count
         total_layers = len(self.layers)
         print(f"Loaded {rule_count} rules in {len(self.layers)} layers "
               f"from {self.from_file}\n")
@@ -104,6 +199,65 @@ class KaramlConfig:
         params = d.pop("parameters") if d.get("parameters") else {}
         return translate_params(params) if params else {}
 
+    def get_backup_policy(self, d: dict) -> dict:
+        """
+        Returns the retention policy for karabiner.json backups specified in
+        the config's `backups` section, or an empty dict to use the default
+        policy. See karaml.backups.RetentionPolicy for the keys.
+        """
+        policy = d.pop("backups") if "backups" in d else {}
+        # Validate it now, rather than after the config is compiled
+        RetentionPolicy.from_dict(policy)
+        return policy or {}
+
+    def get_profiles(self, d: dict) -> list:
+        """
+        Returns the profiles to update in karabiner.json from the config's
+        `profiles` list, as dicts with a "name" and the profile's translated
+        parameter overrides as "params". Each item is either a profile name or
+        a map with a `name` and optional `parameters`, e.g.
+
+        profiles:
+          - Laptop
+          - name: External keyboard
+            parameters: {a: 150}
+
+        The rules are the same for every profile, only the parameters differ.
+        A profile can only be listed once.
+        """
+        profiles = d.pop("profiles") if d.get("profiles") else []
+        if not isinstance(profiles, list):
+            invalidProfiles(profiles)
+        translated = []
+        for profile in profiles:
+            if isinstance(profile, str):
+                profile = {"name": profile}
+            if not isinstance(profile, dict) or \
+                    not isinstance(profile.get("name"), str) or \
+                    not set(profile) <= {"name", "parameters"}:
+                invalidProfiles(profile)
+            if any(p["name"] == profile["name"] for p in translated):
+                invalidProfiles(profile)
+            params = profile.get("parameters") or {}
+            translated.append({
+                "name": profile["name"],
+                "params": translate_params(params) if params else {},
+            })
+        return translated
+
+    def get_compact_profiles(self, d: dict) -> int | None:
+        """
+        Returns the number of profiles generated by karaml (i.e. named
+        "Karaml Profile TIMESTAMP") to keep in karabiner.json when it is
+        updated, or None if stale profiles shouldn't be removed.
+        """
+        keep = d.pop("compact_profiles", None)
+        if keep is not None and (
+                isinstance(keep, bool) or not isinstance(keep, int) or
+                keep < 0):
+            invalidCompactProfiles(keep)
+        return keep
+
     def get_json_rules_list(self, d: dict) -> list:
         """
         Returns a list of JSON-formatted rules from the YAML config file by
@@ -114,63 +268,25 @@ class KaramlConfig:
         """
         return d.pop("json") if d.get("json") else []
 
-    def gen_layers(self, yaml_data: dict) -> list:
+    @timed("gen_layers")
+    def gen_layers(self) -> list:
         """
         Returns a list of layers, where each layer is a dict with a description
         containing the layer's name, and a list of manipulators. Each layer is
         equivalent to a complex modification ruleset in Karabiner-Elements.
-        """
-        layers_list = []
-
-        for layer_key, layer_maps in yaml_data.items():
-            name, description = parse_layer_key(layer_key)
-
-            manipulators: list = self.get_manipulators(name, layer_maps)
-            layer = {"description": description,
-                     "manipulators": manipulators}
-            layers_list.append(layer)
 
+        Most layers were translated by the layer stream while the config was
+        loaded, the rest are translated here. If the config has a build cache,
+        unchanged layers are restored from the cache and only the rest are
+        translated, in parallel if jobs > 1.
+        """
+        layers_list = self.layer_stream.finish()
         self.insert_json(layers_list)
         # Reverse the list so that later mappings override earlier ones in
         # 'higher' layers
         layers_list.reverse()
         return layers_list
 
-    def get_manipulators(self, layer_name: str, layer_maps: dict) -> list:
-        """
-        Returns a list of manipulators for a given layer. Each item in the list
-        is an object (KaramlizedKey) equivalent to a Karabiner-Elements rule.
-        The KaramlizedKey objects are interpreted from the layer_maps dict,
-        which is a dict of key mappings read into memory from the YAML Karaml
-        config file by the PyYAML library.
-        """
-        manipulators = []
-        for from_keys, rhs in layer_maps.items():
-            gkk_args = [from_keys, layer_name, self.hold_flavor]
-            # If the rhs is a single complex modification
-            if type(rhs) in [list, str]:
-                karamlized_key = get_karamlized_key(*gkk_args, rhs)
-                manipulators.append(karamlized_key.make_mapping_dict())
-                manipulators = self.insert_toggle_off(
-                    karamlized_key, manipulators)
-
-            # If this map is a dict of frontmost app based conditions, which
-            # may contain multiple complex modifications
-            elif isinstance(rhs, dict):
-                # Append a modification for each condition
-                for frontmost_app_key, to_keys in rhs.items():
-                    karamlized_key = get_karamlized_key(*gkk_args, to_keys)
-                    frontmost_app_dict = get_app_conditions_dict(
-                        frontmost_app_key, rhs)
-                    karamlized_key.conditions["conditions"].append(
-                        frontmost_app_dict)
-
-                    manipulators.append(karamlized_key.make_mapping_dict())
-                    manipulators = self.insert_toggle_off(
-                        karamlized_key, manipulators)
-
-        return manipulators
-
     def insert_json(self, layers_list: list):
         """
         Inserts a JSON layer at the end of the layers list if the user defined
@@ -183,54 +299,398 @@ class KaramlConfig:
             "manipulators": self.json_rules_list
         })
 
-    def insert_toggle_off(self, karamlized_key: KaramlizedKey,
-                          manipulators: list) -> list:
-        """
-        Inserts a corresponding layer-off rule for a layer-on rule if the user
-        specified a layer toggle in the YAML config file into the manipulators
-        list. Returns the manipulators list.
-
-        Layer-off rules are auto-generated so that the user does not have to
-        map a different key to turn off a layer if they mapped a layer-on key
-        with the `/layer_name/` syntax in the YAML config file. This syntax
-        is intended for automating the layer-off rule, so the user does not
-        have to map a different key to turn off a layer. To turn layers on or
-        off manually, the user should use the `var(layer_name, value)` syntax.
-        """
-        # BUG: If a user maps something to the same key as the auto-generated
-        # layer-off rule, the layer-off rule will be overridden, so the user
-        # could potentially get stuck in a layer if they have no other way to
-        # turn it off. Perhaps a user might be ok with this, but they should
-        # be warned.
-
-        toggle_info: list = karamlized_key.layer_toggle
-        if not toggle_info:
-            return manipulators
-        layer_off: KaramlizedKey = self.toggle_layer_off(karamlized_key,
-                                                         toggle_info)
-        manipulators.append(layer_off.make_mapping_dict())
-        return manipulators
 
-    def toggle_layer_off(self, karamlized_key: KaramlizedKey,
-                         toggle_info: list) -> KaramlizedKey:
-        """
-        Returns a KaramlizedKey object that turns off the layer turned on by
-        the corresponding karamlized_key arg. The toggle_info arg is a list of
-        tuples containing the layer name and the event that toggled the layer
-        on.
-        """
-        layer_off = deepcopy(karamlized_key)
-        for layer_name, event in toggle_info:
-            for condition in layer_off.conditions["conditions"]:
-                if condition["name"] == layer_name:
-                    condition["value"] = 1
-            for to_event in layer_off._to[event]:
-                if not to_event.get("set_variable"):
+class LayerStream:
+    """
+    Translates the layers of a config while the rest of it is loaded.
+
+    Each layer is translated as soon as it is loaded (by a pool of worker
+    processes if jobs > 1), with the user aliases and templates that come
+    before it in the file. The translations are speculative until the whole
+    config is loaded: their output is captured and printed by finish(), and a
+    layer whose translation fails is translated again by finish(), where the
+    error is reported as usual.
+
+    The stream takes over the layers from the loaded config, and only keeps
+    the maps of a layer until it is translated, so the maps of the translated
+    layers can be freed while the rest of the file is loaded.
+
+    An aliases or templates section after the first layer drops the
+    translations made so far, since they may depend on it, so the layers are
+    only translated while the file is loaded if these sections come first.
+    The maps of the dropped layers are then loaded again with reload().
+    """
+
+    def __init__(self, hold_flavor: str, cache: BuildCache | None = None,
+                 jobs: int = 1):
+        self.hold_flavor = hold_flavor
+        self.cache = cache
+        self.jobs = jobs
+        self.user_sections: dict = dict.fromkeys(USER_SECTION_KEYS)
+        # Layer key -> the number of rules of the layer, in the order of the
+        # file
+        self.rule_counts: dict = {}
+        # Layer key -> layer maps, for the layers that aren't translated yet
+        # or whose translation failed
+        self.pending: dict = {}
+        # Layer key -> (layer fingerprint, result), where the result is a
+        # Future in a parallel build
+        self.translations: dict = {}
+        self.executor: ProcessPoolExecutor | None = None
+        self.started = False
+        # Whether translations were dropped after their maps were freed
+        self.needs_reload = False
+        # Layers translated in the worker processes are released by the
+        # thread that completes their future
+        self.release_lock = Lock()
+
+    @property
+    def rule_count(self) -> int:
+        return sum(self.rule_counts.values())
+
+    def add(self, key, value):
+        """
+        Takes a top-level item of the config as soon as it is loaded.
+        """
+        if key in USER_SECTION_KEYS:
+            self.user_sections[key] = value
+            with self.release_lock:
+                self.stop()
+                self.needs_reload = self.needs_reload or any(
+                    key not in self.pending for key in self.rule_counts)
+        elif key not in SECTION_KEYS:
+            self.rule_counts[key] = count_rules({key: value})
+            self.pending[key] = value
+            self.translate(key, value)
+
+    def reload(self, key, value):
+        """
+        Takes a top-level item of the config when it is loaded again, to
+        restore the maps of the layers whose translations were dropped.
+        """
+        if key in self.rule_counts and key not in self.translations:
+            self.pending[key] = value
+
+    def start(self):
+        """
+        Applies the user aliases and templates seen so far, as they must be
+        applied before any layer is translated.
+        """
+        if self.cache:
+            self.cache.begin_build(self.user_sections["aliases"],
+                                   self.user_sections["templates"],
+                                   self.hold_flavor)
+        update_user_templates(dict(self.user_sections))
+        update_user_aliases(dict(self.user_sections))
+        self.started = True
+
+    def stop(self):
+        """
+        Drops the translations made so far and shuts down the worker
+        processes.
+        """
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+        self.translations.clear()
+        self.started = False
+
+    def release(self, layer_key, layer_maps, result):
+        """
+        Frees the maps of a layer once it is translated. A failed layer keeps
+        its maps, to be translated again by finish(), and so does a layer
+        whose translation was dropped.
+        """
+        if isinstance(result, Future):
+            if result.cancelled() or result.exception() or \
+                    result.result()[0] is None:
+                return
+        elif result[0] is None:
+            return
+        with self.release_lock:
+            translation = self.translations.get(layer_key, (None, None))
+            if translation[1] is result and \
+                    self.pending.get(layer_key) is layer_maps:
+                del self.pending[layer_key]
+
+    def translate(self, layer_key, layer_maps):
+        """
+        Translates a layer, or submits it to the worker processes, unless it
+        is in the build cache.
+        """
+        if not self.started:
+            self.start()
+        layer_fp = None
+        if self.cache:
+            layer_fp = self.cache.layer_fingerprint(layer_key, layer_maps)
+            layer = self.cache.get_layer(layer_fp)
+            if layer is not None:
+                result = (layer, "", None)
+                self.translations[layer_key] = (layer_fp, result)
+                self.release(layer_key, layer_maps, result)
+                return
+        if self.jobs > 1:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(
+                    self.jobs,
+                    initializer=init_layer_worker,
+                    initargs=(self.user_sections, karaml.cfg.DEBUG_FLAG),
+                )
+            future = self.executor.submit(
+                try_translate_layer, layer_key, layer_maps, self.hold_flavor)
+            self.translations[layer_key] = (layer_fp, future)
+            future.add_done_callback(
+                partial(self.release, layer_key, layer_maps))
+        else:
+            result = try_translate_layer(
+                layer_key, layer_maps, self.hold_flavor)
+            self.translations[layer_key] = (layer_fp, result)
+            self.release(layer_key, layer_maps, result)
+
+    def finish(self) -> list:
+        """
+        Returns the layers of the loaded config, in the order of the file.
+        Layers that weren't translated while the config was loaded are
+        restored from the build cache or translated now.
+        """
+        if not self.started:
+            self.start()
+        layer_keys = list(self.rule_counts)
+        layers_list = [None] * len(layer_keys)
+        layer_fps = [None] * len(layer_keys)
+        misses = []
+        try:
+            for i, layer_key in enumerate(layer_keys):
+                layer_fp, result = self.translations.get(
+                    layer_key, (None, None))
+                if result is None:
+                    if self.cache:
+                        layer_fp = self.cache.layer_fingerprint(
+                            layer_key, self.pending[layer_key])
+                        layers_list[i] = self.cache.get_layer(layer_fp)
+                    layer_fps[i] = layer_fp
+                    if layers_list[i] is None:
+                        misses.append(i)
+                    continue
+                if isinstance(result, Future):
+                    result = result.result()
+                layer, output, seconds = result
+                layer_fps[i] = layer_fp
+                if layer is None:
+                    misses.append(i)
+                    continue
+                print(output, end="")
+                layers_list[i] = layer
+                if seconds is None:
                     continue
-                if to_event["set_variable"]["name"] == layer_name:
-                    to_event["set_variable"]["value"] = 0
+                if TIMINGS.enabled:
+                    TIMINGS.record_layer(
+                        layer_key.replace("\n", " "), seconds)
+                if self.cache:
+                    self.cache.put_layer(layer_fp, layer)
+        finally:
+            self.stop()
+
+        translated = translate_layers(
+            [(layer_keys[i], self.pending[layer_keys[i]]) for i in misses],
+            self.hold_flavor,
+            self.jobs,
+            self.user_sections,
+        )
+        for i, layer in zip(misses, translated):
+            layers_list[i] = layer
+            if self.cache:
+                self.cache.put_layer(layer_fps[i], layer)
+        self.pending.clear()
+        return layers_list
+
 
-        return layer_off
+def count_rules(yaml_data: dict) -> int:
+    """
+    Returns the number of rules in the config file. Layers are determined by
+    the number of top-level keys in the config that match the pattern
+    /layer_name/ (e.g. /layer1/). All other top-level keys are ignored.
+    """
+    rule_count = 0
+    for layer_name, layer_maps in yaml_data.items():
+        # Account for multiple layer conditions (e.g. /layer1/ + /layer2/)
+        if layer_name.startswith("/") and layer_name.endswith("/"):
+            rule_count += len(layer_maps)
+    return rule_count
+
+
+def translate_layers(layer_items: list, hold_flavor: str, jobs: int = 1,
+                     user_sections: dict | None = None) -> list:
+    """
+    Translates a list of (layer_key, layer_maps) items and returns the layers
+    in the same order. If jobs > 1, the layers are translated by a pool of
+    worker processes. The user_sections dict holds the user's "aliases" and
+    "templates" config sections, which each worker applies on startup, since
+    the workers can't rely on the state of the main process.
+    """
+    if not layer_items:
+        return []
+    layer_keys, layer_maps = zip(*layer_items)
+    workers = min(jobs, len(layer_items))
+    if workers <= 1:
+        results = list(map(timed_translate_layer, layer_keys, layer_maps,
+                           repeat(hold_flavor)))
+    else:
+        with ProcessPoolExecutor(
+            workers,
+            initializer=init_layer_worker,
+            initargs=(user_sections or {}, karaml.cfg.DEBUG_FLAG),
+        ) as executor:
+            # map() returns the results in the order of the layers
+            results = list(executor.map(
+                timed_translate_layer, layer_keys, layer_maps,
+                repeat(hold_flavor)))
+
+    if TIMINGS.enabled:
+        for layer_key, (_, seconds) in zip(layer_keys, results):
+            TIMINGS.record_layer(layer_key.replace("\n", " "), seconds)
+    return [layer for layer, _ in results]
+
+
+def init_layer_worker(user_sections: dict, debug_flag: bool):
+    """
+    Prepares a worker process for translating layers by applying the user's
+    templates and aliases to a compile context of its own, as KaramlConfig
+    does before translating its layers.
+    """
+    karaml.cfg.DEBUG_FLAG = debug_flag
+    use_context(CompileContext())
+    user_sections = dict(user_sections)
+    update_user_templates(user_sections)
+    update_user_aliases(user_sections)
+
+
+def timed_translate_layer(layer_key: str, layer_maps: dict,
+                          hold_flavor: str) -> tuple[dict, float]:
+    """
+    Returns a translated layer and the seconds it took to translate it. The
+    layer is timed here rather than by the caller so that layers translated
+    in worker processes are timed as well.
+    """
+    start = perf_counter()
+    layer = translate_layer(layer_key, layer_maps, hold_flavor)
+    return layer, perf_counter() - start
+
+
+def try_translate_layer(layer_key: str, layer_maps: dict, hold_flavor: str
+                        ) -> tuple[dict | None, str, float]:
+    """
+    Returns a translated layer, the output printed while translating it and
+    the seconds it took, or None as the layer if the translation failed. The
+    errors aren't reported, so the layer has to be translated again to report
+    them.
+    """
+    output = StringIO()
+    try:
+        with redirect_stdout(output):
+            layer, seconds = timed_translate_layer(
+                layer_key, layer_maps, hold_flavor)
+    except (Exception, SystemExit):
+        return None, "", 0.0
+    return layer, output.getvalue(), seconds
+
+
+def translate_layer(layer_key: str, layer_maps: dict,
+                    hold_flavor: str) -> dict:
+    """
+    Returns a single layer dict with a description and a list of
+    manipulators.
+    """
+    name, description = parse_layer_key(layer_key)
+    manipulators: list = get_manipulators(name, layer_maps, hold_flavor)
+    return {"description": description,
+            "manipulators": manipulators}
+
+
+def get_manipulators(layer_name: str, layer_maps: dict,
+                     hold_flavor: str) -> list:
+    """
+    Returns a list of manipulators for a given layer. Each item in the list
+    is an object (KaramlizedKey) equivalent to a Karabiner-Elements rule.
+    The KaramlizedKey objects are interpreted from the layer_maps dict,
+    which is a dict of key mappings read into memory from the YAML Karaml
+    config file by the PyYAML library.
+    """
+    manipulators = []
+    for from_keys, rhs in layer_maps.items():
+        gkk_args = [from_keys, layer_name, hold_flavor]
+        # If the rhs is a single complex modification
+        if type(rhs) in [list, str]:
+            karamlized_key = get_karamlized_key(*gkk_args, rhs)
+            manipulators.append(karamlized_key.make_mapping_dict())
+            manipulators = insert_toggle_off(karamlized_key, manipulators)
+
+        # If this map is a dict of frontmost app based conditions, which
+        # may contain multiple complex modifications
+        elif isinstance(rhs, dict):
+            # Append a modification for each condition
+            for frontmost_app_key, to_keys in rhs.items():
+                karamlized_key = get_karamlized_key(*gkk_args, to_keys)
+                frontmost_app_dict = get_app_conditions_dict(
+                    frontmost_app_key, rhs)
+                karamlized_key.conditions["conditions"].append(
+                    frontmost_app_dict)
+
+                manipulators.append(karamlized_key.make_mapping_dict())
+                manipulators = insert_toggle_off(karamlized_key, manipulators)
+
+    return manipulators
+
+
+@timed("insert_toggle_off")
+def insert_toggle_off(karamlized_key: KaramlizedKey,
+                      manipulators: list) -> list:
+    """
+    Inserts a corresponding layer-off rule for a layer-on rule if the user
+    specified a layer toggle in the YAML config file into the manipulators
+    list. Returns the manipulators list.
+
+    Layer-off rules are auto-generated so that the user does not have to
+    map a different key to turn off a layer if they mapped a layer-on key
+    with the `/layer_name/` syntax in the YAML config file. This syntax
+    is intended for automating the layer-off rule, so the user does not
+    have to map a different key to turn off a layer. To turn layers on or
+    off manually, the user should use the `var(layer_name, value)` syntax.
+    """
+    # BUG: If a user maps something to the same key as the auto-generated
+    # layer-off rule, the layer-off rule will be overridden, so the user
+    # could potentially get stuck in a layer if they have no other way to
+    # turn it off. Perhaps a user might be ok with this, but they should
+    # be warned.
+
+    toggle_info: list = karamlized_key.layer_toggle
+    if not toggle_info:
+        return manipulators
+    layer_off: KaramlizedKey = toggle_layer_off(karamlized_key, toggle_info)
+    manipulators.append(layer_off.make_mapping_dict())
+    return manipulators
+
+
+def toggle_layer_off(karamlized_key: KaramlizedKey,
+                     toggle_info: list) -> KaramlizedKey:
+    """
+    Returns a KaramlizedKey object that turns off the layer turned on by
+    the corresponding karamlized_key arg. The toggle_info arg is a list of
+    tuples containing the layer name and the event that toggled the layer
+    on.
+    """
+    layer_off = deepcopy(karamlized_key)
+    for layer_name, event in toggle_info:
+        for condition in layer_off.conditions["conditions"]:
+            if condition["name"] == layer_name:
+                condition["value"] = 1
+        for to_event in layer_off._to[event]:
+            if not to_event.get("set_variable"):
+                continue
+            if to_event["set_variable"]["name"] == layer_name:
+                to_event["set_variable"]["value"] = 0
+
+    return layer_off
 
 
 def get_app_conditions_dict(app_conditions: str, rhs: dict) -> dict:
@@ -4,6 +4,7 @@
 
 from string import ascii_uppercase
 from collections import namedtuple
+from copy import copy
 
 Alias = namedtuple("Alias", ["key_code", "modifiers"])
 
@@ -476,6 +477,97 @@ KEY_CODE_REF_LISTS = [
     KeyCodesRef("pointing_button", POINTING_BUTTON),
 ]
 
+KeyEntry = namedtuple("KeyEntry", ["key_type", "alias", "modifier_alias"])
+
+
+class KeyCodeRegistry:
+    """
+    An index of every name that can appear as a key in a karaml map, so any
+    name can be resolved with a single dict lookup instead of scanning the
+    key code lists.
+
+    Each name maps to a KeyEntry with:
+        key_type: The Karabiner-Elements key type of the name if it is a
+            valid key code, consumer key code or pointing button, else None.
+            If a name is in several lists, the first one in KEY_CODE_REF_LISTS
+            wins, e.g. `menu` is a key_code, not a consumer_key_code.
+        alias: The Alias the name resolves to if it is an alias, else None.
+            Aliases take precedence over key codes when translating a map.
+        modifier_alias: The modifier string the name stands for if it is a
+            modifier alias (e.g. `☆`), else None.
+
+    The registry also holds its own aliases and modifier aliases, starting
+    from the built-in ALIASES and MODIFIER_ALIASES, which are never modified.
+    KEY_REGISTRY is built once at import, and user aliases are added to a copy
+    of it held by a CompileContext (see karaml.compile_context), which keeps
+    the aliases and the index in sync.
+    """
+
+    def __init__(self):
+        self.aliases: dict[str, Alias] = dict(ALIASES)
+        self.modifier_aliases: dict[str, str] = dict(MODIFIER_ALIASES)
+        self.entries: dict[str, KeyEntry] = {}
+        for key_type, ref in reversed(KEY_CODE_REF_LISTS[1:]):
+            for name in ref:
+                self._update(name, key_type=key_type)
+        for name, alias in ALIASES.items():
+            self._update(name, alias=alias)
+        for name, mods in MODIFIER_ALIASES.items():
+            self._update(name, modifier_alias=mods)
+
+    def _update(self, name: str, **fields):
+        entry = self.entries.get(name) or KeyEntry(None, None, None)
+        self.entries[name] = entry._replace(**fields)
+
+    def copy(self) -> "KeyCodeRegistry":
+        """
+        Returns a copy of the registry that can be updated on its own.
+        """
+        registry = copy(self)
+        registry.aliases = dict(self.aliases)
+        registry.modifier_aliases = dict(self.modifier_aliases)
+        registry.entries = dict(self.entries)
+        return registry
+
+    def get(self, name: str) -> KeyEntry | None:
+        """
+        Returns the KeyEntry for a name, or None if the name is unknown.
+        """
+        return self.entries.get(name)
+
+    def add_alias(self, name: str, alias: Alias):
+        """
+        Adds a user-defined alias to the aliases and the index.
+        """
+        self.aliases[name] = alias
+        self._update(name, alias=alias)
+
+    def add_modifier_alias(self, name: str, modifiers: str):
+        """
+        Adds a user-defined modifier alias to the modifier aliases and the
+        index.
+        """
+        self.modifier_aliases[name] = modifiers
+        self._update(name, modifier_alias=modifiers)
+
+    def is_modifier_alias(self, name: str) -> bool:
+        """
+        Returns True if the name is a modifier alias, e.g. `⌘` or `☆`.
+        """
+        entry = self.entries.get(name)
+        return bool(entry and entry.modifier_alias)
+
+    def is_valid_key_code(self, name: str) -> bool:
+        """
+        Returns True if the name is a key code, consumer key code, pointing
+        button or modifier alias, i.e. a valid target for a user alias.
+        """
+        entry = self.entries.get(name)
+        return bool(entry and (entry.key_type or entry.modifier_alias))
+
+
+KEY_REGISTRY = KeyCodeRegistry()
+
 # NOTE: As of KE 14.12.0, "shift", "command", etc. are not valid sticky mods
 STICKY_MODS = [
     "left_control",
@@ -11,7 +11,7 @@ from karaml.exceptions import (
     invalidToModType, missingToMap
 )
 from karaml.map_translator import TranslatedMap, KeyStruct
-from karaml.templates import TEMPLATES
+from karaml.templates import template_names
 
 
 @dataclass
@@ -223,7 +223,7 @@ def chatter_safeguard(hold_map: str, key_list: list, to_event: str) -> str:
         return to_event
 
     # Templates are chatty except for notify
-    for template in TEMPLATES:
+    for template in template_names():
         if template == "notify":
             continue
         if template in hold_map:
@@ -0,0 +1,238 @@
+"""
+A hand-written parser for the karaml mapping mini-language.
+
+A map string like `<o-s>`, `app(Terminal)`, `/nav/`, `string(hello)` or
+`j + <c-k>` is parsed once into a small tree of namedtuples, which the
+translators in map_translator consume instead of running a cascade of regexes
+over the same string:
+
+    ParsedMap: the whole map string. `simultaneous` is True if the keys were
+        concatenated with `+`, in which case each key is stripped of
+        surrounding whitespace.
+    ParsedKey: a single key in the map, with every way karaml can read it:
+        layer: the layer name of a `/layer/` reference
+        template: a TemplateCall for a `name(args)` call. Whether `name` is a
+            known template is decided by the translator, since users can
+            define their own templates
+        string_args: the characters of a `string(...)` call
+        modded: a ModifiedKey for a `<mods-key>`, `mods|key` or `mods key` key
+    ModifierGroups: the mandatory and optional (in parens) parts of a modifier
+        string like `co(ms)`.
+
+Every scan is linear in the length of the input. The grammar follows the
+regexes karaml used before this parser, including their quirks, so existing
+configs translate the same way. Some of those regexes backtracked
+quadratically on long keys without a delimiter.
+"""
+
+from collections import namedtuple
+
+ModifiedKey = namedtuple("ModifiedKey", ["modifiers", "key"])
+TemplateCall = namedtuple("TemplateCall", ["name", "args"])
+ParsedKey = namedtuple(
+    "ParsedKey", ["text", "layer", "template", "string_args", "modded"])
+ParsedMap = namedtuple("ParsedMap", ["text", "simultaneous", "keys"])
+ModifierGroups = namedtuple(
+    "ModifierGroups", ["mandatory", "optional_sets", "split"])
+
+
+def parse_map(text: str) -> ParsedMap:
+    """
+    Parses a full map string, splitting simultaneous keys on `+`.
+    """
+    if "+" in text:
+        keys = tuple(parse_key(key.strip()) for key in text.split("+"))
+        return ParsedMap(text, True, keys)
+    return ParsedMap(text, False, (parse_key(text),))
+
+
+def parse_key(text: str) -> ParsedKey:
+    """
+    Parses a single key of a map string.
+    """
+    return ParsedKey(
+        text,
+        scan_layer(text),
+        scan_template(text),
+        scan_string_args(text),
+        scan_modded(text),
+    )
+
+
+def _end_before_final_newline(text: str, char: str) -> int:
+    """
+    Returns the index of the last char of the text if it is `char`, allowing
+    for a single trailing newline (as the regex `$` does). Otherwise -1.
+    """
+    if text.endswith(char):
+        return len(text) - 1
+    if text.endswith(char + "\n"):
+        return len(text) - 2
+    return -1
+
+
+def scan_layer(text: str) -> str | None:
+    """
+    Returns the layer name of a `/layer_name/` reference, or None. The name
+    must not be empty or contain a forward slash.
+    """
+    if not text.startswith("/"):
+        return None
+    end = _end_before_final_newline(text, "/")
+    if end < 2 or text.find("/", 1, end) != -1:
+        return None
+    return text[1:end]
+
+
+def scan_template(text: str) -> TemplateCall | None:
+    """
+    Returns a TemplateCall for a `name(args)` string, or None. The args must
+    not be empty or span multiple lines. Everything between the first open
+    paren and the last close paren is the args string.
+    """
+    open_paren = text.find("(")
+    if open_paren == -1:
+        return None
+    close_paren = _end_before_final_newline(text, ")")
+    if close_paren <= open_paren + 1:
+        return None
+    if text.find("\n", open_paren, close_paren) != -1:
+        return None
+    return TemplateCall(text[:open_paren], text[open_paren + 1:close_paren])
+
+
+def scan_string_args(text: str) -> str | None:
+    """
+    Returns the args of the first `string(...)` call in the text, or None.
+    The args run to the last close paren on the same line.
+    """
+    start = text.find("string(")
+    while start != -1:
+        args_start = start + len("string(")
+        line_end = text.find("\n", args_start)
+        if line_end == -1:
+            line_end = len(text)
+        close_paren = text.rfind(")", args_start, line_end)
+        if close_paren != -1:
+            return text[args_start:close_paren]
+        start = text.find("string(", line_end)
+    return None
+
+
+def scan_modded(text: str) -> ModifiedKey | None:
+    """
+    Returns a ModifiedKey if the text is a valid modified key, or None.
+
+    A modified key either has a delimiter (`-` or `|`) between the modifiers
+    and the key, optionally wrapped in angle brackets, e.g. `<mods-key>` or
+    `mods | key`, or separates the modifiers from the key with whitespace,
+    e.g. `m o d s key`. Whitespace in the modifiers is ignored.
+    """
+    text = text.strip()
+    n = len(text)
+
+    # The modifiers are the first run of chars (other than `|`, `>` or `-`)
+    # that is followed by a delimiter and a non-empty key
+    run_start = 0
+    ws_start = ws_end = -1
+    for i, char in enumerate(text):
+        if char == "|" or char == "-":
+            if i > run_start and i + 1 < n and text[i + 1] != ">":
+                modifiers = text[run_start:i]
+                if modifiers[0] == "<" and len(modifiers) > 1:
+                    modifiers = modifiers[1:]
+                key_end = text.find(">", i + 1)
+                key = text[i + 1:key_end if key_end != -1 else n]
+                return ModifiedKey(modifiers.replace(" ", ""), key.strip())
+            run_start = i + 1
+        elif char == ">":
+            run_start = i + 1
+        elif char.isspace():
+            if ws_end != i - 1:
+                ws_start = i
+            ws_end = i
+
+    # Otherwise, the key is everything after the last whitespace, and the
+    # modifiers are everything before it on the same line
+    if ws_end == -1:
+        return None
+    key_start = ws_end + 1
+    last_newline = text.rfind("\n", 0, ws_start)
+    mods_end = text.find("\n", ws_start, key_start)
+    if mods_end == -1:
+        mods_end = ws_end
+    modifiers = text[last_newline + 1:mods_end]
+    return ModifiedKey(modifiers.replace(" ", ""), text[key_start:].strip())
+
+
+def _is_word(char: str) -> bool:
+    return char.isalnum() or char == "_"
+
+
+def parse_modifier_groups(mods: str) -> ModifierGroups:
+    """
+    Splits a modifier string into its mandatory and optional modifiers.
+
+    Optional modifiers are the chars in parens and mandatory modifiers are the
+    first run of chars that is not inside parens, e.g. `co(ms)` has the
+    mandatory modifiers `co` and the optional modifiers `ms`. Also returns
+    whether a set of parens splits the mandatory modifiers (e.g. `c(o)s`).
+    More than one set of optional modifiers, or a split, is an error.
+    """
+    optional_sets = []
+    search_from = 0
+    while (open_paren := mods.find("(", search_from)) != -1:
+        close_paren = mods.find(")", open_paren + 1)
+        if close_paren == -1:
+            break
+        if mods.find("\n", open_paren + 1, close_paren) != -1:
+            search_from = open_paren + 1
+            continue
+        optional_sets.append(mods[open_paren + 1:close_paren])
+        search_from = close_paren + 1
+
+    split = False
+    mandatory = None
+    # Runs of mandatory candidates wait until the next paren is seen: a run
+    # followed by a close paren is inside parens
+    pending = []
+    run_start = -1
+    for i, char in enumerate(mods):
+        in_run = _is_word(char) or char == "+"
+        if in_run and run_start == -1:
+            run_start = i
+        elif not in_run and run_start != -1:
+            pending.append(mods[run_start:i])
+            run_start = -1
+
+        if char == "(":
+            if mandatory is None and pending:
+                mandatory = pending[0]
+            pending = []
+            split = split or _splits_word(mods, i)
+        elif char == ")":
+            pending = []
+    if run_start != -1:
+        pending.append(mods[run_start:])
+    if mandatory is None and pending:
+        mandatory = pending[0]
+
+    return ModifierGroups(mandatory, tuple(optional_sets), split)
+
+
+def _splits_word(mods: str, open_paren: int) -> bool:
+    """
+    Returns True if the open paren at the given index is part of a pattern
+    like `c(o)s`, i.e. word chars on both sides of a parenthesized word.
+    """
+    if open_paren == 0 or not _is_word(mods[open_paren - 1]):
+        return False
+    i = open_paren + 1
+    while i < len(mods) and _is_word(mods[i]):
+        i += 1
+    return (
+        i > open_paren + 1 and
+        i + 1 < len(mods) and
+        mods[i] == ")" and
+        _is_word(mods[i + 1])
+    )
@@ -1,31 +1,84 @@
 from collections import namedtuple
+from copy import deepcopy
 from dataclasses import dataclass
-from re import findall, search
 
+from karaml.compile_context import current_context
 from karaml.exceptions import invalidKey, invalidSoftFunct
 from karaml.helpers import (
     check_and_validate_str_as_dict,
-    get_multi_keys,
-    is_layer,
     validate_mod_aliases,
     validate_optional_mod_sets,
 )
-from karaml.key_codes import (
-    ALIASES,
-    KEY_CODE_REF_LISTS,
-    MODIFIER_ALIASES,
-    MODIFIERS,
-)
-from karaml.templates import (
-    TEMPLATES,
-    translate_template,
+from karaml.key_codes import MODIFIERS, KeyEntry
+from karaml.map_parser import (
+    ModifiedKey,
+    ParsedKey,
+    parse_key,
+    parse_map,
+    parse_modifier_groups,
+    scan_modded,
+    scan_string_args,
 )
+from karaml.templates import is_template, translate_template
 
 KeyStruct = namedtuple("KeyStruct", ["key_type", "key_code", "modifiers"])
-ModifiedKey = namedtuple("ModifiedKey", ["modifiers", "key"])
+
+# The number of distinct map strings whose translations are memoized
+TRANSLATION_CACHE_SIZE = 4096
 
 
 def queue_translations(usr_key: str) -> list:
+    """
+    Returns the list of KeyStructs for a user mapping (see translate_usr_map).
+
+    The same right-hand sides tend to repeat many times across a config, so
+    translations are memoized per map string. The cached KeyStructs are
+    shared, so the caller gets copies of any mutable key codes or modifiers.
+    """
+    return [copy_keystruct(k) for k in cached_translations(usr_key)]
+
+
+def cached_translations(usr_key: str) -> tuple[KeyStruct, ...]:
+    """
+    Returns the memoized translation of a user mapping as a tuple. The
+    translations are memoized in the current compile context, and must be
+    cleared with clear_translation_cache whenever the aliases or templates
+    the translation depends on change. Once the cache is full, the least
+    recently used translation is dropped.
+    """
+    translations = current_context().translations
+    # Reinserted on a hit, so the dict is ordered by last use
+    translation = translations.pop(usr_key, None)
+    if translation is None:
+        translation = tuple(translate_usr_map(usr_key))
+        if len(translations) >= TRANSLATION_CACHE_SIZE:
+            del translations[next(iter(translations))]
+    translations[usr_key] = translation
+    return translation
+
+
+def clear_translation_cache():
+    """
+    Clears the memoized translations of the current compile context. Called
+    whenever the user-defined aliases or templates are updated.
+    """
+    current_context().translations.clear()
+
+
+def copy_keystruct(keystruct: KeyStruct) -> KeyStruct:
+    """
+    Returns a KeyStruct whose key_code and modifiers can be safely mutated
+    without affecting the memoized translation it was copied from.
+    """
+    key_type, key_code, modifiers = keystruct
+    if isinstance(key_code, (dict, list)):
+        key_code = deepcopy(key_code)
+    if modifiers:
+        modifiers = deepcopy(modifiers)
+    return KeyStruct(key_type, key_code, modifiers)
+
+
+def translate_usr_map(usr_key: str) -> list:
     """
     Given a user mapping, return a list of KeyStructs for each key in the
     mapping that holds the key_type, key_code, and modifiers for each key.
@@ -41,18 +94,19 @@ def queue_translations(usr_key: str) -> list:
     slow shell commands from blocking the event queue, but we want to let the
     user separate them if they want to.
     """
-    multi_keys = get_multi_keys(usr_key)
-    if not multi_keys:
-        usr_string_template = string_template(usr_key)
-        return usr_string_template or [key_code_translator(usr_key, usr_key)]
+    parsed = parse_map(usr_key)
+    if not parsed.simultaneous:
+        key = parsed.keys[0]
+        return string_template_keys(key.string_args) or [
+            translate_key(key, usr_key)]
 
     translations = []
     shell_cmd = ""
-    for key in multi_keys:
-        if string_pf := string_template(key):
+    for key in parsed.keys:
+        if string_pf := string_template_keys(key.string_args):
             translations += string_pf
             continue
-        translated = key_code_translator(key, usr_key)
+        translated = translate_key(key, usr_key)
         if translated and translated.key_type == "shell_command":
             shell_cmd = combine_shell_commands(translated, shell_cmd)
             continue
@@ -94,13 +148,21 @@ def key_code_translator(usr_key: str, usr_map: str) -> KeyStruct | None:
     e.g. for 'j+k', usr_map is `j+k' and usr_key are 'j' or 'k' on separate
     calls usr_map is passed for configError printing purposes
     """
-    if layer := translate_if_layer(usr_key):
-        return layer
-    if to_event := translate_if_template(usr_key):
+    return translate_key(parse_key(usr_key), usr_map)
+
+
+def translate_key(key: ParsedKey, usr_map: str) -> KeyStruct | None:
+    """
+    Return a KeyStruct for a single parsed key of a user mapping. See
+    key_code_translator.
+    """
+    if key.layer:
+        return KeyStruct("layer", key.layer, None)
+    if to_event := template_event(key):
         return to_event
-    if keystruct := translate_if_valid_keycode(usr_key, usr_map):
+    if keystruct := keycode_event(key, usr_map):
         return keystruct
-    invalidKey("key code", usr_map, usr_key)
+    invalidKey("key code", usr_map, key.text)
 
 
 def string_template(usr_key: str) -> list:
@@ -118,17 +180,25 @@ def string_template(usr_key: str) -> list:
     contents of the clipboard are restored after the paste command is sent.
     """
 
-    usr_string_template = search("string\\((.*)\\)", usr_key)
-    if not usr_string_template:
+    return string_template_keys(scan_string_args(usr_key))
+
+
+def string_template_keys(string_args: str | None) -> list:
+    """
+    Return the list of KeyStructs for the args of a string() template, or an
+    empty list if the key is not a string() template. See string_template.
+    """
+    if string_args is None:
         return []
-    string_args = usr_string_template.group(1)
 
     key_codes = []
+    keys = current_context().keys
     for char in string_args:
-        if char in MODIFIER_ALIASES:
+        # A single char can't be a modded key, so look it up directly
+        entry = keys.get(char)
+        if not entry or entry.modifier_alias:
             continue
-        valid_key_code = translate_if_valid_keycode(char, usr_key)
-        if valid_key_code:
+        if valid_key_code := keystruct_from_entry(char, entry, {}):
             key_codes.append(valid_key_code)
 
     if len(string_args) > len(key_codes):
@@ -158,10 +228,8 @@ def translate_if_layer(string: str) -> namedtuple:
     key_code if the string matches the regex determined in the is_layer func.
     Otherwise, return None.
     """
-    layer = is_layer(string)
-    if not layer:
-        return
-    return KeyStruct("layer", layer.group(1), None)
+    if layer := parse_key(string).layer:
+        return KeyStruct("layer", layer, None)
 
 
 def translate_if_template(usr_map: str) -> KeyStruct:
@@ -170,16 +238,23 @@ def translate_if_template(usr_map: str) -> KeyStruct:
     if the user mapping matches the regex for a template, e.g.
     'shell(open .)' or 'app(Terminal)'. Otherwise, return None.
     """
+    return template_event(parse_key(usr_map))
+
+
+def template_event(key: ParsedKey) -> KeyStruct | None:
+    """
+    Return a KeyStruct for a parsed key that calls a template, either
+    directly or through an alias. Otherwise, return None.
+    """
+    template_call = key.template
     # Check if the user mapping is an alias for a template, and if so,
     # replace the alias with the template
-    if usr_map in ALIASES:
-        usr_map = ALIASES[usr_map].key_code
-    for template in TEMPLATES:
-        query = search(f"^{template}\\((.+)\\)$", usr_map)
-        if not query:
-            continue
-        event, command = translate_template(template, query.group(1))
-        return KeyStruct(event, command, None)
+    if alias := current_context().keys.aliases.get(key.text):
+        template_call = parse_key(alias.key_code).template
+    if not template_call or not is_template(template_call.name):
+        return
+    event, command = translate_template(*template_call)
+    return KeyStruct(event, command, None)
 
 
 def soft_func(softfunc_args: str) -> dict:
@@ -200,17 +275,35 @@ def translate_if_valid_keycode(usr_key: str, usr_map: str) -> KeyStruct | None:
     mapping if the user mapping uses valid Karaibner-Elements key_codes or
     karaml aliases. Otherwise, return None.
     """
-    for ref_list in KEY_CODE_REF_LISTS:
-        key_code_type, ref = ref_list.key_type, ref_list.ref
-        primary_key, modifiers = parse_primary_key_and_mods(usr_key, usr_map)
+    return keycode_event(parse_key(usr_key), usr_map)
 
-        if primary_key not in ref:
-            continue
 
-        if alias := resolve_alias(primary_key, key_code_type, ref, modifiers):
-            return alias
+def keycode_event(key: ParsedKey, usr_map: str) -> KeyStruct | None:
+    """
+    Return a KeyStruct for a parsed key that is a valid key code or alias,
+    with or without modifiers. Otherwise, return None.
+    """
+    primary_key, modifiers = primary_key_and_mods(key.text, key.modded,
+                                                  usr_map)
+    if entry := current_context().keys.get(primary_key):
+        return keystruct_from_entry(primary_key, entry, modifiers)
 
-        return KeyStruct(key_code_type, primary_key, modifiers)
+
+def keystruct_from_entry(
+        primary_key: str,
+        entry: KeyEntry,
+        modifiers: dict
+) -> KeyStruct | None:
+    """
+    Return a KeyStruct for a primary key found in the key code registry,
+    resolving it first if it is an alias. Return None if the key is only a
+    modifier alias, which is not a valid key on its own.
+    """
+    if entry.alias:
+        return resolve_alias(primary_key, "alias",
+                             current_context().keys.aliases, modifiers)
+    if entry.key_type:
+        return KeyStruct(entry.key_type, primary_key, modifiers)
 
 
 def parse_primary_key_and_mods(usr_key: str, usr_map) -> tuple[str, dict]:
@@ -220,11 +313,24 @@ def parse_primary_key_and_mods(usr_key: str, usr_map) -> tuple[str, dict]:
     The modifiers are a dict with the keys 'mandatory' and 'optional', each
     containing a list of Karabiner-Elements key_codes for the modifiers.
     """
-    modded_key = is_modded_key(usr_key)
+    return primary_key_and_mods(usr_key, is_modded_key(usr_key), usr_map)
+
+
+def primary_key_and_mods(
+        usr_key: str,
+        modded_key: ModifiedKey | None,
+        usr_map: str
+) -> tuple[str, dict]:
+    """
+    Return the primary key and modifiers of a key that was already parsed
+    into a ModifiedKey, or the key itself and an empty dict if it has no
+    modifiers. See parse_primary_key_and_mods.
+    """
     if not modded_key:
         return usr_key, {}
     # The modifiers should either be ascii or unicode, but not a mix
-    if bool(set(MODIFIER_ALIASES.keys()) & set(modded_key.modifiers)):
+    if any(map(current_context().keys.is_modifier_alias,
+               modded_key.modifiers)):
         modifiers_string: str = translate_unicode_mods(modded_key.modifiers)
     else:
         modifiers_string: str = modded_key.modifiers
@@ -242,6 +348,7 @@ def translate_unicode_mods(modifiers: str) -> str:
     are prefixed or suffixed by a unicode 'arrow' character. This function
     handles the three cases: prefix, suffix, and neither.
     """
+    modifier_aliases = current_context().keys.modifier_aliases
     translated_mods = ""
     for i, char in enumerate(modifiers):
         if char in ("(", ")"):
@@ -249,11 +356,11 @@ def translate_unicode_mods(modifiers: str) -> str:
         elif char in ["‹", "›", " "]:
             continue
         elif i > 0 and modifiers[i-1] == "‹":
-            translated_char = MODIFIER_ALIASES["‹" + char]
+            translated_char = modifier_aliases["‹" + char]
         elif i < len(modifiers) - 1 and modifiers[i + 1] == "›":
-            translated_char = MODIFIER_ALIASES[char + "›"]
+            translated_char = modifier_aliases[char + "›"]
         else:
-            translated_char = MODIFIER_ALIASES[char]
+            translated_char = modifier_aliases[char]
         translated_mods += translated_char
 
     return translated_mods
@@ -268,19 +375,7 @@ def is_modded_key(mapping: str) -> ModifiedKey | None:
     A valid syntax must have a delimiter betwwen modifiers and the key (either
     a hyphen or a pipe). The modifiers may be enclosed in angle brackets.
     """
-
-    mapping = mapping.strip()
-    delim_expression = r"<?([^|>-]+)[|-]([^>]+)>?"
-    delim_query = search(delim_expression, mapping)
-    final_str_expression = r"(.*)\s+([^\s]+)$"
-    final_str_query = search(final_str_expression, mapping)
-    query = delim_query or final_str_query
-    if not query:
-        return
-    modifiers, key = query.groups()
-    modifiers = modifiers.replace(" ", "")
-    key = key.strip()
-    return ModifiedKey(modifiers, key)
+    return scan_modded(mapping)
 
 
 def get_modifiers(usr_mods: str, usr_map: str) -> dict:
@@ -309,12 +404,13 @@ def parse_chars_in_parens(string: str) -> tuple:
     parens, representing mandatory modifiers, and the second containing
     characters in parens, representing optional modifiers.
     """
-    in_parens: list = findall(r"\((.*?)\)", string)
-    validate_optional_mod_sets(string, in_parens)
-    not_in_parens: list = findall(r"[\w+]+(?![^()]*\))", string)
+    mod_groups = parse_modifier_groups(string)
+    validate_optional_mod_sets(string, mod_groups)
 
-    in_parens = list(in_parens[0]) if in_parens else None
-    not_in_parens = list(not_in_parens[0]) if not_in_parens else None
+    optional_sets = mod_groups.optional_sets
+    in_parens = list(optional_sets[0]) if optional_sets else None
+    mandatory = mod_groups.mandatory
+    not_in_parens = list(mandatory) if mandatory else None
     return not_in_parens, in_parens
 
 
@@ -359,17 +455,17 @@ def update_alias_modifiers(modifiers_dict: dict, alias_mods: list) -> dict:
 
     Where `alias_shift_mod` == `["shift]`. So, the KeyStruct needs to be
     updated to include a shift modifier in its `modifiers` attribute.
+
+    The original modifiers dict and the alias's modifier list are never
+    mutated, since both may be shared (e.g. by memoized translations).
     """
     if not alias_mods:
         return modifiers_dict
     elif not modifiers_dict:
-        return {'mandatory': alias_mods}
+        return {'mandatory': list(alias_mods)}
 
-    if not modifiers_dict.get('mandatory'):
-        modifiers_dict['mandatory'] = alias_mods
-    else:
-        modifiers_dict['mandatory'] += alias_mods
-    return modifiers_dict
+    mandatory = modifiers_dict.get('mandatory') or []
+    return {**modifiers_dict, 'mandatory': mandatory + list(alias_mods)}
 
 
 @ dataclass
@@ -0,0 +1,126 @@
+"""
+Cleans up the profiles karaml generates in karabiner.json.
+
+When a karaml config has no `profile_name`, every `-k` run appends a new
+profile named "Karaml Profile TIMESTAMP", so karabiner.json (and the profile
+list Karabiner-Elements loads and shows) grows with every build. Profiles with
+that generated name are recognized by the name alone, since Karabiner-Elements
+drops unknown fields (i.e. a marker field) when it rewrites the file.
+
+Stale profiles are all but the newest `keep` generated profiles. The selected
+profile is never removed, however old it is. Profiles are removed from the
+text of karabiner.json (see karaml.json_patch), leaving the rest of the file
+as it is.
+"""
+
+import re
+from functools import partial
+from json import loads
+from pathlib import Path
+
+from karaml.backups import (
+    RetentionPolicy,
+    backup_karabiner_json,
+    report_missing_karabiner_json,
+)
+from karaml.file_lock import file_lock
+from karaml.json_patch import remove_elements
+from karaml.json_writer import INDENT, iter_json, write_chunks
+
+AUTO_PROFILE_PREFIX = "Karaml Profile "
+AUTO_PROFILE_NAME = re.compile(
+    re.escape(AUTO_PROFILE_PREFIX) + r"(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})")
+
+
+def auto_profile_time(profile: dict) -> str | None:
+    """
+    Returns the timestamp of a profile karaml generated, or None if the
+    profile has a name of its own.
+    """
+    match = AUTO_PROFILE_NAME.fullmatch(str(profile.get("name", "")))
+    return match.group(1) if match else None
+
+
+def find_stale_profiles(profiles: list[dict], keep: int) -> set[int]:
+    """
+    Returns the indices of the generated profiles that are older than the
+    newest `keep` ones, except for the selected profile.
+    """
+    generated = [
+        (time, i) for i, profile in enumerate(profiles)
+        if (time := auto_profile_time(profile))
+    ]
+    generated.sort(reverse=True)
+    return {
+        i for _, i in generated[keep:]
+        if not profiles[i].get("selected")
+    }
+
+
+def compact_profiles(karabiner_config: str, karabiner_dict: dict,
+                     keep: int) -> tuple[str | None, list[str], int]:
+    """
+    Removes the stale generated profiles from the text and the dict of
+    karabiner.json. Returns the new text (or None if it couldn't be patched
+    and has to be written from the dict), the names of the removed profiles
+    and the number of bytes they took up.
+    """
+    profiles = karabiner_dict["profiles"]
+    stale = find_stale_profiles(profiles, keep)
+    if not stale:
+        return karabiner_config, [], 0
+    removed = [profiles[i] for i in sorted(stale)]
+    karabiner_dict["profiles"] = [
+        profile for i, profile in enumerate(profiles) if i not in stale]
+    # Each profile is an element of the profiles array, on its own line
+    separator = len(",\n" + INDENT * 2)
+    bytes_saved = sum(
+        separator + sum(len(chunk) for chunk in iter_json(profile, 2))
+        for profile in removed
+    )
+    return (
+        remove_elements(karabiner_config, ["profiles"], stale),
+        [profile["name"] for profile in removed],
+        bytes_saved,
+    )
+
+
+def report_compaction(removed: list[str], bytes_saved: int):
+    if not removed:
+        print("No stale karaml profiles found.")
+        return
+    print(f"Removed {len(removed)} stale karaml profiles "
+          f"({bytes_saved / 1000:.1f} KB):")
+    for name in removed:
+        print(f"    {name}")
+    print()
+
+
+def compact_karabiner_json(karabiner_path: Path, keep: int,
+                           dry_run: bool = False) -> bool:
+    """
+    Removes the stale generated profiles from karabiner.json, backing it up
+    first. With dry_run, only reports what would be removed. Returns False if
+    karabiner.json couldn't be found. Raises FileLockTimeout if another karaml
+    process keeps karabiner.json locked.
+    """
+    karabiner_json = karabiner_path / "karabiner.json"
+    with file_lock(karabiner_json):
+        try:
+            karabiner_config = karabiner_json.read_text()
+        except FileNotFoundError:
+            report_missing_karabiner_json(karabiner_json)
+            return False
+        karabiner_dict = loads(karabiner_config)
+        compacted, removed, bytes_saved = compact_profiles(
+            karabiner_config, karabiner_dict, keep)
+
+        if dry_run:
+            print("Dry run, karabiner.json is left as is.")
+        elif removed:
+            chunks = ([compacted] if compacted is not None
+                      else iter_json(karabiner_dict))
+            write_chunks(karabiner_json, chunks, partial(
+                backup_karabiner_json, karabiner_path, RetentionPolicy()))
+        report_compaction(removed, bytes_saved)
+        return True
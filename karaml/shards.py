@@ -0,0 +1,199 @@
+"""
+Writes the complex modifications of a karaml config as one file per layer.
+
+A single complex modifications file is rewritten whenever any layer changes,
+and the Karabiner-Elements GUI can only re-import it as a whole. With
+`--split-layers`, every layer (i.e. rule) is written to a file of its own in
+the complex_modifications folder, named after the output file and the layer's
+description, e.g. `karaml_complex_mods.nav-layer.json`.
+
+An index file (`.karaml_complex_mods.index.json`) records the shards in the
+order of the rules with a sha256 of their content. A rebuild only writes the
+shards whose hash changed, and removes the shards of layers that are gone, so
+both the writes and the GUI re-imports scale with what was edited. Shards are
+written in the order of the rules, which is the order to enable them in
+Karabiner-Elements to keep the priority of the layers.
+"""
+
+import re
+from hashlib import sha256
+from json import JSONDecodeError, dumps, loads
+from pathlib import Path
+from typing import Iterator
+
+from karaml.file_lock import FileLockTimeout, file_lock
+from karaml.file_writer import COMPLEX_MODS_PATH, confirm_before_lock
+from karaml.json_writer import (
+    WriteAborted,
+    file_digest,
+    iter_json,
+    write_chunks,
+)
+from karaml.karaml_config import KaramlConfig
+from karaml.timings import timed
+
+SHARD_INDEX_VERSION = 1
+MAX_SLUG_LENGTH = 60
+
+
+def layer_slug(description: str) -> str:
+    """
+    Returns the part of a shard's file name for a layer description, e.g.
+    "nav-layer" for "/nav/ layer".
+    """
+    slug = re.sub(r"[^a-z0-9]+", "-", description.lower()).strip("-")
+    return slug[:MAX_SLUG_LENGTH].rstrip("-") or "layer"
+
+
+def shard_file_names(stem: str, layers: list[dict]) -> list[str]:
+    """
+    Returns the file name of the shard of each layer. Layers with the same
+    slug are numbered in the order of the rules.
+    """
+    names, seen = [], {}
+    for layer in layers:
+        slug = layer_slug(layer.get("description", ""))
+        seen[slug] = seen.get(slug, 0) + 1
+        suffix = f"-{seen[slug]}" if seen[slug] > 1 else ""
+        names.append(f"{stem}.{slug}{suffix}.json")
+    return names
+
+
+def index_file_name(stem: str) -> str:
+    return f".{stem}.index.json"
+
+
+def load_shard_index(index_file: Path) -> dict[str, str]:
+    """
+    Returns a dict of the shard file names in an index file to the hash of
+    their content. A missing or unreadable index is empty.
+    """
+    try:
+        index = loads(index_file.read_text())
+        if index.get("version") == SHARD_INDEX_VERSION:
+            return {shard["file"]: shard["sha256"]
+                    for shard in index["shards"]}
+    except (OSError, JSONDecodeError, KeyError, TypeError, AttributeError):
+        pass
+    return {}
+
+
+def iter_shards(karaml_config: KaramlConfig, stem: str
+                ) -> Iterator[tuple[str, str, str]]:
+    """
+    Yields the file name, the text and the sha256 of the text of each shard
+    of the config.
+    """
+    layers = karaml_config.layers
+    for file_name, layer in zip(shard_file_names(stem, layers), layers):
+        title = f"{karaml_config.title}: {layer.get('description', '')}"
+        text = "".join(iter_json({"title": title, "rules": [layer]}))
+        yield file_name, text, sha256(text.encode("utf-8")).hexdigest()
+
+
+def confirm_foreign_shards(karaml_config: KaramlConfig,
+                           complex_mods_path: Path, stem: str
+                           ) -> dict[str, str]:
+    """
+    Asks the user to confirm overwriting each existing file of a shard that
+    karaml didn't write, i.e. that isn't in the index, before the index is
+    locked. Returns the digests of the files the user agreed to overwrite,
+    by file name, for write_shards.
+    """
+    old_index = load_shard_index(complex_mods_path / index_file_name(stem))
+    confirmed = {}
+    for file_name, _, digest in iter_shards(karaml_config, stem):
+        shard_file = complex_mods_path / file_name
+        if file_name in old_index or not shard_file.exists():
+            continue
+        try:
+            confirmed[file_name] = confirm_before_lock(
+                shard_file, digest, file_name)
+        except WriteAborted:
+            continue
+    return confirmed
+
+
+@timed("write_shards")
+def write_shards(karaml_config: KaramlConfig, complex_mods_path: Path,
+                 stem: str, overwrite: bool = False,
+                 confirmed: dict[str, str] | None = None
+                 ) -> tuple[list[str], list[str], int]:
+    """
+    Writes the shards of the config whose content changed since the last
+    build, removes the shards of layers that are gone and updates the index.
+    Returns the names of the written and the removed shards and the number
+    of unchanged shards.
+
+    An existing file that isn't in the index is only overwritten if the user
+    confirmed it with confirm_foreign_shards and it hasn't changed since, or
+    if overwrite is True.
+    """
+    confirmed = confirmed or {}
+    index_file = complex_mods_path / index_file_name(stem)
+    old_index = load_shard_index(index_file)
+    index, written, unchanged = [], [], 0
+    for file_name, text, digest in iter_shards(karaml_config, stem):
+        shard_file = complex_mods_path / file_name
+        if old_index.get(file_name) == digest and shard_file.exists():
+            index.append({"file": file_name, "sha256": digest})
+            unchanged += 1
+            continue
+
+        if file_name not in old_index and shard_file.exists() and \
+                not overwrite and file_digest(shard_file) not in (
+                    digest, confirmed.get(file_name)):
+            continue
+        if write_chunks(shard_file, [text]):
+            written.append(file_name)
+        else:
+            unchanged += 1
+        index.append({"file": file_name, "sha256": digest})
+
+    current = {shard["file"] for shard in index}
+    removed = [name for name in old_index if name not in current]
+    for name in removed:
+        (complex_mods_path / name).unlink(missing_ok=True)
+
+    write_chunks(index_file, [dumps({
+        "version": SHARD_INDEX_VERSION,
+        "title": karaml_config.title,
+        "shards": index,
+    }, indent=4)])
+    return written, removed, unchanged
+
+
+def write_complex_mods_shards(karaml_config: KaramlConfig, to_file: str,
+                              overwrite: bool = False):
+    """
+    Writes the karaml config to one complex modifications file per layer,
+    named after to_file. See the module docstring. Overwriting files that
+    karaml didn't write is confirmed before the index is locked.
+    """
+    if not to_file or not karaml_config:
+        print("No destination file or karaml config provided. Aborting.")
+        return
+    stem = to_file.removesuffix(".json")
+    complex_mods_path = Path(COMPLEX_MODS_PATH).expanduser()
+
+    print("\nWriting complex modifications by layer to:\n"
+          f"{COMPLEX_MODS_PATH}/{stem}.*.json\n")
+
+    confirmed = None
+    if not overwrite:
+        confirmed = confirm_foreign_shards(
+            karaml_config, complex_mods_path, stem)
+    try:
+        with file_lock(complex_mods_path / index_file_name(stem)):
+            written, removed, unchanged = write_shards(
+                karaml_config, complex_mods_path, stem, overwrite, confirmed)
+    except FileLockTimeout as e:
+        print(e)
+        return
+
+    for name in written:
+        print(f"Wrote {name}")
+    for name in removed:
+        print(f"Removed {name}")
+    print(f"{len(written)} layers written, {len(removed)} removed, "
+          f"{unchanged} unchanged.")
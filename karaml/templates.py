@@ -30,6 +30,7 @@ rules, giving the user more direct control over their complex rule creation.
 from dataclasses import dataclass
 from re import search
 
+from karaml.compile_context import current_context
 from karaml.helpers import (
     check_and_validate_str_as_dict,
     validate_mouse_pos_args,
@@ -38,6 +39,7 @@ from karaml.helpers import (
     validate_sticky_modifier,
     validate_var_value,
 )
+from karaml.timings import timed
 
 
 @dataclass
@@ -121,20 +123,36 @@ TEMPLATES = [
     "var",
 ]
 
-USER_TEMPLATES = {}
+
+def is_template(name: str) -> bool:
+    """
+    Returns True if the name is a default template or a user template of the
+    current compile context.
+    """
+    return name in TEMPLATES or name in current_context().user_templates
+
+
+def template_names() -> list[str]:
+    """
+    Returns the names of the default templates and the user templates of the
+    current compile context.
+    """
+    return TEMPLATES + list(current_context().user_templates)
 
 
+@timed("update_user_templates")
 def update_user_templates(d: dict) -> None:
     """
     Checks the top-level key "templates" for a dict of user-defined
     templates. Each template key should have a value of a string
     representing a valid shell script.
 
-    This function calls functions that update the TEMPLATES dict with the
-    user-defined templates.
+    The user-defined templates are added to the current compile context.
+    Memoized translations are cleared since they may depend on the previous
+    templates.
 
     The "templates" key is popped from the imported YAML dict after updating
-    the TEMPLATES dict.
+    the compile context.
 
     Returns None.
     """
@@ -147,9 +165,12 @@ def update_user_templates(d: dict) -> None:
         if not (template_pattern and template_pattern.group(1)):
             # TODO: raise error
             pass
-        TEMPLATES.append(template)
-        USER_TEMPLATES[template] = ShellCommandTemplate(template, template_def)
+        current_context().add_template(
+            template, ShellCommandTemplate(template, template_def))
 
+    # map_translator imports this module, so import it here to avoid a cycle
+    from karaml.map_translator import clear_translation_cache
+    clear_translation_cache()
     d.pop("templates")
 
 
@@ -212,10 +233,10 @@ def get_user_template_instance(event: str, cmd: str) -> tuple[str, str] | None:
     create a KeyStruct for a user template instance.
     """
 
-    if event not in USER_TEMPLATES:
+    template = current_context().user_templates.get(event)
+    if not template:
         return
 
-    template = USER_TEMPLATES[event]
     template_instance_args = [arg.strip() for arg in cmd.split(",")]
     instance = TemplateInstance(template, template_instance_args)
     return "shell_command", instance.shell_script
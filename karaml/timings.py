@@ -0,0 +1,181 @@
+"""
+Per-stage timing instrumentation for karaml builds.
+
+Stages of the build pipeline are wrapped with the `timed` decorator or the
+`TIMINGS.stage()` context manager, which record the wall time and number of
+calls of each stage. Translated layers are timed individually as well.
+
+Timings are disabled by default. While disabled, `timed` functions only pay for
+a single attribute check and `stage()` returns a shared no-op context manager,
+so the instrumentation can stay in hot paths like the duplicate key check of
+the YAML loader.
+
+Stages can be nested (e.g. `check_duplicate_keys` runs inside
+`load_karaml_config`), so the times of all stages don't add up to the total.
+Stages that run in the worker processes of a parallel build (`--jobs`) are not
+recorded, except for the time of each layer.
+"""
+
+from functools import wraps
+from json import dumps
+from pathlib import Path
+from time import perf_counter
+
+
+class _NoOpStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NO_OP_STAGE = _NoOpStage()
+
+
+class _Stage:
+    def __init__(self, timings: "Timings", name: str):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.timings.start(self.name)
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timings.record(self.name, perf_counter() - self.start)
+        return False
+
+
+class Timings:
+    """
+    Collects the wall time and call counts of the stages of a build.
+
+    Attributes:
+        enabled: Whether timings are recorded.
+        stages: A dict of stage names to a list of [total seconds, calls], in
+            the order the stages were first entered.
+        layers: A dict of layer names to the seconds it took to translate them.
+        counters: A dict of counter names to their counts, e.g. the hits and
+            misses of a cache.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.stages: dict[str, list] = {}
+        self.layers: dict[str, float] = {}
+        self.counters: dict[str, int] = {}
+
+    def enable(self):
+        self.enabled = True
+        self.reset()
+
+    def reset(self):
+        self.stages = {}
+        self.layers = {}
+        self.counters = {}
+
+    def start(self, name: str):
+        """
+        Registers a stage when it is entered, so stages are listed in the
+        order they started rather than the order they finished.
+        """
+        self.stages.setdefault(name, [0.0, 0])
+
+    def record(self, name: str, seconds: float):
+        """
+        Adds a call of a stage that took the given number of seconds.
+        """
+        stage = self.stages.setdefault(name, [0.0, 0])
+        stage[0] += seconds
+        stage[1] += 1
+
+    def record_layer(self, layer_name: str, seconds: float):
+        self.layers[layer_name] = seconds
+
+    def count(self, name: str, n: int = 1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def hit_rates(self) -> dict[str, float]:
+        """
+        Returns the hit rate of every pair of NAME_hits and NAME_misses
+        counters, by NAME.
+        """
+        rates = {}
+        for name, hits in self.counters.items():
+            if not name.endswith("_hits"):
+                continue
+            prefix = name.removesuffix("_hits")
+            lookups = hits + self.counters.get(f"{prefix}_misses", 0)
+            rates[prefix] = hits / lookups if lookups else 0.0
+        return rates
+
+    def stage(self, name: str):
+        """
+        Returns a context manager that times the code in its block as a stage.
+        """
+        if not self.enabled:
+            return NO_OP_STAGE
+        return _Stage(self, name)
+
+    def as_dict(self) -> dict:
+        return {
+            "stages": {
+                name: {"seconds": seconds, "calls": calls}
+                for name, (seconds, calls) in self.stages.items()
+            },
+            "layers": self.layers,
+            "counters": self.counters,
+            "hit_rates": self.hit_rates(),
+        }
+
+    def summary(self) -> str:
+        """
+        Returns a table of the stages and the slowest layers.
+        """
+        rows = ["Timings:", f"  {'stage':<28}{'calls':>8}{'total ms':>12}"]
+        rows += [
+            f"  {name:<28}{calls:>8}{seconds * 1000:>12.1f}"
+            for name, (seconds, calls) in self.stages.items()
+        ]
+        if self.layers:
+            rows += ["", f"  {'layer':<28}{'':>8}{'total ms':>12}"]
+            slowest = sorted(self.layers.items(), key=lambda item: -item[1])
+            rows += [
+                f"  {name:<36}{seconds * 1000:>12.1f}"
+                for name, seconds in slowest[:10]
+            ]
+        if self.counters:
+            rows += ["", f"  {'counter':<28}{'':>8}{'count':>12}"]
+            rows += [f"  {name:<36}{count:>12}"
+                     for name, count in self.counters.items()]
+            rows += [f"  {name + '_hit_rate':<36}{rate:>12.1%}"
+                     for name, rate in self.hit_rates().items()]
+        return "\n".join(rows) + "\n"
+
+    def write_json(self, path: Path):
+        path.write_text(dumps(self.as_dict(), indent=4))
+
+
+TIMINGS = Timings()
+
+
+def timed(name: str):
+    """
+    Decorator that times every call of the decorated function as a stage.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not TIMINGS.enabled:
+                return func(*args, **kwargs)
+            TIMINGS.start(name)
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                TIMINGS.record(name, perf_counter() - start)
+        return wrapper
+    return decorator
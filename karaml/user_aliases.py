@@ -1,16 +1,17 @@
 from re import search
 
+from karaml.compile_context import current_context
 from karaml.helpers import validate_alias_key_code
-from karaml.key_codes import (
-    ALIASES,
-    MODIFIER_ALIASES,
-    MODIFIERS,
-    Alias,
+from karaml.key_codes import MODIFIERS, Alias
+from karaml.map_translator import (
+    clear_translation_cache,
+    parse_primary_key_and_mods,
 )
-from karaml.map_translator import parse_primary_key_and_mods
-from karaml.templates import TEMPLATES
+from karaml.templates import is_template
+from karaml.timings import timed
 
 
+@timed("update_user_aliases")
 def update_user_aliases(d: dict) -> None:
     """
     Checks the top-level key "aliases" for a dict of user-defined
@@ -23,12 +24,13 @@ def update_user_aliases(d: dict) -> None:
         consumer_key_code and pointing_button types, the user should specify
         this third item
 
-    This function calls functions that update the ALIASES dict with the
-    user-defined aliases, as well as the MODIFIER_ALIASES dict if the
-    alias definition includes only modifiers.
+    This function calls functions that add the user-defined aliases to the
+    current compile context, as modifier aliases as well if the alias
+    definition includes only modifiers. Memoized translations are cleared
+    since they may depend on the previous aliases.
 
     The "aliases" key is popped from the imported YAML dict after updating
-    the ALIASES dict.
+    the compile context.
 
     Returns None.
     """
@@ -40,10 +42,12 @@ def update_user_aliases(d: dict) -> None:
         alias_codes = process_alias_definition(alias_name, alias_def)
         alias_primary_key_code, mod_key_codes = alias_codes
 
-        ALIASES[alias_name] = Alias(alias_primary_key_code, mod_key_codes)
+        current_context().add_alias(
+            alias_name, Alias(alias_primary_key_code, mod_key_codes))
 
         add_modifier_alias(alias_name, alias_def)
 
+    clear_translation_cache()
     d.pop("aliases")
 
 
@@ -56,10 +60,9 @@ def process_alias_definition(
     optional modifiers, if any. If the alias definition is a template, the
     primary key code is the entire alias definition string.
 
-    Updates the ALIASES dict, and, if the alias definition is composed
-    entirely of valid modifiers, adds the alias to the MODIFIER_ALIASES
-    dict so they can be used in the "mandatory" and "optional" fields of
-    a rule.
+    If the alias definition is composed entirely of valid modifiers, the
+    alias is also added as a modifier alias by add_modifier_alias, so it can
+    be used in the "mandatory" and "optional" fields of a rule.
 
     Returns a tuple of the primary key code and the optional modifiers.
     """
@@ -79,16 +82,17 @@ def process_alias_definition(
         from sys import exit
         exit(1)
 
-    if template_pattern and template_pattern.group(1) in TEMPLATES:
+    if template_pattern and is_template(template_pattern.group(1)):
         return template_pattern.group(), None
 
     primary_kc, alias_mods = parse_primary_key_and_mods(
         alias_def, f"{alias_name}: {alias_def}"
     )
 
+    keys = current_context().keys
     alias_primary_key_code = (
-        ALIASES.get(primary_kc) or
-        MODIFIER_ALIASES.get(primary_kc) or
+        keys.aliases.get(primary_kc) or
+        keys.modifier_aliases.get(primary_kc) or
         # e.g. `s` counts as `left_shift` only if there's no
         # non-whitespace delimiter in the alias definition, else it's `s`
         MODIFIERS.get(primary_kc) if (
@@ -110,18 +114,21 @@ def process_alias_definition(
 def add_modifier_alias(alias_name: str, alias_def: str) -> None:
     """
     Checks if all the key codes in the alias definition are valid modifier
-    key codes. If so, adds the alias to the MODIFIER_ALIASES dict.
+    key codes. If so, adds the alias to the modifier aliases of the current
+    compile context.
 
     Returns None.
     """
+    context = current_context()
+    modifier_aliases = context.keys.modifier_aliases
     alias_def_items = alias_def.split()
     new_mod_alias_value = ""
     for item in alias_def_items:
-        if item not in MODIFIER_ALIASES and item not in MODIFIERS:
+        if item not in modifier_aliases and item not in MODIFIERS:
             return
         if item in MODIFIERS:
             new_mod_alias_value += item
-        elif item in MODIFIER_ALIASES:
-            new_mod_alias_value += MODIFIER_ALIASES[item]
+        elif item in modifier_aliases:
+            new_mod_alias_value += modifier_aliases[item]
 
-    MODIFIER_ALIASES[alias_name] = new_mod_alias_value
+    context.add_modifier_alias(alias_name, new_mod_alias_value)
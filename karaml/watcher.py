@@ -0,0 +1,98 @@
+"""
+Watch mode for karaml. Keeps a single process alive that recompiles the karaml
+config whenever the file changes and rewrites the configured outputs.
+
+Since the process stays alive, the key-code tables, compiled regexes and the
+in-memory build cache stay warm between builds, so a rebuild after a small edit
+only translates the layers that changed.
+
+The file is polled rather than watched with a platform-specific API. Editors
+often save a file in several steps (truncate + write, or write to a temp file
+and rename it), so a change is only picked up once the file has stopped
+changing for a short debounce interval.
+"""
+
+import traceback
+from pathlib import Path
+from time import perf_counter, sleep
+from typing import Callable
+
+import karaml.cfg
+from karaml.build_cache import BuildCache
+from karaml.file_utils import file_signature
+from karaml.karaml_config import KaramlConfig
+from karaml.timings import TIMINGS
+
+POLL_INTERVAL = 0.2
+DEBOUNCE_INTERVAL = 0.3
+
+
+def wait_for_quiet(path: Path, signature: tuple | None) -> tuple | None:
+    """
+    Waits until the file has not changed for DEBOUNCE_INTERVAL seconds, so a
+    burst of writes from a single save is coalesced into one rebuild. Returns
+    the final signature of the file.
+    """
+    while True:
+        sleep(DEBOUNCE_INTERVAL)
+        latest = file_signature(path)
+        if latest == signature and latest is not None:
+            return latest
+        signature = latest
+
+
+def rebuild(config_file: str, hold_flavor: str, cache: BuildCache | None,
+            write_outputs: Callable[[KaramlConfig], None],
+            jobs: int = 1) -> bool:
+    """
+    Compiles the karaml config and passes it to write_outputs. Errors in the
+    config file are reported without stopping the watcher, including YAML
+    syntax errors of a half-typed edit, a config file that is missing in the
+    middle of an editor's save, and unexpected errors of the build. Returns
+    True if the build succeeded, False otherwise.
+    """
+    TIMINGS.reset()
+    start = perf_counter()
+    try:
+        karaml_config = KaramlConfig(config_file, hold_flavor, cache, jobs)
+        write_outputs(karaml_config)
+    except SystemExit:
+        print("\nBuild failed. Waiting for changes...\n")
+        return False
+    except Exception as e:
+        # yaml.YAMLError, OSError and any other error of a single build
+        report = (traceback.format_exc() if karaml.cfg.DEBUG_FLAG
+                  else "".join(traceback.format_exception_only(e)))
+        print(f"\n{report.strip()}\n\nBuild failed. Waiting for changes...\n")
+        return False
+    elapsed_ms = (perf_counter() - start) * 1000
+    if cache:
+        cache.report()
+    print(f"Rebuilt {config_file} in {elapsed_ms:.1f} ms. "
+          "Waiting for changes...\n")
+    return True
+
+
+def watch_config(config_file: str, hold_flavor: str, cache: BuildCache | None,
+                 write_outputs: Callable[[KaramlConfig], None],
+                 jobs: int = 1):
+    """
+    Builds the karaml config once, then rebuilds it every time the file
+    changes until the user interrupts the process with Ctrl-C.
+    """
+    path = Path(config_file)
+    print(f"Watching {config_file} for changes. Press Ctrl-C to stop.\n")
+
+    signature = file_signature(path)
+    rebuild(config_file, hold_flavor, cache, write_outputs, jobs)
+    try:
+        while True:
+            sleep(POLL_INTERVAL)
+            latest = file_signature(path)
+            if latest == signature:
+                continue
+            signature = wait_for_quiet(path, latest)
+            print(f"\n{config_file} changed, rebuilding...\n")
+            rebuild(config_file, hold_flavor, cache, write_outputs, jobs)
+    except KeyboardInterrupt:
+        print("\nStopped watching.")
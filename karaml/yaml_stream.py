@@ -0,0 +1,55 @@
+"""
+Hands over the top-level items of a karaml config one at a time.
+
+Loading the config with `yaml.load` constructs the objects of the whole file
+before any of it is returned, so the node tree and the objects of every layer
+are alive at once and nothing can be translated until all of them are built.
+Here the node tree is composed first, with libyaml when the loader is one of
+the C loaders, and the top-level items are then constructed one at a time:
+an item is constructed, handed over, and its nodes are freed before the next
+one is constructed. Duplicate keys are collected as in karaml.helpers,
+including duplicate top-level keys.
+"""
+
+from typing import Iterator
+
+from yaml.nodes import MappingNode
+
+import karaml.cfg
+from karaml.exceptions import invalidConfigRoot
+from karaml.helpers import DuplicateKey
+
+
+def iter_top_level(loader) -> Iterator[tuple[object, object]]:
+    """
+    Yields the key and the value of each top-level item of the YAML document
+    loaded by `loader`, e.g. a karaml.helpers.UniqueKeyLoader. Each item is
+    constructed on its own, so the nodes of the items that were handed over
+    are freed.
+
+    Duplicate top-level keys are added to the loader's duplicates. With the
+    "first" policy (karaml.cfg.ON_DUPLICATE), their later values are skipped.
+    """
+    root = loader.get_single_node()
+    if root is None:
+        return
+    if not isinstance(root, MappingNode):
+        invalidConfigRoot(root.start_mark)
+        return
+
+    keep_first = karaml.cfg.ON_DUPLICATE == "first"
+    seen = {}
+    # Popped from the end so the items handed over are no longer referenced
+    root.value.reverse()
+    while root.value:
+        key_node, value_node = root.value.pop()
+        key = loader.construct_document(key_node)
+        mark = key_node.start_mark
+        if key in seen:
+            loader.duplicates.append(
+                DuplicateKey(key, mark, seen[key], value_node))
+            if keep_first:
+                continue
+        else:
+            seen[key] = mark
+        yield key, loader.construct_document(value_node)
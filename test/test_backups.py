@@ -0,0 +1,319 @@
+from datetime import datetime, timedelta
+from json import dumps
+
+import pytest
+
+from karaml.backups import (
+    MANIFEST_NAME,
+    OBJECTS_DIR_NAME,
+    TIME_FORMAT,
+    BackupManifest,
+    RetentionPolicy,
+    apply_retention,
+    backup_karabiner_json,
+    backup_name,
+    clone_file,
+    discard_staged_backup,
+    list_backups,
+    restore_backup,
+    select_backups,
+    stage_backup,
+)
+
+NO_RULES = RetentionPolicy(None, None, None, None, None)
+
+
+@pytest.fixture
+def karabiner_path(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    karabiner_path = tmp_path / ".config" / "karabiner"
+    karabiner_path.mkdir(parents=True)
+    return karabiner_path
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    Makes every backup one hour later than the previous one.
+    """
+    times = (datetime(2023, 1, 1) + timedelta(hours=h) for h in range(1000))
+
+    class FakeDatetime(datetime):
+        @classmethod
+        def now(cls):
+            return next(times)
+
+    monkeypatch.setattr("karaml.backups.datetime", FakeDatetime)
+
+
+def make_backups(karabiner_path, contents, policy=NO_RULES):
+    karabiner_json = karabiner_path / "karabiner.json"
+    for content in contents:
+        karabiner_json.write_text(content)
+        assert backup_karabiner_json(karabiner_path, policy)
+    return karabiner_path / "automatic_backups"
+
+
+def test_backup_name():
+    timestamp = datetime(2023, 4, 5, 6, 7, 8)
+    assert backup_name(timestamp) == \
+        "karabiner.backup.2023-04-05_06-07-08.json"
+
+
+def test_clone_file(tmp_path):
+    src = tmp_path / "src.json"
+    src.write_text("{}" * 100000)
+    clone_file(src, tmp_path / "dst.json")
+    assert (tmp_path / "dst.json").read_text() == src.read_text()
+
+
+def test_backup_karabiner_json_dedupes(karabiner_path, clock):
+    content = '{"profiles": []}' + " " * 1000
+    backup_dir = make_backups(karabiner_path, [content, content])
+
+    backups = sorted(backup_dir.glob("karabiner.backup.*.json"))
+    assert len(backups) == 2
+    assert all(b.read_text() == content for b in backups)
+    assert len(list((backup_dir / OBJECTS_DIR_NAME).iterdir())) == 1
+    assert BackupManifest.load(backup_dir).total_size == len(content)
+
+    (karabiner_path / "karabiner.json").unlink()
+    assert not backup_karabiner_json(karabiner_path)
+
+
+def test_manifest_rebuild(karabiner_path):
+    backup_dir = karabiner_path / "automatic_backups"
+    backup_dir.mkdir()
+    # Backups made before the manifest existed are full copies
+    for i, content in enumerate(["a", "b", "a"]):
+        name = f"karabiner.backup.2023-01-0{i + 1}_00-00-00.json"
+        (backup_dir / name).write_text(content)
+
+    manifest = BackupManifest.load(backup_dir)
+    assert [b["time"][:10] for b in manifest.backups] == [
+        "2023-01-01", "2023-01-02", "2023-01-03"]
+    assert len(manifest.objects) == 2
+    assert manifest.total_size == 2
+    assert (backup_dir / MANIFEST_NAME).exists()
+    assert manifest.find("1") == manifest.backups[-1]
+    assert manifest.find("2023-01-02_00-00-00") == manifest.backups[1]
+    assert manifest.find("9") is None
+
+
+def test_legacy_backups_kept_by_default(karabiner_path, clock):
+    backup_dir = karabiner_path / "automatic_backups"
+    backup_dir.mkdir()
+    # Backups made before the manifest existed
+    for i in range(30):
+        name = f"karabiner.backup.2022-01-{i + 1:02}_00-00-00.json"
+        (backup_dir / name).write_text(f'{{"version": {i}}}')
+
+    # The default policy only prunes the backups karaml recorded
+    make_backups(karabiner_path, [f'{{"new": {i}}}' for i in range(25)],
+                 RetentionPolicy())
+    manifest = BackupManifest.load(backup_dir)
+    assert sum(b.get("legacy", False) for b in manifest.backups) == 30
+    assert len(manifest.backups) == 50
+    assert len(list(backup_dir.glob("karabiner.backup.2022-*.json"))) == 30
+    assert all(obj["compression"] is None
+               for obj in manifest.objects.values())
+
+    # A backups policy in the config applies to all of them
+    make_backups(karabiner_path, ['{"new": 25}'], RetentionPolicy.from_dict(
+        {"keep_last": 10, "keep_daily": None, "keep_weekly": None}))
+    manifest = BackupManifest.load(backup_dir)
+    assert len(manifest.backups) == 10
+    assert not any(b.get("legacy") for b in manifest.backups)
+    assert list(backup_dir.glob("karabiner.backup.2022-*.json")) == []
+
+
+def test_select_backups():
+    start = datetime(2023, 1, 2)  # A Monday
+    backups = [
+        {"time": (start + timedelta(hours=6 * i)).strftime(TIME_FORMAT),
+         "object": str(i), "name": str(i)}
+        for i in range(60)  # 15 days, 4 backups a day
+    ]
+    sizes = {str(i): 10 for i in range(60)}
+
+    def kept(**rules):
+        policy = RetentionPolicy(**{**NO_RULES.__dict__, **rules})
+        return [int(b["name"]) for b in select_backups(backups, policy, sizes)]
+
+    assert kept() == list(range(60))
+    assert kept(keep_last=3) == [57, 58, 59]
+    assert kept(keep_daily=3) == [51, 55, 59]
+    assert kept(keep_weekly=2) == [55, 59]
+    assert kept(keep_last=2, keep_daily=2) == [55, 58, 59]
+    assert kept(keep_last=10, max_size_mb=0.00004) == [56, 57, 58, 59]
+    assert kept(keep_last=10, max_size_mb=0) == [59]
+
+
+def test_apply_retention_prunes_and_compresses(karabiner_path, clock):
+    backup_dir = make_backups(
+        karabiner_path, [f'{{"version": {i}}}' * 100 for i in range(6)])
+    manifest = BackupManifest.load(backup_dir)
+
+    pruned = apply_retention(manifest, RetentionPolicy(
+        keep_last=4, keep_daily=None, keep_weekly=None, max_size_mb=None,
+        compress_after=2, compression="xz"))
+    manifest.save()
+    assert pruned == 2
+    manifest = BackupManifest.load(backup_dir)
+    assert len(manifest.backups) == 4
+    compressions = [manifest.objects[b["object"]]["compression"]
+                    for b in manifest.backups]
+    assert compressions == ["xz", "xz", None, None]
+    # Only the uncompressed backups are still linked files
+    assert len(list(backup_dir.glob("karabiner.backup.*.json"))) == 2
+    assert len(list((backup_dir / OBJECTS_DIR_NAME).iterdir())) == 4
+    assert manifest.read_object(manifest.backups[0]["object"]) == \
+        b'{"version": 2}' * 100
+
+    # Compressed backups outlive the loss of the manifest
+    (backup_dir / MANIFEST_NAME).unlink()
+    rebuilt = BackupManifest.load(backup_dir)
+    assert {b["object"] for b in rebuilt.backups} == \
+        {b["object"] for b in manifest.backups}
+    assert apply_retention(rebuilt, NO_RULES) == 0
+    assert rebuilt.objects.keys() == manifest.objects.keys()
+    assert len(list((backup_dir / OBJECTS_DIR_NAME).iterdir())) == 4
+
+
+def test_list_and_restore(karabiner_path, clock):
+    make_backups(karabiner_path, ['{"a": 1}', '{"a": 2}'], RetentionPolicy(
+        keep_last=None, keep_daily=None, keep_weekly=None, max_size_mb=None,
+        compress_after=0))
+    karabiner_json = karabiner_path / "karabiner.json"
+    karabiner_json.write_text('{"a": 3}')
+
+    lines = list_backups(karabiner_path)
+    assert len(lines) == 2
+    assert lines[0].split()[:2] == ["1", "2023-01-01_01-00-00"]
+
+    assert restore_backup(karabiner_path, "2", NO_RULES)
+    assert karabiner_json.read_text() == '{"a": 1}'
+    # The replaced karabiner.json was backed up first
+    assert len(list_backups(karabiner_path)) == 3
+    assert not restore_backup(karabiner_path, "missing")
+
+
+def test_retention_policy_from_dict():
+    assert RetentionPolicy.from_dict(None) == RetentionPolicy()
+    policy = RetentionPolicy.from_dict({"keep_last": 5, "max_size_mb": None})
+    assert policy.keep_last == 5 and policy.max_size is None
+    assert policy.keep_daily == RetentionPolicy().keep_daily
+    # A backups policy applies to the legacy backups too, unless it says not
+    assert RetentionPolicy().keep_legacy and not policy.keep_legacy
+    assert RetentionPolicy.from_dict({"keep_legacy": True}).keep_legacy
+    assert RetentionPolicy().compress_after is None
+
+    invalid = [{"keep_hourly": 1}, {"keep_last": "5"}, {"keep_last": 2.5},
+               {"compression": "zip"}, {"keep_legacy": 1}, ["keep_last"]]
+    for policy in invalid:
+        with pytest.raises(SystemExit):
+            RetentionPolicy.from_dict(policy)
+
+
+def test_delta_backups(karabiner_path, clock):
+    karabiner = {"profiles": [
+        {"name": "Karaml", "rules": [{"key_code": str(i)} for i in range(200)]}
+    ]}
+    versions = []
+    for i in range(5):
+        karabiner["profiles"][0]["rules"][i]["key_code"] = "changed"
+        versions.append(dumps(karabiner, indent=4))
+    versions.append("not json, stored in full")
+    policy = RetentionPolicy(None, None, None, None, None, delta=True,
+                             rebase_every=3)
+    backup_dir = make_backups(karabiner_path, versions, policy)
+
+    manifest = BackupManifest.load(backup_dir)
+    bases = [manifest.objects[b["object"]].get("base")
+             for b in manifest.backups]
+    first = manifest.backups[0]["object"]
+    assert bases == [None, first, first, first, None, None]
+    for backup, version in zip(manifest.backups, versions):
+        assert manifest.read_object(backup["object"]).decode() == version
+        assert manifest.objects[backup["object"]]["size"] == len(version)
+    # Only full backups have a timestamped file
+    assert len(list(backup_dir.glob("karabiner.backup.*.json"))) == 3
+    assert "delta" in list_backups(karabiner_path)[2]
+
+    # Rebuilding the manifest finds the bases of the deltas again
+    (backup_dir / MANIFEST_NAME).unlink()
+    rebuilt = BackupManifest.load(backup_dir)
+    assert {d: o.get("base") for d, o in rebuilt.objects.items()} == \
+        {d: o.get("base") for d, o in manifest.objects.items()}
+    # and lists the deltas, which have no timestamped file, as recovered
+    assert len(rebuilt.backups) == len(manifest.backups)
+    assert {b["object"] for b in rebuilt.backups} == set(manifest.objects)
+
+    # A base is kept as long as a delta needs it
+    apply_retention(manifest, RetentionPolicy(
+        keep_last=1, keep_daily=None, keep_weekly=None, max_size_mb=None,
+        compress_after=None))
+    assert len(manifest.backups) == 1
+    apply_retention(manifest, RetentionPolicy(
+        keep_last=None, keep_daily=None, keep_weekly=None, max_size_mb=None,
+        compress_after=None))
+    assert manifest.read_object(manifest.backups[-1]["object"]).decode() == \
+        versions[-1]
+
+
+def test_staged_backups(karabiner_path, clock):
+    karabiner = {"profiles": [{"rules": [{"key_code": str(i)}
+                                         for i in range(200)]}]}
+    first = dumps(karabiner, indent=4)
+    karabiner["profiles"][0]["rules"][0]["key_code"] = "changed"
+    second = dumps(karabiner, indent=4)
+    policy = RetentionPolicy(None, None, None, None, None, delta=True)
+    backup_dir = make_backups(karabiner_path, [first], policy)
+    objects = backup_dir / OBJECTS_DIR_NAME
+
+    # A discarded backup leaves nothing behind
+    karabiner_json = karabiner_path / "karabiner.json"
+    karabiner_json.write_text(second)
+    discard_staged_backup(stage_backup(karabiner_path))
+    assert len(list(objects.iterdir())) == 1
+
+    # A staged backup is stored as a delta if the policy asks for it
+    staged = stage_backup(karabiner_path)
+    assert staged.is_new
+    assert backup_karabiner_json(karabiner_path, policy, staged)
+    manifest = BackupManifest.load(backup_dir)
+    assert "base" in manifest.objects[staged.digest]
+    assert manifest.read_object(staged.digest).decode() == second
+    assert len(list(objects.iterdir())) == 2
+
+    assert stage_backup(karabiner_path / "missing") is None
+
+
+def test_list_and_restore_without_backups(karabiner_path, capsys):
+    assert list_backups(karabiner_path) == []
+    assert not restore_backup(karabiner_path, "1", NO_RULES)
+    assert capsys.readouterr().out == "No backups found.\n"
+    # The missing backup folder isn't created just to hold a manifest
+    assert not (karabiner_path / "automatic_backups").exists()
+
+
+def test_staging_keeps_compressed_objects(karabiner_path, clock):
+    compress = RetentionPolicy(None, None, None, None, compress_after=0)
+    backup_dir = make_backups(karabiner_path, ['{"a": 1}'], compress)
+    objects = backup_dir / OBJECTS_DIR_NAME
+    [compressed] = objects.glob("*.json.xz")
+
+    # Staging runs without the lock, while the manifest of another process
+    # may still refer to the compressed object
+    staged = stage_backup(karabiner_path)
+    assert not staged.is_new
+    assert compressed.exists()
+    assert BackupManifest.load(backup_dir).read_object(staged.digest) == \
+        b'{"a": 1}'
+
+    # Recording the backup under the lock removes it
+    assert backup_karabiner_json(karabiner_path, NO_RULES, staged)
+    assert not compressed.exists()
+    manifest = BackupManifest.load(backup_dir)
+    assert manifest.objects[staged.digest]["compression"] is None
+    assert [p.name for p in objects.iterdir()] == [f"{staged.digest}.json"]
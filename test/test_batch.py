@@ -0,0 +1,83 @@
+from json import loads
+
+import pytest
+from testing_assets import FULL_CONFIG_PATH, FULL_CONFIG_SAMPLE, HOLD_FLAVOR
+
+import karaml.cfg
+from karaml.__main__ import build_main
+from karaml.batch import (
+    build_configs,
+    find_config_files,
+    format_results,
+    output_files,
+)
+
+
+def make_configs(path):
+    (path / "sub").mkdir(parents=True)
+    (path / "full.yaml").write_text(open(FULL_CONFIG_PATH).read())
+    (path / "laptop.yaml").write_text(
+        "aliases:\n  hyper_alias: left_arrow\n/base/:\n  h: hyper_alias\n")
+    # Same name, and uses an alias it doesn't define
+    (path / "sub" / "laptop.yml").write_text("/base/:\n  h: hyper_alias\n")
+    (path / "notes.txt").write_text("not a config")
+    return path
+
+
+def test_find_config_files(tmp_path):
+    configs = make_configs(tmp_path / "configs")
+    config_files = find_config_files(
+        [str(configs), str(configs / "sub"), str(configs / "full.yaml")])
+    assert config_files == [
+        str(configs / "full.yaml"),
+        str(configs / "laptop.yaml"),
+        str(configs / "sub" / "laptop.yml"),
+    ]
+    assert output_files(config_files, tmp_path) == [
+        tmp_path / "full.json",
+        tmp_path / "laptop.json",
+        tmp_path / "laptop-2.json",
+    ]
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_build_configs(tmp_path, jobs):
+    configs = make_configs(tmp_path / "configs")
+    config_files = find_config_files([str(configs), str(configs / "sub")])
+    out = tmp_path / "out"
+
+    full, laptop, sub_laptop = build_configs(
+        config_files, out, HOLD_FLAVOR, jobs)
+    assert full.error is None and full.written
+    assert loads((out / "full.json").read_text()) == {
+        "title": FULL_CONFIG_SAMPLE.title,
+        "rules": FULL_CONFIG_SAMPLE.layers,
+    }
+    assert laptop.error is None and laptop.rules == 1
+    # The aliases of one config don't leak into the next
+    assert "Invalid" in sub_laptop.error
+    assert not (out / "laptop-2.json").exists()
+
+    summary = format_results([full, laptop, sub_laptop], 1.0)
+    assert "Built 2 of 3 configs in 1.00s, 1 failed" in summary
+
+    results = build_configs(config_files[:2], out, HOLD_FLAVOR, jobs)
+    assert [result.written for result in results] == [False, False]
+
+
+def test_build_main(tmp_path, capsys, monkeypatch):
+    # build_main sets the global flags, so restore them afterwards
+    for flag in ["DEBUG_FLAG", "ON_DUPLICATE"]:
+        monkeypatch.setattr(karaml.cfg, flag, getattr(karaml.cfg, flag))
+    configs = make_configs(tmp_path / "configs")
+    out = tmp_path / "out"
+    build_main([str(configs), "-o", str(out), "--no-cache"])
+    assert "Built 2 of 2 configs" in capsys.readouterr().out
+
+    with pytest.raises(SystemExit):
+        build_main([str(configs / "sub"), "-o", str(out), "--no-cache"])
+    assert "1 failed" in capsys.readouterr().out
+
+    # Prompting is never an option
+    with pytest.raises(SystemExit):
+        build_main([str(configs), "-o", str(out), "--on-duplicate=prompt"])
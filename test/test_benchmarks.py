@@ -0,0 +1,59 @@
+import yaml
+from testing_assets import FULL_CONFIG_PATH, HOLD_FLAVOR
+
+from benchmarks.runner import (
+    LOADERS,
+    STAGES,
+    benchmark_loaders,
+    benchmark_spec,
+    compare,
+    format_loader_results,
+    load_config,
+)
+from benchmarks.synthetic import SyntheticSpec, generate_config
+from karaml.karaml_config import KaramlConfig
+
+
+def test_generate_config(tmp_path):
+    spec = SyntheticSpec("test", layers=3, maps_per_layer=120,
+                         app_condition_share=0.2, simultaneous_share=0.3)
+    config_file = tmp_path / "synthetic.yaml"
+    config_file.write_text(generate_config(spec))
+    assert generate_config(spec) == config_file.read_text()
+
+    karaml_config = KaramlConfig(str(config_file), HOLD_FLAVOR)
+    assert karaml_config.rule_count == spec.mappings
+    assert len(karaml_config.layers) == spec.layers
+
+
+def test_load_config():
+    with open(FULL_CONFIG_PATH) as f:
+        expected = yaml.safe_load(f)
+    for loader in LOADERS.values():
+        assert load_config(FULL_CONFIG_PATH, loader) == expected
+
+
+def test_benchmark_spec():
+    result = benchmark_spec(SyntheticSpec("smoke", 2, 10), repeat=1)
+    assert result["mappings"] == 20
+    assert list(result["stages"]) == STAGES
+    assert result["mappings_per_second"] > 0
+    assert result["peak_memory_bytes"] > 0
+
+
+def test_benchmark_loaders():
+    results = {"smoke": benchmark_loaders(SyntheticSpec("smoke", 2, 10), 1)}
+    assert list(results["smoke"]["loaders"]) == list(LOADERS)
+    assert "smoke" in format_loader_results(results)
+
+
+def test_compare():
+    baseline = {"medium": {"mappings_per_second": 1000,
+                           "peak_memory_bytes": 1000}}
+    same = {"medium": {"mappings_per_second": 900,
+                       "peak_memory_bytes": 1100}}
+    slower = {"medium": {"mappings_per_second": 700,
+                         "peak_memory_bytes": 1500}}
+    assert not compare(same, baseline, tolerance=0.2)
+    assert len(compare(slower, baseline, tolerance=0.2)) == 2
+    assert not compare({"other": slower["medium"]}, baseline)
@@ -0,0 +1,60 @@
+from pathlib import Path
+
+from testing_assets import FULL_CONFIG_PATH, FULL_CONFIG_SAMPLE, HOLD_FLAVOR
+
+from karaml.build_cache import BuildCache
+from karaml.karaml_config import KaramlConfig
+
+
+def copy_config(tmp_path: Path) -> Path:
+    config_file = tmp_path / "karaml.yaml"
+    config_file.write_text(Path(FULL_CONFIG_PATH).read_text())
+    return config_file
+
+
+def test_unchanged_config_short_circuits(tmp_path):
+    config_file = copy_config(tmp_path)
+    cache = BuildCache(tmp_path / "cache")
+
+    first = KaramlConfig(str(config_file), HOLD_FLAVOR, cache)
+    assert not cache.unchanged
+    assert cache.hits == 0
+    assert cache.misses == len(first.layers) - 1  # the /JSON/ layer
+
+    # A new cache object reads the previous build from disk
+    cache = BuildCache(tmp_path / "cache")
+    second = KaramlConfig(str(config_file), HOLD_FLAVOR, cache)
+    assert cache.unchanged
+    assert second.layers == first.layers == FULL_CONFIG_SAMPLE.layers
+    assert second.title == first.title
+    assert second.profile_name == first.profile_name
+    assert second.params == first.params
+
+
+def test_only_edited_layers_are_translated(tmp_path):
+    config_file = copy_config(tmp_path)
+    cache = BuildCache(tmp_path / "cache")
+    KaramlConfig(str(config_file), HOLD_FLAVOR, cache)
+
+    # Edit a single map in the /nav/ layer
+    config = config_file.read_text()
+    edited = config.replace("/nav/:\n", "/nav/:\n  <c-q>: escape\n", 1)
+    assert edited != config
+    config_file.write_text(edited)
+
+    rebuilt = KaramlConfig(str(config_file), HOLD_FLAVOR, cache)
+    assert not cache.unchanged
+    assert cache.misses == 1
+    assert cache.hits == len(rebuilt.layers) - 2
+
+    uncached = KaramlConfig(str(config_file), HOLD_FLAVOR)
+    assert rebuilt.layers == uncached.layers
+
+
+def test_hold_flavor_invalidates_cache(tmp_path):
+    config_file = copy_config(tmp_path)
+    cache = BuildCache(tmp_path / "cache")
+    KaramlConfig(str(config_file), HOLD_FLAVOR, cache)
+    KaramlConfig(str(config_file), "to_if_held_down", cache)
+    assert not cache.unchanged
+    assert cache.hits == 0
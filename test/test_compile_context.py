@@ -0,0 +1,86 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from testing_assets import HOLD_FLAVOR
+
+from karaml.compile_context import (
+    DEFAULT_CONTEXT,
+    CompileContext,
+    current_context,
+)
+from karaml.karaml_config import KaramlConfig
+from karaml.key_codes import ALIASES, KEY_REGISTRY
+from karaml.user_aliases import update_user_aliases
+
+
+def write_config(path, alias: str, template: str):
+    path.write_text(
+        "templates:\n"
+        f"  tmpl: {template} %s\n"
+        "aliases:\n"
+        f"  ctx_alias: {alias}\n"
+        "/base/:\n"
+        "  a: ctx_alias\n"
+        "  b: tmpl(x)\n"
+    )
+    return str(path)
+
+
+def base_to_events(config: KaramlConfig) -> list:
+    manipulators = config.layers[-1]["manipulators"]
+    return [manipulator["to"] for manipulator in manipulators]
+
+
+def test_activate():
+    assert current_context() is DEFAULT_CONTEXT
+    context = CompileContext()
+    with context.activate():
+        assert current_context() is context
+        with CompileContext().activate() as inner:
+            assert current_context() is inner
+        assert current_context() is context
+    assert current_context() is DEFAULT_CONTEXT
+
+
+def test_registries_are_copied_on_write():
+    context = CompileContext()
+    assert context.keys is KEY_REGISTRY
+    with context.activate():
+        update_user_aliases({"aliases": {"cow_alias": "<c-j>"}})
+    assert context.keys is not KEY_REGISTRY
+    assert context.keys.get("cow_alias")
+    assert "cow_alias" not in ALIASES and not KEY_REGISTRY.get("cow_alias")
+
+
+def test_configs_are_isolated(tmp_path):
+    first = KaramlConfig(
+        write_config(tmp_path / "first.yaml", "left_arrow", "echo"),
+        HOLD_FLAVOR)
+    second = KaramlConfig(
+        write_config(tmp_path / "second.yaml", "right_arrow", "say"),
+        HOLD_FLAVOR)
+    assert base_to_events(first) == [
+        [{"key_code": "left_arrow"}], [{"shell_command": "echo x"}]]
+    assert base_to_events(second) == [
+        [{"key_code": "right_arrow"}], [{"shell_command": "say x"}]]
+    assert not current_context().keys.get("ctx_alias")
+    assert "tmpl" not in current_context().user_templates
+
+    # Each config only knows its own aliases
+    (tmp_path / "third.yaml").write_text("/base/:\n  a: ctx_alias\n")
+    with pytest.raises(SystemExit):
+        KaramlConfig(str(tmp_path / "third.yaml"), HOLD_FLAVOR)
+
+
+def test_threaded_configs(tmp_path):
+    arrows = ["left_arrow", "right_arrow", "up_arrow", "down_arrow"] * 4
+    paths = [
+        write_config(tmp_path / f"{i}.yaml", arrow, f"echo {i}")
+        for i, arrow in enumerate(arrows)
+    ]
+    with ThreadPoolExecutor(4) as executor:
+        configs = list(executor.map(
+            lambda path: KaramlConfig(path, HOLD_FLAVOR), paths))
+    for i, (arrow, config) in enumerate(zip(arrows, configs)):
+        assert base_to_events(config) == [
+            [{"key_code": arrow}], [{"shell_command": f"echo {i} x"}]]
@@ -0,0 +1,77 @@
+from threading import Event, Thread
+
+import pytest
+
+import karaml.cfg
+from karaml.file_lock import FileLockTimeout, file_lock, lock_file_path
+
+
+@pytest.fixture
+def target(tmp_path):
+    target = tmp_path / "karabiner.json"
+    target.write_text("{}")
+    return target
+
+
+def hold_lock(path, locked: Event, release: Event):
+    with file_lock(path):
+        locked.set()
+        release.wait(5)
+
+
+def test_lock_file_path(target):
+    assert lock_file_path(target) == target.with_name(".karabiner.json.lock")
+
+    link = target.with_name("link.json")
+    link.symlink_to(target)
+    assert lock_file_path(link) == lock_file_path(target)
+
+
+def test_file_lock_times_out_while_held(target):
+    locked, release = Event(), Event()
+    holder = Thread(target=hold_lock, args=(target, locked, release))
+    holder.start()
+    try:
+        assert locked.wait(5)
+        with pytest.raises(FileLockTimeout, match="--lock-timeout"):
+            with file_lock(target, timeout=0.1):
+                pass
+    finally:
+        release.set()
+        holder.join()
+
+    # Released once the holder is done
+    with file_lock(target, timeout=0):
+        pass
+
+
+def test_file_lock_waits_for_release(target):
+    locked, release = Event(), Event()
+    holder = Thread(target=hold_lock, args=(target, locked, release))
+    holder.start()
+    assert locked.wait(5)
+    Thread(target=lambda: release.wait(0.1) or release.set()).start()
+    with file_lock(target, timeout=5):
+        assert release.is_set()
+    holder.join()
+
+
+def test_file_lock_default_timeout(target, monkeypatch):
+    monkeypatch.setattr(karaml.cfg, "LOCK_TIMEOUT", 0)
+    locked, release = Event(), Event()
+    holder = Thread(target=hold_lock, args=(target, locked, release))
+    holder.start()
+    try:
+        assert locked.wait(5)
+        with pytest.raises(FileLockTimeout):
+            with file_lock(target):
+                pass
+    finally:
+        release.set()
+        holder.join()
+
+
+def test_file_lock_missing_directory(tmp_path):
+    with file_lock(tmp_path / "missing" / "karabiner.json"):
+        pass
+    assert not (tmp_path / "missing").exists()
@@ -0,0 +1,13 @@
+from karaml.file_utils import file_signature
+
+
+def test_file_signature(tmp_path):
+    config_file = tmp_path / "karaml.yaml"
+    assert file_signature(config_file) is None
+
+    config_file.write_text("/base/:\n  a: b\n")
+    signature = file_signature(config_file)
+    assert signature == file_signature(config_file)
+
+    config_file.write_text("/base/:\n  a: c\n  b: a\n")
+    assert file_signature(config_file) != signature
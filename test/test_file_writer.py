@@ -0,0 +1,191 @@
+from copy import copy
+from json import dumps, loads
+
+import pytest
+from testing_assets import FULL_CONFIG_SAMPLE
+
+import karaml.cfg
+from karaml.file_lock import file_lock
+from karaml.file_writer import (
+    KarabinerPrefetch,
+    target_profiles,
+    update_karabiner_json,
+    write_complex_mods_json,
+)
+
+PROFILES = [
+    {"name": name, "complex_modifications": {"rules": []}}
+    for name in ["Default", "Laptop", "External"]
+]
+
+
+@pytest.fixture
+def karabiner_json(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    karabiner_path = tmp_path / ".config" / "karabiner"
+    karabiner_path.mkdir(parents=True)
+    karabiner_json = karabiner_path / "karabiner.json"
+    karabiner_json.write_text(dumps({"profiles": PROFILES}, indent=4))
+    return karabiner_json
+
+
+def config_with_profiles(profiles: list) -> object:
+    karaml_config = copy(FULL_CONFIG_SAMPLE)
+    karaml_config.profiles = profiles
+    return karaml_config
+
+
+def test_target_profiles():
+    karaml_config = config_with_profiles([
+        {"name": "Laptop", "params": {}},
+        {"name": "External", "params": {"parameters": {"a": 1}}},
+    ])
+    assert target_profiles(karaml_config) == [
+        ("Laptop", True, {}), ("External", True, {"parameters": {"a": 1}})]
+    assert target_profiles(karaml_config, ["External", "Other", "Other"]) == [
+        ("External", True, {"parameters": {"a": 1}}), ("Other", True, {})]
+    assert target_profiles(config_with_profiles([])) == [
+        (FULL_CONFIG_SAMPLE.profile_name, True, {})]
+
+
+def test_update_karabiner_json_profiles(karabiner_json):
+    timeout = "basic.to_if_alone_timeout_milliseconds"
+    karaml_config = config_with_profiles([
+        {"name": "Laptop", "params": {}},
+        {"name": "External", "params": {"parameters": {timeout: 150}}},
+        {"name": "Presentation", "params": {}},
+    ])
+    update_karabiner_json(karaml_config)
+
+    profiles = loads(karabiner_json.read_text())["profiles"]
+    assert [p["name"] for p in profiles] == [
+        "Default", "Laptop", "External", "Presentation"]
+    assert profiles[0]["complex_modifications"] == {"rules": []}
+    rules = loads(dumps(FULL_CONFIG_SAMPLE.layers))
+    for profile in profiles[1:]:
+        assert profile["complex_modifications"]["rules"] == rules
+    params = [p["complex_modifications"]["parameters"] for p in profiles[1:]]
+    assert params[0] == params[2] == \
+        FULL_CONFIG_SAMPLE.params["parameters"]
+    assert params[1] == {**params[0], timeout: 150}
+    # One backup for the whole update
+    backups = karabiner_json.parent / "automatic_backups"
+    assert len(list(backups.glob("karabiner.backup.*.json"))) == 1
+
+
+def test_update_karabiner_json_locked(karabiner_json, monkeypatch, capsys):
+    monkeypatch.setattr(karaml.cfg, "LOCK_TIMEOUT", 0)
+    before = karabiner_json.read_text()
+    with file_lock(karabiner_json):
+        update_karabiner_json(config_with_profiles([]))
+    assert karabiner_json.read_text() == before
+    assert "Could not lock" in capsys.readouterr().out
+
+
+def backup_objects(karabiner_json) -> list:
+    objects = karabiner_json.parent / "automatic_backups" / "objects"
+    return sorted(objects.glob("*.json*"))
+
+
+def test_update_karabiner_json_prefetch(karabiner_json):
+    before = karabiner_json.read_text()
+    karaml_config = config_with_profiles([{"name": "Laptop", "params": {}}])
+    prefetch = KarabinerPrefetch()
+    update_karabiner_json(karaml_config, prefetch=prefetch)
+
+    backups = karabiner_json.parent / "automatic_backups"
+    backup_files = list(backups.glob("karabiner.backup.*.json"))
+    assert len(backup_files) == 1
+    assert backup_files[0].read_text() == before
+    written = karabiner_json.read_text()
+    assert "complex_modifications" in written and written != before
+
+    # Unchanged: the staged backup is dropped again
+    update_karabiner_json(karaml_config, prefetch=KarabinerPrefetch())
+    assert karabiner_json.read_text() == written
+    assert len(list(backups.glob("karabiner.backup.*.json"))) == 1
+    assert len(backup_objects(karabiner_json)) == 1
+
+
+def test_update_karabiner_json_prefetch_stale(karabiner_json):
+    karaml_config = config_with_profiles([{"name": "Laptop", "params": {}}])
+    prefetch = KarabinerPrefetch()
+    prefetch.future.result()
+    # Changed by something other than karaml after it was prefetched
+    edited = loads(karabiner_json.read_text())
+    edited["profiles"].append({"name": "Edited", "complex_modifications": {}})
+    karabiner_json.write_text(dumps(edited, indent=4) + "\n")
+    update_karabiner_json(karaml_config, prefetch=prefetch)
+
+    profiles = loads(karabiner_json.read_text())["profiles"]
+    assert [p["name"] for p in profiles] == [
+        "Default", "Laptop", "External", "Edited"]
+    # Only the backup of the edited file is kept
+    assert len(backup_objects(karabiner_json)) == 1
+
+
+def test_prefetch_close_discards_staged_backup(karabiner_json):
+    # The build failed, so the prefetched snapshot is never used
+    prefetch = KarabinerPrefetch()
+    prefetch.future.result()
+    assert len(backup_objects(karabiner_json)) == 1
+    prefetch.close()
+    assert backup_objects(karabiner_json) == []
+    # and the lock is released
+    update_karabiner_json(config_with_profiles([]))
+    assert len(backup_objects(karabiner_json)) == 1
+
+
+def test_prefetch_doesnt_hold_the_lock(karabiner_json, monkeypatch):
+    monkeypatch.setattr(karaml.cfg, "LOCK_TIMEOUT", 0)
+    karaml_config = config_with_profiles([{"name": "Laptop", "params": {}}])
+    prefetch = KarabinerPrefetch()
+    prefetch.future.result()
+
+    # Another karaml process updates karabiner.json during the build
+    update_karabiner_json(config_with_profiles([{
+        "name": "External", "params": {}}]))
+    other = karabiner_json.read_text()
+    update_karabiner_json(karaml_config, prefetch=prefetch)
+
+    profiles = loads(karabiner_json.read_text())["profiles"]
+    rules = loads(dumps(FULL_CONFIG_SAMPLE.layers))
+    assert [p["complex_modifications"].get("rules") for p in profiles] == \
+        [[], rules, rules]
+    # The second update backed up the output of the first one, and the
+    # manifest still matches the stored objects
+    manifest = loads((karabiner_json.parent / "automatic_backups" /
+                      "manifest.json").read_text())
+    assert len(manifest["objects"]) == len(backup_objects(karabiner_json))
+    backups = sorted((karabiner_json.parent / "automatic_backups")
+                     .glob("karabiner.backup.*.json"))
+    assert backups[-1].read_text() == other
+
+
+def test_write_complex_mods_json_asks_before_locking(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.setattr(karaml.cfg, "LOCK_TIMEOUT", 0)
+    mods_file = tmp_path / ".config/karabiner/assets/complex_modifications" \
+        / "mods.json"
+    mods_file.parent.mkdir(parents=True)
+    mods_file.write_text("{}")
+
+    def answer(prompt):
+        # Other writers can take the lock while the user is asked
+        with file_lock(mods_file):
+            pass
+        return "Y"
+
+    monkeypatch.setattr("builtins.input", answer)
+    write_complex_mods_json(FULL_CONFIG_SAMPLE, "mods.json")
+    assert loads(mods_file.read_text())["title"] == FULL_CONFIG_SAMPLE.title
+
+    # A file changed between the prompt and the write is left alone
+    def answer_and_edit(prompt):
+        mods_file.write_text('{"edited": true}')
+        return "Y"
+
+    mods_file.write_text("{}")
+    monkeypatch.setattr("builtins.input", answer_and_edit)
+    write_complex_mods_json(FULL_CONFIG_SAMPLE, "mods.json")
+    assert mods_file.read_text() == '{"edited": true}'
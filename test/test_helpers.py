@@ -1,8 +1,18 @@
 # TODO: Migrate all helper tests to this file
 
 import pytest
+import yaml
+from testing_assets import FULL_CONFIG_PATH
 
-from karaml.helpers import check_and_validate_str_as_dict, validate_mouse_pos_args
+import karaml.cfg
+from karaml.helpers import (
+    PyUniqueKeyLoader,
+    UniqueKeyLoader,
+    check_and_validate_str_as_dict,
+    load_unique_keys,
+    resolve_duplicate_keys,
+    validate_mouse_pos_args,
+)
 
 
 def test_validate_mouse_pos_args():
@@ -70,3 +80,46 @@ def test_check_and_validate_str_as_dict():
     with pytest.raises(SystemExit) as pytest_wrapped_e:
         check_and_validate_str_as_dict("{hello: 'world'}")
     assert pytest_wrapped_e.type == SystemExit
+
+
+DUPLICATES_YAML = (
+    "/base/:\n  a: b\n  c: {x: 1, x: 2}\n  a: d\n  1: e\n  1: f\n")
+
+
+@pytest.mark.parametrize("loader", [PyUniqueKeyLoader, UniqueKeyLoader])
+def test_unique_key_loader(loader, monkeypatch):
+    with open(FULL_CONFIG_PATH) as f:
+        text = f.read()
+    assert load_unique_keys(text, loader) == \
+        (yaml.load(text, Loader=yaml.SafeLoader), [])
+
+    data, duplicates = load_unique_keys(DUPLICATES_YAML, loader)
+    assert data == {"/base/": {"a": "d", "c": {"x": 2}, 1: "f"}}
+    assert [(d.key, d.first_mark.line, d.mark.line) for d in duplicates] == \
+        [("x", 2, 2), ("a", 1, 3), (1, 4, 5)]
+
+    monkeypatch.setattr(karaml.cfg, "ON_DUPLICATE", "first")
+    data, duplicates = load_unique_keys(DUPLICATES_YAML, loader)
+    assert data == {"/base/": {"a": "b", "c": {"x": 1}, 1: "e"}}
+    assert len(duplicates) == 3
+
+
+def test_resolve_duplicate_keys(monkeypatch, capsys):
+    _, duplicates = load_unique_keys(DUPLICATES_YAML)
+    resolve_duplicate_keys([], "error")
+
+    with pytest.raises(SystemExit):
+        resolve_duplicate_keys(duplicates, "error")
+    assert capsys.readouterr().out.count("Duplicate key found") == 3
+
+    resolve_duplicate_keys(duplicates, "last")
+    assert "Keeping the last value" in capsys.readouterr().out
+
+    # Never prompts without a terminal to answer it
+    monkeypatch.setattr("sys.stdin.isatty", lambda: False)
+    with pytest.raises(SystemExit):
+        resolve_duplicate_keys(duplicates, "prompt")
+
+    monkeypatch.setattr("sys.stdin.isatty", lambda: True)
+    monkeypatch.setattr("builtins.input", lambda prompt: "y")
+    resolve_duplicate_keys(duplicates, "prompt")
@@ -0,0 +1,45 @@
+from copy import deepcopy
+from json import dumps
+
+from testing_assets import FULL_CONFIG_SAMPLE
+
+from karaml.json_delta import apply_delta, diff_json
+
+OLD = {
+    "global": {"show_in_menu_bar": True},
+    "profiles": [
+        {"name": "Default", "complex_modifications": {"rules": []}},
+        {"name": "Karaml", "complex_modifications": {
+            "rules": deepcopy(FULL_CONFIG_SAMPLE.layers)}},
+    ],
+}
+
+
+def check_round_trip(old, new) -> list:
+    op = diff_json(old, new)
+    assert dumps(apply_delta(old, op), indent=4) == dumps(new, indent=4)
+    return op
+
+
+def test_diff_json_round_trip():
+    samples = [
+        (1, 2), ("a", "a"), ([1, 2, 3], [3, 1]), ({"a": 1}, [1]),
+        ({"a": 1, "b": 2}, {"b": 2, "a": 1}),
+        ({"a": {"b": [1, {"c": 2}]}}, {"a": {"b": [1, {"c": 3}], "d": 4}}),
+        ({"a": 1, "b": 2}, {"a": 1}),
+        ([True], [1]),
+    ]
+    for old, new in samples:
+        check_round_trip(old, new)
+
+
+def test_diff_json_is_small():
+    new = deepcopy(OLD)
+    rules = new["profiles"][1]["complex_modifications"]["rules"]
+    rules[1]["manipulators"][0]["from"]["key_code"] = "changed"
+    rules.insert(0, {"description": "new", "manipulators": []})
+    del rules[-1]
+
+    op = check_round_trip(OLD, new)
+    assert len(dumps(op)) < len(dumps(new)) / 10
+    assert diff_json(OLD, deepcopy(OLD)) == ["same"]
@@ -0,0 +1,142 @@
+from copy import deepcopy
+from json import dumps, loads
+
+import pytest
+from testing_assets import FULL_CONFIG_SAMPLE
+
+from karaml.json_patch import (
+    append_value,
+    patch_values,
+    remove_elements,
+    replace_value,
+    value_span,
+)
+from karaml.json_writer import atomic_open, write_chunks
+
+KARABINER_DICT = {
+    "global": {"check_for_updates_on_startup": True, "show_in_menu_bar": True},
+    "profiles": [
+        {
+            "name": name,
+            "complex_modifications": {
+                "parameters": {"basic.to_if_alone_timeout_milliseconds": 1000},
+                "rules": [],
+            },
+            "devices": [{"identifiers": {"vendor_id": 1452, "product_id": 1}}],
+            "selected": name == "Default",
+        }
+        for name in ["Default", "Karaml", "Gaming"]
+    ],
+}
+
+COMPLEX_MODS = {
+    "parameters": {"basic.to_if_alone_timeout_milliseconds": 100},
+    "rules": FULL_CONFIG_SAMPLE.layers,
+    "title": FULL_CONFIG_SAMPLE.title,
+}
+
+
+def test_replace_value():
+    text = dumps(KARABINER_DICT, indent=4)
+    path = ["profiles", 1, "complex_modifications"]
+    patched = "".join(replace_value(text, path, COMPLEX_MODS))
+
+    expected = deepcopy(KARABINER_DICT)
+    expected["profiles"][1]["complex_modifications"] = COMPLEX_MODS
+    assert patched == dumps(expected, indent=4)
+
+
+def test_append_value():
+    text = dumps(KARABINER_DICT, indent=4)
+    new_profile = {"name": "New", "complex_modifications": COMPLEX_MODS}
+    patched = "".join(append_value(text, ["profiles"], new_profile))
+
+    expected = deepcopy(KARABINER_DICT)
+    expected["profiles"].append(new_profile)
+    assert patched == dumps(expected, indent=4)
+
+
+def test_replace_value_keeps_other_bytes():
+    text = dumps(KARABINER_DICT, indent=4)
+    # Formatting outside the patched value is not ours to change
+    text = text.replace(dumps(KARABINER_DICT["global"], indent=4),
+                        '{ "check_for_updates_on_startup" :true,'
+                        '"show_in_menu_bar":true }')
+    path = ["profiles", 2, "complex_modifications"]
+    patched = "".join(replace_value(text, path, COMPLEX_MODS))
+
+    _, start, end = value_span(text, path)
+    assert patched.startswith(text[:start])
+    assert patched.endswith(text[end:])
+    assert loads(patched)["profiles"][2]["complex_modifications"] == \
+        loads(dumps(COMPLEX_MODS))
+
+
+def test_patch_refused():
+    minified = dumps(KARABINER_DICT)
+    path = ["profiles", 1, "complex_modifications"]
+    assert replace_value(minified, path, COMPLEX_MODS) is None
+    assert append_value(minified, ["profiles"], {}) is None
+
+    text = dumps(KARABINER_DICT, indent=4)
+    assert replace_value(text, ["profiles", 5, "rules"], {}) is None
+    assert replace_value(text, ["missing"], {}) is None
+    assert append_value(text, ["global"], {}) is None
+
+
+def test_atomic_write(tmp_path):
+    target = tmp_path / "karabiner.json"
+    target.write_text("original")
+    link = tmp_path / "link.json"
+    link.symlink_to(target)
+
+    with pytest.raises(RuntimeError):
+        with atomic_open(link) as f:
+            f.write("partial")
+            raise RuntimeError
+    assert target.read_text() == "original"
+
+    write_chunks(link, ["new ", "text"])
+    assert link.is_symlink()
+    assert target.read_text() == "new text"
+    # No temp files are left behind
+    assert {p.name for p in tmp_path.iterdir()} == {"karabiner.json",
+                                                   "link.json"}
+
+
+def test_remove_elements():
+    text = dumps(KARABINER_DICT, indent=4)
+    for indices in [{0}, {1}, {2}, {0, 2}]:
+        patched = remove_elements(text, ["profiles"], indices)
+        expected = deepcopy(KARABINER_DICT)
+        expected["profiles"] = [p for i, p in enumerate(
+            expected["profiles"]) if i not in indices]
+        assert patched == dumps(expected, indent=4)
+
+    assert remove_elements(text, ["profiles"], {0, 1, 2}) is None
+    assert remove_elements(text, ["profiles"], set()) is None
+    assert remove_elements(dumps(KARABINER_DICT), ["profiles"], {0}) is None
+
+
+def test_patch_values():
+    text = dumps(KARABINER_DICT, indent=4)
+    new_profiles = [{"name": "New"}, {"name": "Newer"}]
+    patches = [
+        ("append", ["profiles"], new_profiles[0]),
+        ("replace", ["profiles", 2, "complex_modifications"], COMPLEX_MODS),
+        ("replace", ["profiles", 0, "complex_modifications"], {}),
+        ("append", ["profiles"], new_profiles[1]),
+    ]
+    patched = "".join(patch_values(text, patches))
+
+    expected = deepcopy(KARABINER_DICT)
+    expected["profiles"][2]["complex_modifications"] = COMPLEX_MODS
+    expected["profiles"][0]["complex_modifications"] = {}
+    expected["profiles"] += new_profiles
+    assert patched == dumps(expected, indent=4)
+
+    assert patch_values(text, patches + [("replace", ["missing"], 1)]) is None
+    # Overlapping patches
+    assert patch_values(text, [("replace", ["profiles", 0], {}),
+                               ("replace", ["profiles", 0, "name"], "")]) \
+        is None
@@ -0,0 +1,137 @@
+import os
+from json import dumps
+
+import pytest
+from testing_assets import FULL_CONFIG_SAMPLE
+
+from karaml.file_writer import basic_rules_dict
+from karaml.json_writer import (
+    FRAGMENTS,
+    FragmentCache,
+    WriteAborted,
+    iter_json,
+    write_json,
+)
+from karaml.timings import Timings
+
+
+def test_iter_json_matches_dumps():
+    samples = [
+        {},
+        [],
+        "string with\nnewline and ünïcode",
+        {"empty": {}, "list": [], "nested": [[1, 2.5], (True, None)]},
+        {"int keys": {1: "a", 2: "b"}, "mixed": {"a": 1, 2: "b"}},
+        {"layer": {"description": "/base/ layer", "manipulators": [
+            {"from": {"key_code": "a"}, "to": [{"key_code": "b"}]}]}},
+    ]
+    for sample in samples:
+        assert "".join(iter_json(sample)) == dumps(sample, indent=4)
+
+
+def test_fragment_cache():
+    cache = FragmentCache()
+    conditions = [{"name": "nav", "type": "variable_if", "value": 1}]
+    layer = {"description": "/nav/ layer", "manipulators": [
+        {"conditions": conditions, "from": {"key_code": key},
+         "to": [{"key_code": "b", "repeat": flag}], "type": "basic"}
+        for key, flag in [("a", True), ("c", 1), ("d", True), ("e", [])]
+    ] + ["not a manipulator", {1: {"int": "keys"}}]}
+    rules = {"rules": [layer, layer]}
+    for level in 0, 2:
+        assert cache.encode(conditions, level) == \
+            dumps(conditions, indent=4).replace("\n", "\n" + " " * 4 * level)
+    assert "".join(iter_json(rules)) == dumps(rules, indent=4)
+    assert cache.hits == 0 and cache.misses == 2
+
+    # True and 1 encode differently, so they are separate fragments
+    hits, misses = FRAGMENTS.hits, FRAGMENTS.misses
+    assert "".join(iter_json(rules)) == dumps(rules, indent=4)
+    assert FRAGMENTS.misses == misses
+    assert FRAGMENTS.hits - hits == 2 * 3 * 4 + 2 * 1
+
+
+def test_iter_json_counts_fragments(monkeypatch):
+    timings = Timings()
+    timings.enable()
+    monkeypatch.setattr("karaml.json_writer.TIMINGS", timings)
+    monkeypatch.setattr("karaml.json_writer.FRAGMENTS", FragmentCache())
+    "".join(iter_json(basic_rules_dict(FULL_CONFIG_SAMPLE)))
+    hits = timings.counters["json_fragment_hits"]
+    misses = timings.counters["json_fragment_misses"]
+    assert hits and misses
+    assert timings.hit_rates() == {"json_fragment": hits / (hits + misses)}
+    assert "json_fragment_hit_rate" in timings.summary()
+
+
+def test_write_json(tmp_path):
+    complex_mods = basic_rules_dict(FULL_CONFIG_SAMPLE)
+    karabiner_json = {
+        "global": {"check_for_updates_on_startup": True},
+        "profiles": [
+            {"name": "Default", "complex_modifications": {"rules": []}},
+            {"name": "Karaml", "complex_modifications": {
+                "parameters": {"basic.to_if_alone_timeout_milliseconds": 100},
+                "rules": FULL_CONFIG_SAMPLE.layers,
+            }, "devices": [{"identifiers": {"vendor_id": 1452}}]},
+        ],
+    }
+    for data in complex_mods, karabiner_json:
+        json_file = tmp_path / "out.json"
+        write_json(json_file, data)
+        assert json_file.read_text() == dumps(data, indent=4)
+
+
+def test_write_json_skips_unchanged(tmp_path):
+    complex_mods = basic_rules_dict(FULL_CONFIG_SAMPLE)
+    json_file = tmp_path / "out.json"
+    assert write_json(json_file, complex_mods)
+    mtime = json_file.stat().st_mtime_ns
+
+    replaced = []
+    assert not write_json(json_file, complex_mods,
+                          lambda: replaced.append(True))
+    assert json_file.stat().st_mtime_ns == mtime
+    assert not replaced
+    assert {p.name for p in tmp_path.iterdir()} == {"out.json"}
+
+    complex_mods = {**complex_mods, "title": "Changed"}
+    assert write_json(json_file, complex_mods, lambda: replaced.append(True))
+    assert replaced == [True]
+    assert json_file.read_text() == dumps(complex_mods, indent=4)
+
+
+def test_write_json_aborted(tmp_path):
+    json_file = tmp_path / "out.json"
+    json_file.write_text("original")
+
+    def decline():
+        raise WriteAborted
+
+    with pytest.raises(WriteAborted):
+        write_json(json_file, {"title": "new"}, decline)
+    assert json_file.read_text() == "original"
+    assert {p.name for p in tmp_path.iterdir()} == {"out.json"}
+
+
+def test_write_json_refuses_non_regular_files(tmp_path):
+    folder = tmp_path / "out.json"
+    folder.mkdir()
+    with pytest.raises(OSError, match="Not a regular file"):
+        write_json(folder, {"title": "new"})
+    assert folder.is_dir()
+    assert {p.name for p in tmp_path.iterdir()} == {"out.json"}
+
+
+def test_write_json_file_mode(tmp_path):
+    umask = os.umask(0o027)
+    try:
+        json_file = tmp_path / "new.json"
+        write_json(json_file, {"title": "new"})
+        assert json_file.stat().st_mode & 0o777 == 0o640
+
+        json_file.chmod(0o604)
+        write_json(json_file, {"title": "changed"})
+        assert json_file.stat().st_mode & 0o777 == 0o604
+    finally:
+        os.umask(umask)
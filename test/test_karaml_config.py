@@ -1,25 +1,28 @@
 import re
 
 import pytest
+import yaml
 from testing_assets import (
+    AUTO_TOGGLE_CONFIG_PATH,
     AUTO_TOGGLE_CONFIG_SAMPLE,
     FULL_CONFIG_SAMPLE,
+    HOLD_FLAVOR,
     MIN_CONFIG_SAMPLE,
 )
 
 import karaml.karaml_config as kc
+from karaml.compile_context import CompileContext
 from karaml.karaml_config import get_app_conditions_dict
 
 
 def test_load_karaml_config():
     yaml_data = MIN_CONFIG_SAMPLE.yaml_data
 
+    # The layers are handed to the layer stream rather than kept
     assert isinstance(yaml_data, dict)
-    assert yaml_data == {
-        "/base/": {
-            "caps_lock": ["escape", "/nav/", None, None, None],
-        }
-    }
+    assert yaml_data == {}
+    assert MIN_CONFIG_SAMPLE.layer_stream.rule_counts == {"/base/": 1}
+    assert MIN_CONFIG_SAMPLE.layer_stream.pending == {}
 
 
 def test_get_profile_name():
@@ -65,6 +68,21 @@ def test_get_params():
         assert isinstance(value, int)
 
 
+def test_get_profiles():
+    assert FULL_CONFIG_SAMPLE.profiles == []
+    get_profiles = FULL_CONFIG_SAMPLE.get_profiles
+    assert get_profiles({"profiles": [
+        "Laptop", {"name": "External", "parameters": {"a": 150}}]}) == [
+        {"name": "Laptop", "params": {}},
+        {"name": "External", "params": {"parameters": {
+            "basic.to_if_alone_timeout_milliseconds": 150}}},
+    ]
+    for invalid in ["Laptop", [{"parameters": {}}], [{"name": "a", "b": 1}],
+                    ["Laptop", {"name": "Laptop", "parameters": {"a": 1}}]]:
+        with pytest.raises(SystemExit):
+            get_profiles({"profiles": invalid})
+
+
 def test_get_json_rules_list():
     min_json = MIN_CONFIG_SAMPLE.json_rules_list
     full_json = FULL_CONFIG_SAMPLE.json_rules_list
@@ -110,7 +128,8 @@ def count_rules_in_yaml_config(layer):
 
 def test_insert_toggle_off():
 
-    yaml_data = AUTO_TOGGLE_CONFIG_SAMPLE.yaml_data
+    with open(AUTO_TOGGLE_CONFIG_PATH) as f:
+        yaml_data = yaml.safe_load(f)
     # Auto toggle config has one map in the base layer:
     # /base/:
     #   escape: /nav/
@@ -121,6 +140,7 @@ def test_insert_toggle_off():
 
     written_rule_count = count_rules_in_yaml_config(yaml_data)
     assert written_rule_count == 1
+    assert AUTO_TOGGLE_CONFIG_SAMPLE.rule_count == 1
 
     # The rule count in self.layers should be two, since the toggle-off rule
     # should be added automatically
@@ -197,3 +217,88 @@ def test_parse_layer_key():
         with pytest.raises(SystemExit) as pytest_wrapped_e:
             kc.parse_layer_key(layer_key)
         assert pytest_wrapped_e.type == SystemExit
+
+
+def test_layer_stream_frees_translated_maps():
+    with CompileContext().activate():
+        stream = kc.LayerStream(HOLD_FLAVOR)
+        stream.add("/base/", {"a": "b", "c": "d"})
+        stream.add("/nav/", {"h": "notakey"})
+        stream.add("title", "Title")
+        # The translated layer's maps are freed, the failed one's are kept
+        assert stream.pending == {"/nav/": {"h": "notakey"}}
+        assert stream.rule_count == 3
+
+        # The dropped translations need the maps loaded again
+        stream.add("aliases", {"notakey": "left_arrow"})
+        assert stream.needs_reload and stream.translations == {}
+        stream.reload("/base/", {"a": "b", "c": "d"})
+        stream.reload("/nav/", {"h": "notakey"})
+        stream.reload("title", "Title")
+        layers = stream.finish()
+    assert [layer["description"] for layer in layers] == [
+        "/base/ layer", "/nav/ layer"]
+    assert stream.pending == {}
+
+
+def test_parallel_gen_layers(tmp_path):
+    config_file = tmp_path / "karaml.yaml"
+    config_file.write_text(
+        "templates:\n"
+        "  rect: open -g \"rectangle-pro://execute-action?name=%s\"\n"
+        "aliases:\n"
+        "  ✦: c o s\n"
+        "  saver: shell(open -b com.apple.ScreenSaver.Engine)\n"
+        "/base/:\n"
+        "  ✦ | enter: saver\n"
+        "  caps_lock: [escape, /nav/]\n"
+        "/nav/:\n"
+        "  h: left_arrow\n"
+        "  m: rect(maximize)\n"
+        "/sys/:\n"
+        "  <✦-s>: string(ok)\n"
+    )
+    serial_config = kc.KaramlConfig(str(config_file), HOLD_FLAVOR)
+    # Worker processes must apply the user aliases and templates themselves
+    parallel_config = kc.KaramlConfig(str(config_file), HOLD_FLAVOR, jobs=2)
+    assert len(parallel_config.layers) == 3
+    assert parallel_config.layers == serial_config.layers
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_layer_stream(tmp_path, capsys, jobs):
+    sections = (
+        "templates:\n"
+        "  rect: open -g \"rectangle-pro://execute-action?name=%s\"\n"
+        "aliases:\n"
+        "  ✦: c o s\n"
+    )
+    layers = (
+        "/base/:\n"
+        "  caps_lock: [escape, /nav/]\n"
+        "/nav/:\n"
+        "  h: left_arrow\n"
+        "  m: rect(maximize)\n"
+        "  <✦-s>: string(ok)\n"
+    )
+    first = tmp_path / "first.yaml"
+    first.write_text(sections + layers)
+    # The layers translated before the sections are translated again
+    last = tmp_path / "last.yaml"
+    last.write_text(layers + sections)
+    first_config = kc.KaramlConfig(str(first), HOLD_FLAVOR, jobs=jobs)
+    last_config = kc.KaramlConfig(str(last), HOLD_FLAVOR, jobs=jobs)
+    assert first_config.layers == last_config.layers
+    assert len(first_config.layers) == 2
+    assert first_config.rule_count == last_config.rule_count == 4
+    # Only the layers translated before the sections are loaded again
+    assert not first_config.layer_stream.needs_reload
+    assert last_config.layer_stream.needs_reload or jobs > 1
+
+    # A layer that fails to translate is reported once, after loading
+    invalid = tmp_path / "invalid.yaml"
+    invalid.write_text(sections + layers + "/sys/:\n  a: notakey\n")
+    capsys.readouterr()
+    with pytest.raises(SystemExit):
+        kc.KaramlConfig(str(invalid), HOLD_FLAVOR, jobs=jobs)
+    assert capsys.readouterr().out.count("Error in config file") == 1
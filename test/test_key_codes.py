@@ -0,0 +1,62 @@
+from karaml.key_codes import (
+    ALIASES,
+    CONSUMER_KEY_CODE,
+    KEY_CODE,
+    KEY_CODE_REF_LISTS,
+    KEY_REGISTRY,
+    MODIFIER_ALIASES,
+    POINTING_BUTTON,
+    Alias,
+)
+
+
+def test_registry_indexes_every_name():
+    for key_type, ref in KEY_CODE_REF_LISTS:
+        for name in ref:
+            assert KEY_REGISTRY.get(name)
+
+    for name in MODIFIER_ALIASES:
+        assert KEY_REGISTRY.is_modifier_alias(name)
+
+    assert not KEY_REGISTRY.get("not_a_key_code")
+
+
+def test_registry_key_type_precedence():
+    # The first list in KEY_CODE_REF_LISTS that contains a name wins
+    for name in KEY_CODE:
+        assert KEY_REGISTRY.get(name).key_type == "key_code"
+    for name in CONSUMER_KEY_CODE:
+        if name not in KEY_CODE:
+            assert KEY_REGISTRY.get(name).key_type == "consumer_key_code"
+    assert KEY_REGISTRY.get("menu").key_type == "key_code"
+    for name in POINTING_BUTTON:
+        assert KEY_REGISTRY.get(name).key_type == "pointing_button"
+
+    # Aliases are resolved before key codes
+    for name, alias in ALIASES.items():
+        assert KEY_REGISTRY.get(name).alias == alias
+
+
+def test_registry_valid_key_codes():
+    assert KEY_REGISTRY.is_valid_key_code("escape")
+    assert KEY_REGISTRY.is_valid_key_code("button1")
+    assert KEY_REGISTRY.is_valid_key_code("al_terminal_lock_or_screensaver")
+    assert KEY_REGISTRY.is_valid_key_code("⌘")
+    # Plain aliases are not key codes
+    assert not KEY_REGISTRY.is_valid_key_code("esc")
+
+
+def test_registry_incremental_updates():
+    registry = KEY_REGISTRY.copy()
+    registry.add_alias("registry_test_alias", Alias("escape", None))
+    assert registry.aliases["registry_test_alias"] == Alias("escape", None)
+    assert registry.get("registry_test_alias").alias.key_code == "escape"
+
+    registry.add_modifier_alias("registry_test_mods", "cs")
+    assert registry.modifier_aliases["registry_test_mods"] == "cs"
+    assert registry.is_modifier_alias("registry_test_mods")
+
+    # The built-in registry and aliases are left as they are
+    assert "registry_test_alias" not in ALIASES
+    assert "registry_test_mods" not in MODIFIER_ALIASES
+    assert not KEY_REGISTRY.get("registry_test_alias")
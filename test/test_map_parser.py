@@ -0,0 +1,116 @@
+import random
+import re
+from time import perf_counter
+
+from testing_assets import KEYCODE_COMBINATIONS
+
+from karaml.map_parser import (
+    ModifiedKey,
+    TemplateCall,
+    parse_key,
+    parse_map,
+    parse_modifier_groups,
+    scan_layer,
+    scan_modded,
+    scan_string_args,
+    scan_template,
+)
+
+# The regexes karaml used before the hand-written parser. The parser must
+# read every string the same way.
+
+
+def regex_layer(text):
+    query = re.search("^/([^/]+)/$", text)
+    return query.group(1) if query else None
+
+
+def regex_template(text):
+    query = re.search(r"^([^(]*)\((.+)\)$", text)
+    return TemplateCall(*query.groups()) if query else None
+
+
+def regex_string_args(text):
+    query = re.search(r"string\((.*)\)", text)
+    return query.group(1) if query else None
+
+
+def regex_modded(text):
+    text = text.strip()
+    query = (re.search(r"<?([^|>-]+)[|-]([^>]+)>?", text) or
+             re.search(r"(.*)\s+([^\s]+)$", text))
+    if not query:
+        return None
+    modifiers, key = query.groups()
+    return ModifiedKey(modifiers.replace(" ", ""), key.strip())
+
+
+def regex_modifier_groups(text):
+    in_parens = re.findall(r"\((.*?)\)", text)
+    not_in_parens = re.findall(r"[\w+]+(?![^()]*\))", text)
+    split = bool(re.search("\\w+\\(\\w+\\)\\w+", text))
+    mandatory = not_in_parens[0] if not_in_parens else None
+    return mandatory, tuple(in_parens), split
+
+
+def random_strings(alphabet, count, seed=0):
+    rng = random.Random(seed)
+    for _ in range(count):
+        yield "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 12)))
+
+
+def test_parser_matches_regexes():
+    alphabet = ["a", "b", "s", "_", "<", ">", "-", "|", " ", "\n", "(", ")",
+                "/", "+", "string("]
+    samples = list(random_strings(alphabet, 20000)) + KEYCODE_COMBINATIONS
+    for text in samples:
+        assert scan_layer(text) == regex_layer(text), text
+        assert scan_template(text) == regex_template(text), text
+        assert scan_string_args(text) == regex_string_args(text), text
+        assert scan_modded(text) == regex_modded(text), text
+        assert tuple(parse_modifier_groups(text)) == \
+            regex_modifier_groups(text), text
+
+
+def test_parse_map():
+    single = parse_map("<o-s>")
+    assert not single.simultaneous
+    assert single.keys[0].modded == ModifiedKey("o", "s")
+
+    multi = parse_map("j + app(Terminal) + /nav/")
+    assert multi.simultaneous
+    assert [key.text for key in multi.keys] == ["j", "app(Terminal)", "/nav/"]
+    assert multi.keys[1].template == TemplateCall("app", "Terminal")
+    assert multi.keys[2].layer == "nav"
+
+    string_key = parse_key("string(hello)")
+    assert string_key.string_args == "hello"
+
+
+def test_parse_modifier_groups():
+    assert parse_modifier_groups("co(ms)") == ("co", ("ms",), False)
+    assert parse_modifier_groups("(c)oms") == ("oms", ("c",), False)
+    assert parse_modifier_groups("c(o)s").split
+    assert len(parse_modifier_groups("c(o)(m)s").optional_sets) == 2
+
+
+def test_scans_are_linear():
+    # Long keys without a delimiter made the old regexes backtrack
+    # quadratically, so 8x the input took ~64x the time
+    adversarial = [
+        lambda n: "a" * n,
+        lambda n: "x" * n + "\ny z",
+        lambda n: "<" * n,
+        lambda n: "(" * n,
+    ]
+
+    def parse_time(text):
+        start = perf_counter()
+        parse_key(text)
+        parse_modifier_groups(text)
+        return perf_counter() - start
+
+    for make_text in adversarial:
+        small = min(parse_time(make_text(5000)) for _ in range(3))
+        large = min(parse_time(make_text(40000)) for _ in range(3))
+        assert large < max(small, 1e-4) * 30
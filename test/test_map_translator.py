@@ -7,6 +7,7 @@ from testing_assets import KEYCODE_COMBINATIONS
 
 import karaml.helpers as helpers
 import karaml.map_translator as mp
+from karaml.compile_context import CompileContext, current_context
 from karaml.key_codes import ALIASES, KEY_CODE, MODIFIERS
 from karaml.map_translator import KeyStruct, ModifiedKey, TranslatedMap
 
@@ -212,9 +213,18 @@ def test_resolve_alias():
                 "mandatory": ["left_control", "shift"],
                 "optional": ["fn"]
             }
+        elif alias_named_tuple.modifiers:
+            # Multi-mod aliases, e.g. hyper
+            assert valid_alias.modifiers == {
+                "mandatory": ["left_control", *alias_named_tuple.modifiers],
+                "optional": ["fn"]
+            }
         else:
             assert valid_alias.modifiers == mod_dict
 
+        # The user's modifiers dict is not mutated
+        assert mod_dict == {"mandatory": ["left_control"], "optional": ["fn"]}
+
 
 def test_is_valid_keycode():
 
@@ -297,6 +307,41 @@ def test_queue_translations():
     assert len(mp.queue_translations(simul.map)) == 2
 
 
+def test_memoized_translations_are_not_shared():
+    mp.clear_translation_cache()
+    first = mp.queue_translations("<c-(>")
+    first[0].modifiers["mandatory"].append("fn")
+
+    second = mp.queue_translations("<c-(>")
+    assert list(current_context().translations) == ["<c-(>"]
+    assert second[0].modifiers == {"mandatory": ["left_control", "shift"]}
+    # The alias's own modifier list is untouched
+    assert ALIASES["("].modifiers == ["shift"]
+
+
+def test_translation_cache_drops_least_recently_used(monkeypatch):
+    monkeypatch.setattr(mp, "TRANSLATION_CACHE_SIZE", 2)
+    with CompileContext().activate() as context:
+        mp.queue_translations("j")
+        mp.queue_translations("k")
+        mp.queue_translations("j")
+        mp.queue_translations("l")
+        assert list(context.translations) == ["j", "l"]
+
+
+def test_translation_cache_cleared_by_user_aliases():
+    from karaml.user_aliases import update_user_aliases
+
+    with CompileContext().activate() as context:
+        mp.queue_translations("j")
+        assert len(context.translations) == 1
+
+        update_user_aliases({"aliases": {"memo_alias": "<c-j>"}})
+        assert len(context.translations) == 0
+        assert mp.queue_translations("memo_alias")[0].key_code == "j"
+    assert not current_context().keys.get("memo_alias")
+
+
 def test_get_multi_keys():
 
     for case in KEYCODE_COMBINATIONS:
@@ -0,0 +1,78 @@
+from json import dumps, loads
+
+import pytest
+
+from karaml.profiles import (
+    auto_profile_time,
+    compact_karabiner_json,
+    compact_profiles,
+    find_stale_profiles,
+)
+
+
+def auto_profile(day: int, **kwargs) -> dict:
+    return {"name": f"Karaml Profile 2023-01-{day:02}_12-00-00",
+            "complex_modifications": {"rules": [{"description": "x" * 100}]},
+            **kwargs}
+
+
+PROFILES = [
+    {"name": "Default", "selected": False},
+    auto_profile(3),
+    auto_profile(1, selected=True),
+    {"name": "Karaml Profile of mine"},
+    auto_profile(4),
+    auto_profile(2),
+]
+
+
+@pytest.fixture
+def karabiner_path(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    karabiner_path = tmp_path / ".config" / "karabiner"
+    karabiner_path.mkdir(parents=True)
+    return karabiner_path
+
+
+def test_auto_profile_time():
+    assert auto_profile_time(PROFILES[1]) == "2023-01-03_12-00-00"
+    assert auto_profile_time(PROFILES[3]) is None
+    assert auto_profile_time({}) is None
+
+
+def test_find_stale_profiles():
+    # The selected profile is kept however old it is
+    assert find_stale_profiles(PROFILES, 1) == {1, 5}
+    assert find_stale_profiles(PROFILES, 2) == {5}
+    assert find_stale_profiles(PROFILES, 0) == {1, 4, 5}
+    assert find_stale_profiles(PROFILES, 10) == set()
+
+
+def test_compact_profiles():
+    karabiner_dict = {"profiles": PROFILES}
+    text = dumps(karabiner_dict, indent=4)
+    compacted, removed, bytes_saved = compact_profiles(
+        text, karabiner_dict, 1)
+
+    assert removed == [PROFILES[1]["name"], PROFILES[5]["name"]]
+    assert compacted == dumps(karabiner_dict, indent=4)
+    assert [p["name"] for p in karabiner_dict["profiles"]] == [
+        p["name"] for i, p in enumerate(PROFILES) if i not in (1, 5)]
+    assert len(text) - len(compacted) == bytes_saved
+
+
+def test_compact_karabiner_json(karabiner_path):
+    karabiner_json = karabiner_path / "karabiner.json"
+    text = dumps({"profiles": PROFILES}, indent=4)
+    karabiner_json.write_text(text)
+
+    assert compact_karabiner_json(karabiner_path, 1, dry_run=True)
+    assert karabiner_json.read_text() == text
+
+    assert compact_karabiner_json(karabiner_path, 1)
+    assert len(loads(karabiner_json.read_text())["profiles"]) == 4
+    backups = list((karabiner_path / "automatic_backups").glob("*.backup.*"))
+    assert [b.read_text() for b in backups] == [text]
+
+    karabiner_json.unlink()
+    assert not compact_karabiner_json(karabiner_path, 1)
@@ -0,0 +1,95 @@
+from copy import copy
+from json import dumps, loads
+
+from testing_assets import FULL_CONFIG_SAMPLE
+
+from karaml.shards import (
+    confirm_foreign_shards,
+    index_file_name,
+    layer_slug,
+    load_shard_index,
+    shard_file_names,
+    write_shards,
+)
+
+
+def config_with_layers(layers: list) -> object:
+    karaml_config = copy(FULL_CONFIG_SAMPLE)
+    karaml_config.layers = layers
+    return karaml_config
+
+
+def test_layer_slug():
+    assert layer_slug("/nav/ layer") == "nav-layer"
+    assert layer_slug("Mouse keys (hold  space)") == "mouse-keys-hold-space"
+    assert layer_slug("/!/") == "layer"
+    assert len(layer_slug("x" * 100)) == 60
+
+
+def test_shard_file_names():
+    layers = [{"description": d} for d in ["/a/ layer", "/b/", "/a/ layer"]]
+    assert shard_file_names("mods", layers) == [
+        "mods.a-layer.json", "mods.b.json", "mods.a-layer-2.json"]
+
+
+def test_write_shards(tmp_path):
+    layers = FULL_CONFIG_SAMPLE.layers
+    karaml_config = config_with_layers(layers)
+    names = shard_file_names("mods", layers)
+
+    written, removed, unchanged = write_shards(
+        karaml_config, tmp_path, "mods")
+    assert (written, removed, unchanged) == (names, [], 0)
+    shard = loads((tmp_path / names[0]).read_text())
+    assert shard["rules"] == loads(dumps(layers[:1]))
+    assert shard["title"].startswith(FULL_CONFIG_SAMPLE.title)
+    index_file = tmp_path / index_file_name("mods")
+    assert list(load_shard_index(index_file)) == names
+
+    # Only the edited layer is written, and removed layers are deleted
+    edited = [dict(layers[0], manipulators=[])] + layers[1:-1]
+    mtime = (tmp_path / names[1]).stat().st_mtime_ns
+    written, removed, unchanged = write_shards(
+        config_with_layers(edited), tmp_path, "mods")
+    assert (written, removed, unchanged) == (
+        names[:1], names[-1:], len(names) - 2)
+    assert (tmp_path / names[1]).stat().st_mtime_ns == mtime
+    assert not (tmp_path / names[-1]).exists()
+    assert list(load_shard_index(index_file)) == names[:-1]
+
+
+def test_write_shards_confirms_foreign_files(tmp_path, monkeypatch):
+    layers = FULL_CONFIG_SAMPLE.layers[:2]
+    names = shard_file_names("mods", layers)
+    (tmp_path / names[0]).write_text("not a karaml shard")
+    karaml_config = config_with_layers(layers)
+    monkeypatch.setattr("builtins.input", lambda prompt: "N")
+
+    confirmed = confirm_foreign_shards(karaml_config, tmp_path, "mods")
+    assert confirmed == {}
+    written, removed, unchanged = write_shards(
+        karaml_config, tmp_path, "mods", confirmed=confirmed)
+    assert written == names[1:]
+    assert (tmp_path / names[0]).read_text() == "not a karaml shard"
+    index_file = tmp_path / index_file_name("mods")
+    assert list(load_shard_index(index_file)) == names[1:]
+
+
+def test_write_shards_rechecks_confirmed_files(tmp_path, monkeypatch):
+    layers = FULL_CONFIG_SAMPLE.layers[:2]
+    names = shard_file_names("mods", layers)
+    foreign = [tmp_path / name for name in names]
+    for shard_file in foreign:
+        shard_file.write_text("not a karaml shard")
+    karaml_config = config_with_layers(layers)
+    monkeypatch.setattr("builtins.input", lambda prompt: "Y")
+
+    confirmed = confirm_foreign_shards(karaml_config, tmp_path, "mods")
+    assert set(confirmed) == set(names)
+    # Changed by something else between the prompt and the lock
+    foreign[1].write_text("edited meanwhile")
+    written, _, _ = write_shards(
+        karaml_config, tmp_path, "mods", confirmed=confirmed)
+    assert written == names[:1]
+    assert foreign[1].read_text() == "edited meanwhile"
+
@@ -0,0 +1,60 @@
+import json
+
+import pytest
+from testing_assets import FULL_CONFIG_SAMPLE, HOLD_FLAVOR
+
+from karaml.karaml_config import KaramlConfig
+from karaml.timings import NO_OP_STAGE, TIMINGS, Timings, timed
+
+
+@pytest.fixture
+def timings():
+    TIMINGS.enable()
+    yield TIMINGS
+    TIMINGS.enabled = False
+    TIMINGS.reset()
+
+
+def test_disabled_timings_record_nothing():
+    timings = Timings()
+    assert timings.stage("stage") is NO_OP_STAGE
+    with timings.stage("stage"):
+        pass
+    assert not timings.stages
+
+    @timed("double")
+    def double(x):
+        return x * 2
+
+    assert double(2) == 4
+    assert not TIMINGS.stages
+
+
+def test_stages_and_calls(timings):
+    @timed("double")
+    def double(x):
+        return x * 2
+
+    with timings.stage("outer"):
+        double(1)
+        double(2)
+
+    # Stages are listed in the order they were entered
+    assert list(timings.stages) == ["outer", "double"]
+    assert timings.stages["double"][1] == 2
+    assert timings.stages["outer"][0] >= timings.stages["double"][0]
+
+
+def test_build_timings(timings, tmp_path):
+    karaml_config = KaramlConfig(FULL_CONFIG_SAMPLE.from_file, HOLD_FLAVOR)
+    for stage in ["load_karaml_config", "check_duplicate_keys", "gen_layers",
+                  "insert_toggle_off"]:
+        assert stage in timings.stages
+    # Every layer but the /JSON/ layer is translated
+    assert len(timings.layers) == len(karaml_config.layers) - 1
+
+    timings_file = tmp_path / "timings.json"
+    timings.write_json(timings_file)
+    written = json.loads(timings_file.read_text())
+    assert written["stages"]["gen_layers"]["calls"] == 1
+    assert set(written["layers"]) == set(timings.layers)
@@ -0,0 +1,51 @@
+from pathlib import Path
+
+from testing_assets import HOLD_FLAVOR, MIN_CONFIG_PATH
+
+from karaml.build_cache import BuildCache
+from karaml.watcher import rebuild
+
+
+def test_rebuild_writes_outputs():
+    written = []
+    assert rebuild(MIN_CONFIG_PATH, HOLD_FLAVOR, BuildCache(), written.append)
+    assert len(written) == 1
+    assert written[0].layers[0]["description"] == "/base/ layer"
+
+
+def test_rebuild_survives_config_errors(tmp_path):
+    config_file = tmp_path / "karaml.yaml"
+    config_file.write_text(Path(MIN_CONFIG_PATH).read_text())
+    written = []
+    cache = BuildCache()
+    assert rebuild(str(config_file), HOLD_FLAVOR, cache, written.append)
+
+    # An invalid key code exits in the main program, but the watcher should
+    # keep running and only write outputs for successful builds
+    config_file.write_text("/base/:\n  caps_lock: not_a_key_code\n")
+    assert not rebuild(str(config_file), HOLD_FLAVOR, cache, written.append)
+    assert len(written) == 1
+
+
+def test_rebuild_survives_yaml_and_file_errors(tmp_path, capsys):
+    config_file = tmp_path / "karaml.yaml"
+    written = []
+
+    # A half-typed edit
+    config_file.write_text("/base/:\n  a: [b\n")
+    assert not rebuild(str(config_file), HOLD_FLAVOR, None, written.append)
+    assert "ParserError" in capsys.readouterr().out
+
+    # The config in the middle of an editor's rename-on-save
+    config_file.unlink()
+    assert not rebuild(str(config_file), HOLD_FLAVOR, None, written.append)
+    assert "FileNotFoundError" in capsys.readouterr().out
+
+    def fail(karaml_config):
+        raise ValueError("unexpected")
+
+    config_file.write_text(Path(MIN_CONFIG_PATH).read_text())
+    assert not rebuild(str(config_file), HOLD_FLAVOR, None, fail)
+    assert "ValueError: unexpected" in capsys.readouterr().out
+    assert rebuild(str(config_file), HOLD_FLAVOR, None, written.append)
+    assert len(written) == 1
@@ -0,0 +1,57 @@
+import pytest
+import yaml
+from testing_assets import FULL_CONFIG_PATH
+
+import karaml.cfg
+from karaml.helpers import PyUniqueKeyLoader, UniqueKeyLoader
+from karaml.yaml_stream import iter_top_level
+
+LOADERS = [PyUniqueKeyLoader, UniqueKeyLoader]
+
+
+def stream(text: str, loader) -> tuple[list[tuple], list]:
+    yaml_loader = loader(text)
+    try:
+        items = list(iter_top_level(yaml_loader))
+    finally:
+        yaml_loader.dispose()
+    return items, yaml_loader.duplicates
+
+
+@pytest.mark.parametrize("loader", LOADERS)
+def test_iter_top_level(loader):
+    with open(FULL_CONFIG_PATH) as f:
+        text = f.read()
+    items, duplicates = stream(text, loader)
+    assert items == list(yaml.load(text, Loader=yaml.SafeLoader).items())
+    assert duplicates == []
+
+    # Anchors are shared between the top-level items
+    items, _ = stream("/a/: &maps {h: left_arrow}\n/b/: *maps\n", loader)
+    assert items == [("/a/", {"h": "left_arrow"}),
+                     ("/b/", {"h": "left_arrow"})]
+
+    assert stream("", loader) == ([], [])
+
+
+@pytest.mark.parametrize("loader", LOADERS)
+def test_iter_top_level_duplicates(loader, monkeypatch):
+    text = "/base/:\n  a: b\n  a: c\ntitle: x\n/base/:\n  a: d\n"
+    items, duplicates = stream(text, loader)
+    assert items == [("/base/", {"a": "c"}), ("title", "x"),
+                     ("/base/", {"a": "d"})]
+    assert sorted((d.key, d.first_mark.line, d.mark.line)
+                  for d in duplicates) == [("/base/", 0, 4), ("a", 1, 2)]
+
+    monkeypatch.setattr(karaml.cfg, "ON_DUPLICATE", "first")
+    items, duplicates = stream(text, loader)
+    assert items == [("/base/", {"a": "b"}), ("title", "x")]
+    assert len(duplicates) == 2
+
+
+@pytest.mark.parametrize("loader", LOADERS)
+def test_iter_top_level_invalid(loader):
+    with pytest.raises(SystemExit):
+        stream("- /base/\n- /nav/\n", loader)
+    with pytest.raises(yaml.composer.ComposerError):
+        stream("/base/: {}\n---\n/nav/: {}\n", loader)